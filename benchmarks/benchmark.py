@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+'''
+Benchmarks of geostatsmodels on synthetic data sets
+
+    python benchmarks/benchmark.py [--full] [--output results.json]
+                                   [--only krige,sgs] [--repeat 3]
+                                   [--compare baseline.json]
+
+Each case is timed as the best of (repeat) runs, and run once
+more under tracemalloc for its peak memory.  The results are
+written as JSON, one record per case, with the throughput in
+items (data points, grid nodes, or cells) per second.  With
+(compare), cases slower than a baseline file by more than
+(threshold) are listed, and the exit status is one.
+
+The default sizes run in a minute or two; --full sweeps data
+sets of 10**2 to 10**6 points and grids of up to 10**6 nodes,
+and takes much longer.
+'''
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import datetime
+import tracemalloc
+import numpy as np
+
+# run against the checkout this script lives in
+sys.path.insert( 0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '..' ) )
+
+from geostatsmodels import kriging, model, simulation, utilities, variograms, zscoretrans
+
+# sizes of the data sets, grids, and simulations
+QUICK = { 'data': [ 10**2, 10**3, 10**4 ], 'grid': [ 10**2, 10**4 ],
+          'sgs': [ 10**2, 10**3, 10**4 ], 'global': 10**3 }
+FULL = { 'data': [ 10**2, 10**3, 10**4, 10**5, 10**6 ], 'grid': [ 10**2, 10**4, 10**6 ],
+         'sgs': [ 10**2, 10**4, 10**6 ], 'global': 10**4 }
+
+# lags of the semivariograms, for points about 10 units apart
+LAGS, TOL = np.linspace( 10, 100, 10 ), 5.0
+
+def synthetic( n, seed=0 ):
+    '''
+    Input:  (n)    number of points
+            (seed) seed of the random numbers
+    Output:        <n,3> NumPy array of points about 10 units
+                   apart, with a smooth trend plus noise
+    '''
+    rng = np.random.default_rng( seed )
+    side = 10.0 * np.sqrt( n )
+    xy = rng.uniform( 0, side, ( n, 2 ) )
+    z = np.sin( xy[:,0] / 50.0 ) + np.cos( xy[:,1] / 70.0 ) + rng.normal( 0, 0.3, n )
+    return np.c_[ xy, z ]
+
+def grid( M, data ):
+    '''
+    Input:  (M)    number of grid nodes, rounded to a square
+            (data) data set the grid should cover
+    Output:        <M,2> NumPy array of grid nodes
+    '''
+    s = int( round( np.sqrt( M ) ) )
+    side = data[:,:2].max()
+    return utilities.gridpoints( ( 0.0, 0.0 ), ( side / s, side / s ), ( s, s ) )
+
+def cases( sizes ):
+    '''
+    Input:  (sizes) QUICK or FULL
+    Output:         generator of ( name, params, items, fct ), where
+                    (fct) runs the case once; the data for each
+                    case are made only when it comes up
+    '''
+    covfct = model.covariance( model.spherical, ( 60.0, 1.0 ) )
+    for n in sizes['data']:
+        data = synthetic( n )
+        for M in sizes['grid']:
+            points = grid( M, data )
+            for method in [ 'simple', 'ordinary' ]:
+                for N in [ 0, 8 ]:
+                    # the global system is O(n**3) to factor
+                    if N == 0 and n > sizes['global']:
+                        continue
+                    params = { 'n': n, 'M': len( points ), 'method': method, 'N': N }
+                    yield ( 'krige', params, len( points ),
+                            lambda d=data, p=points, m=method, N=N:
+                                kriging.krige( d, covfct, p, m, N ) )
+        params = { 'n': n }
+        yield ( 'semivariogram', params, n,
+                lambda d=data: variograms.semivariogram( d, LAGS, TOL ) )
+        yield ( 'fitmodel', params, n,
+                lambda d=data: model.fitmodel( d, model.spherical, LAGS, TOL ) )
+        yield ( 'to_norm', params, n, lambda d=data: zscoretrans.to_norm( d ) )
+        z, inv = zscoretrans.to_norm( data[:,2] )
+        yield ( 'from_norm', params, n, lambda z=z, inv=inv: zscoretrans.from_norm( z, inv ) )
+    # simulate from a fixed set of normal scores
+    data = zscoretrans.to_norm( synthetic( 1000 ) )[0]
+    for cells in sizes['sgs']:
+        s = int( round( np.sqrt( cells ) ) )
+        params = { 'n': len( data ), 'cells': s * s }
+        yield ( 'sgs', params, s * s,
+                lambda s=s: simulation.sgs( data, covfct, s, s, seed=0 ) )
+
+def measure( fct, repeat ):
+    '''
+    Input:  (fct)    function that runs a case once
+            (repeat) number of timed runs
+    Output:          ( best time in seconds, peak traced bytes )
+    '''
+    times = list()
+    for r in range( repeat ):
+        t = time.perf_counter()
+        fct()
+        times.append( time.perf_counter() - t )
+    # tracing slows the run down, so it is not timed
+    tracemalloc.start()
+    fct()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min( times ), peak
+
+def compare( results, baseline, threshold ):
+    '''
+    Input:  (results)   records of this run
+            (baseline)  records of an earlier run
+            (threshold) ratio of times counted as a regression
+    Output:             list of ( record, ratio ) for the cases
+                        of (results) slower than (baseline)
+    '''
+    key = lambda r: ( r['benchmark'], json.dumps( r['params'], sort_keys=True ) )
+    old = { key( r ): r for r in baseline }
+    slower = list()
+    for r in results:
+        b = old.get( key( r ) )
+        if b is not None and r['seconds'] > threshold * b['seconds']:
+            slower.append( ( r, r['seconds'] / b['seconds'] ) )
+    return slower
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser( description='Benchmarks of geostatsmodels' )
+    parser.add_argument( '--full', action='store_true',
+                         help='sweep up to 10**6 points and grid nodes' )
+    parser.add_argument( '--output', default='benchmark.json',
+                         help='JSON file for the results' )
+    parser.add_argument( '--only', default=None,
+                         help='comma separated names of the benchmarks to run' )
+    parser.add_argument( '--repeat', type=int, default=3,
+                         help='number of timed runs of each case' )
+    parser.add_argument( '--compare', default=None,
+                         help='JSON file of an earlier run to compare against' )
+    parser.add_argument( '--threshold', type=float, default=1.25,
+                         help='slowdown counted as a regression' )
+    args = parser.parse_args( argv )
+    only = set( args.only.split( ',' ) ) if args.only else None
+    results = list()
+    for name, params, items, fct in cases( FULL if args.full else QUICK ):
+        if only is not None and name not in only:
+            continue
+        # the largest cases are too slow to repeat
+        repeat = args.repeat if items <= 10**5 else 1
+        with np.errstate( invalid='ignore' ):
+            seconds, peak = measure( fct, repeat )
+        record = { 'benchmark': name, 'params': params, 'items': items,
+                   'seconds': seconds, 'throughput': items / seconds,
+                   'peak_bytes': peak }
+        results.append( record )
+        print( '{:<14} {:<55} {:>10.4f} s {:>12.0f} /s {:>8.1f} MB'.format(
+               name, json.dumps( params ), seconds, items / seconds, peak / 2.0**20 ) )
+    meta = { 'date': datetime.datetime.now().isoformat(),
+             'python': platform.python_version(),
+             'numpy': np.__version__,
+             'platform': platform.platform(),
+             'processor': platform.processor(),
+             'cpus': os.cpu_count(),
+             'full': args.full }
+    with open( args.output, 'w' ) as f:
+        json.dump( { 'meta': meta, 'results': results }, f, indent=1 )
+    if args.compare:
+        with open( args.compare ) as f:
+            baseline = json.load( f )['results']
+        slower = compare( results, baseline, args.threshold )
+        for r, ratio in slower:
+            print( 'slower: {} {} x{:.2f}'.format( r['benchmark'], json.dumps( r['params'] ), ratio ) )
+        return 1 if slower else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -17,7 +17,8 @@ def hscattergram(data, pwdist, lag, tol):
                       of interest
             (lag)     the lagged distance of interest
             (tol)     the allowable tolerance about (lag)
-            (pwdist)  a square pairwise distance matrix
+            (pwdist)  a square pairwise distance matrix, or the
+                      pair list of utilities.pairlist()
     Output:           h-scattergram figure showing the distribution of
                       measurements taken at a certain lag and tolerance
     '''
@@ -140,12 +141,12 @@ def polaranisotropy(data, pwdist, lags, tol, nsectors):
     cnorm = colors.Normalize(vmin=0, vmax=1)
     scalarmap = cm.ScalarMappable(norm=cnorm, cmap=cm.jet)
 
-    for sector in sectors:
-        for lag in lags:
+    # semivariance in every sector at every lag
+    svs = variograms.directional(data, lags, tol, sectors, atol)
+
+    for sector, row in zip(sectors, svs):
+        for lag, sv in zip(lags, row):
 
-            anisodata = (data, pwdist, lag, tol, sector, atol)
-            indices = variograms.anilagindices(*anisodata)
-            sv = variograms.semivariance(data, indices)
             fc = scalarmap.to_rgba(sv)
 
             center, r, width = (0, 0), lag, lags[0] * 2
@@ -1,9 +1,24 @@
 #!/usr/bin/env python
+import os
+import re
+import json
+import hashlib
+import itertools
+import multiprocessing
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import scipy.linalg
 from scipy.spatial.distance import cdist
-from geostatsmodels.utilities import pairwise
+from geostatsmodels.utilities import pairwise, gridpoints
+from geostatsmodels.neighbors import NeighborIndex
+from geostatsmodels.profiling import Stats, stage
 
-def kmatrices( data, covfct, u, N=0 ):
+# number of matrix elements kriged together in one batch
+_BATCH_ELEMENTS = 2**22
+
+def kmatrices( data, covfct, u, N=0, index=None, stats=None, ndim=2 ):
     '''
     Input  (data)  ndarray, data
            (model) modeling function
@@ -13,23 +28,35 @@ def kmatrices( data, covfct, u, N=0 ):
            (u)     unsampled point
            (N)     number of neighboring points
                    to consider, if zero use all
+           (index) neighbors.NeighborIndex built on (data),
+                   used to find the N closest points
+           (stats) profiling.Stats to record the time spent in
+                   each stage, or None
+           (ndim)  number of spatial coordinates, 2 or 3; the
+                   variable is the column after them
     '''
-    # u needs to be two dimensional for cdist()
-    if np.ndim( u ) == 1:
-        u = [u]
-    # distance between u and each data point in P
-    d = cdist( data[:,:2], u )
-    # add these distances to P
-    P = np.hstack(( data, d ))
-    # if N>0, take the N closest points,
-    if N > 0:
-        P = P[d[:,0].argsort()[:N]]
+    with stage( stats, 'search' ):
+        # if N>0 and there is an index, ask it for the N closest points
+        if N > 0 and index is not None:
+            d, idx = index.nearest( np.ravel( u ), N )
+            P = np.hstack(( data[idx], d[:,None] ))
+        else:
+            # u needs to be two dimensional for cdist()
+            if np.ndim( u ) == 1:
+                u = [u]
+            # distance between u and each data point in P
+            d = cdist( data[:,:ndim], u )
+            # add these distances to P
+            P = np.hstack(( data, d ))
+            # if N>0, take the N closest points,
+            if N > 0:
+                P = P[d[:,0].argsort()[:N]]
     # otherwise, use all of the points
-    else:
-        N = len( P )
+    N = len( P )
 
     # apply the covariance model to the distances
-    k = covfct( P[:,3] )
+    with stage( stats, 'covariance' ):
+        k = covfct( P[:,-1] )
     # check for nan values in k
     if np.any( np.isnan( k ) ):
         raise ValueError('The vector of covariances, k, contains NaN values')
@@ -37,9 +64,11 @@ def kmatrices( data, covfct, u, N=0 ):
     k = np.matrix( k ).T
 
     # form a matrix of distances between existing data points
-    K = pairwise( P[:,:2] )
+    with stage( stats, 'assembly' ):
+        K = pairwise( P, ndim=ndim )
     # apply the covariance model to these distances
-    K = covfct( K.ravel() )
+    with stage( stats, 'covariance' ):
+        K = covfct( K.ravel() )
     # check for nan values in K
     if np.any( np.isnan( K ) ):
         raise ValueError('The matrix of covariances, K, contains NaN values')
@@ -52,44 +81,56 @@ def kmatrices( data, covfct, u, N=0 ):
 
     return K, k, P
 
-def simple( data, covfct, u, N=0, nugget=0 ):
-    
+def simple( data, covfct, u, N=0, nugget=0, index=None, factor=None, stats=None,
+            ndim=2 ):
+
+    # with all of the points, reuse the factorization of K
+    if N == 0 and factor is not None:
+        return _factored( factor, 'simple', u, nugget, stats )
+
     # calculate the matrices K, and k
-    K, k, P = kmatrices( data, covfct, u, N )
+    K, k, P = kmatrices( data, covfct, u, N, index, stats, ndim )
+    if stats is not None:
+        stats.systems( K )
 
     # calculate the kriging weights
-    weights = np.linalg.inv( K ) * k
-    weights = np.array( weights )
+    with stage( stats, 'solve' ):
+        weights = np.linalg.inv( K ) * k
+        weights = np.array( weights )
 
     # calculate k' * K * k for
     # the kriging variance
     kvar = k.T * weights
 
     # mean of the variable
-    mu = np.mean( data[:,2] )
+    mu = np.mean( data[:,ndim] )
     
     # calculate the residuals
-    residuals = P[:,2] - mu
+    residuals = P[:,ndim] - mu
 
     # calculate the estimation
     estimation = np.dot( weights.T, residuals ) + mu
 
     # calculate the sill and the 
     # kriging standard deviation
-    sill = np.var( data[:,2] )
-    kvar = float( sill + nugget - kvar )
+    sill = np.var( data[:,ndim] )
+    kvar = sill + nugget - kvar.item()
     kstd = np.sqrt( kvar )
 
-    return float( estimation ), kstd
+    return estimation.item(), kstd
+
+def ordinary( data, covfct, u, N=0, nugget=0, index=None, factor=None, stats=None,
+              ndim=2 ):
 
-def ordinary( data, covfct, u, N=0, nugget=0 ):
+    # with all of the points, reuse the factorization of K
+    if N == 0 and factor is not None:
+        return _factored( factor, 'ordinary', u, nugget, stats )
 
     # calculate the matrices K, and k
-    Ks, ks, P = kmatrices( data, covfct, u, N )
+    Ks, ks, P = kmatrices( data, covfct, u, N, index, stats, ndim )
 
-    # if N is not set, determine from Ks
-    if N == 0:
-        N, N = Ks.shape
+    # the number of points used, determined from Ks
+    N, N = Ks.shape
 
     # add a column and row of ones to Ks,
     # with a zero in the bottom, right hand corner
@@ -100,46 +141,1045 @@ def ordinary( data, covfct, u, N=0, nugget=0 ):
     # add a one to the end of ks
     k = np.matrix( np.ones(( N+1,1 )) )
     k[:N] = ks
+    if stats is not None:
+        stats.systems( K )
     
     # calculate the kriging weights
-    weights = np.linalg.inv( K ) * k
-    weights = np.array( weights )
+    with stage( stats, 'solve' ):
+        weights = np.linalg.inv( K ) * k
+        weights = np.array( weights )
 
     # calculate k' * K * k for
     # the kriging variance
     kvar = k.T * weights
 
     # mean of the variable
-    mu = np.mean( data[:,2] )
+    mu = np.mean( data[:,ndim] )
     
     # calculate the residuals
-    residuals = P[:,2]
+    residuals = P[:,ndim]
 
     # calculate the estimation
     estimation = np.dot( weights[:-1].T, residuals )
 
     # calculate the sill and the kriging standard deviation
-    sill = np.var( data[:,2] )
-    kvar = float( sill + nugget - kvar )
+    sill = np.var( data[:,ndim] )
+    kvar = sill + nugget - kvar.item()
     kstd = np.sqrt( kvar )
 
-    return float( estimation ), kstd
+    return estimation.item(), kstd
 
-def krige(data, covfct, grid, method='simple', N=0, nugget=0):
+def universal( data, covfct, u, N=0, nugget=0, order=1, index=None, factor=None,
+               stats=None, ndim=2 ):
     '''
-    Krige an <Nx2> array of points representing a grid.
-    
-    Use either simple or ordinary kriging, some number N
-    of neighboring points, and a nugget value.
-    '''
-    kriging_method = None
-    if method == 'simple':
-        kriging_method = simple 
-    elif method == 'ordinary':
-        kriging_method = ordinary
-    M = len(grid)
-    est = np.zeros((M, 1))
-    kstd = np.zeros((M, 1))
-    for i in range(M):
-        est[i], kstd[i] = kriging_method(data, covfct, grid[i], N, nugget)
+    Universal kriging of a single point (u), with a polynomial
+    drift of (order) one or two; see krige()
+    '''
+    est, kstd = krige( data, covfct, np.ravel( u )[None,:], 'universal', N, nugget,
+                       index=index, factor=factor, stats=stats, order=order, ndim=ndim )
+    return est[0,0], kstd[0,0]
+
+def external( data, covfct, u, N=0, nugget=0, index=None, factor=None, stats=None,
+              ndim=2 ):
+    '''
+    Kriging with external drift of a single point (u), given as
+    its coordinates followed by its drift variables; the drift
+    variables of (data) follow the variable of interest.  See
+    krige()
+    '''
+    est, kstd = krige( data, covfct, np.ravel( u )[None,:], 'external', N, nugget,
+                       index=index, factor=factor, stats=stats, ndim=ndim )
+    return est[0,0], kstd[0,0]
+
+def _vectors( coords, targets, nbrs, covfct, stats=None, offsets=None ):
+    '''
+    <B,N> stack of the covariances between each target and its
+    neighbors, see _systems(); with the <D,ndim> (offsets) of the
+    points discretizing a block, the average covariances between
+    the neighbors and the block around each target
+    '''
+    with stage( stats, 'assembly' ):
+        # coordinates of the neighbors of each target
+        X = coords[nbrs]
+        if offsets is None:
+            # distances between each target and its neighbors
+            d = np.sqrt( ( ( X - targets[:,None,:] )**2.0 ).sum( axis=-1 ) )
+        else:
+            # <B,N,D> distances to the points of each block
+            P = targets[:,None,:] + offsets[None,:,:]
+            d = np.sqrt( ( ( X[:,:,None,:] - P[:,None,:,:] )**2.0 ).sum( axis=-1 ) )
+    # apply the covariance model to these distances
+    with stage( stats, 'covariance' ):
+        k = np.asarray( covfct( d.ravel() ), dtype=float ).reshape( d.shape )
+        if offsets is not None:
+            k = k.mean( axis=-1 )
+    if np.any( np.isnan( k ) ):
+        raise ValueError('The vector of covariances, k, contains NaN values')
+    return k
+
+def _matrices( coords, nbrs, covfct, stats=None ):
+    '''
+    <B,N,N> stack of the covariances between the neighbors of
+    each target, see _systems()
+    '''
+    with stage( stats, 'assembly' ):
+        X = coords[nbrs]
+        # distances between the neighbors of each target
+        D = np.sqrt( ( ( X[:,:,None,:] - X[:,None,:,:] )**2.0 ).sum( axis=-1 ) )
+    # apply the covariance model to these distances
+    with stage( stats, 'covariance' ):
+        K = np.asarray( covfct( D.ravel() ), dtype=float ).reshape( D.shape )
+    if np.any( np.isnan( K ) ):
+        raise ValueError('The matrix of covariances, K, contains NaN values')
+    return K
+
+def _systems( coords, targets, nbrs, covfct, stats=None, offsets=None ):
+    '''
+    Input:  (coords)  <n,ndim> NumPy array of data coordinates
+            (targets) <B,ndim> NumPy array of unsampled points
+            (nbrs)    <B,N> NumPy array of neighbor indices into (coords)
+            (covfct)  covariance function
+            (stats)   profiling.Stats, or None
+            (offsets) <D,ndim> NumPy array of the points discretizing
+                      a block around each target, or None
+    Output: (K)       <B,N,N> stack of data-to-data covariance matrices
+            (k)       <B,N> stack of data-to-target covariance vectors
+    '''
+    k = _vectors( coords, targets, nbrs, covfct, stats, offsets )
+    K = _matrices( coords, nbrs, covfct, stats )
+    return K, k
+
+# kriging methods, and those with a drift other than a constant mean
+_METHODS = ( 'simple', 'ordinary', 'universal', 'external' )
+_DRIFTS = ( 'universal', 'external' )
+
+class _Drift( object ):
+    '''
+    Input:  (data)   NumPy array of data; for external drift the
+                     columns after the variable of interest hold
+                     the drift variables
+            (method) 'universal' or 'external'
+            (order)  order of the polynomial drift, 1 or 2, for
+                     universal kriging
+            (ndim)   number of spatial coordinates, 2 or 3
+    --------------------------------------------------------
+    Drift terms of universal kriging, a polynomial in x, y (and
+    z), or of kriging with external drift, a constant and the drift
+    variables.  The coordinates are centered and scaled by the
+    data once, to keep the bordered systems well conditioned,
+    and the terms at the data, (F), are worked out here once
+    rather than for each target.
+    '''
+    def __init__( self, data, method, order=1, ndim=2 ):
+        if method == 'universal' and order not in ( 1, 2 ):
+            raise ValueError('The order of the drift must be 1 or 2')
+        if method == 'external' and data.shape[1] < ndim + 2:
+            raise ValueError('External drift needs the drift variables in the columns after the data')
+        self.method = method
+        self.order = order
+        coords = data[:,:ndim]
+        self.center = coords.mean( axis=0 )
+        self.scale = max( np.ptp( coords, axis=0 ).max(), np.finfo( float ).tiny )
+        self.nvar = data.shape[1] - ndim - 1
+        # the pairs of coordinates in the quadratic terms, xx, xy, yy, ...
+        self.pairs = list( itertools.combinations_with_replacement( range( ndim ), 2 ) )
+        # cached systems depend on the terms as well as the method
+        self.key = 'universal{}'.format( order ) if method == 'universal' else method
+        self.F = self( data[:,:ndim], data[:,ndim+1:] )
+
+    def __call__( self, coords, extra ):
+        '''
+        Input:  (coords) <B,ndim> NumPy array of coordinates
+                (extra)  <B,q> NumPy array of drift variables,
+                         used for external drift
+        Output:          <B,p> NumPy array of the drift terms
+        '''
+        ones = np.ones(( len( coords ), 1 ))
+        if self.method == 'external':
+            if extra.shape[1] != self.nvar:
+                raise ValueError('The targets need {} drift variables, not {}'.format(
+                                 self.nvar, extra.shape[1] ))
+            return np.hstack(( ones, extra ))
+        x = ( coords - self.center ) / self.scale
+        if self.order == 1:
+            return np.hstack(( ones, x ))
+        xx = np.column_stack([ x[:,a] * x[:,b] for a, b in self.pairs ])
+        return np.hstack(( ones, x, xx ))
+
+class GlobalFactor( object ):
+    '''
+    Input:  (data)   NumPy array where the first (ndim) columns
+                     are the spatial coordinates, x, y (and z),
+                     and the next is the variable of interest
+            (covfct) covariance function
+            (method) 'simple', 'ordinary', 'universal', or 'external'
+            (stats)  profiling.Stats, or None
+            (order)  order of the drift of universal kriging
+            (ndim)   number of spatial coordinates, 2 or 3
+    --------------------------------------------------------
+    Factorization of the covariance matrix of the whole data
+    set, for kriging with all of the points (N=0).  K is built
+    and factored once, with a Cholesky factorization for simple
+    kriging and an LU factorization for the bordered systems of
+    the other methods, after which each target costs one
+    matrix-vector product for the estimate and one triangular
+    solve for the variance.  Pass it to kriging.krige(),
+    kriging.simple(), or kriging.ordinary() as (factor).
+    '''
+    def __init__( self, data, covfct, method='simple', stats=None, order=1, ndim=2 ):
+        if method not in _METHODS:
+            raise ValueError('Unknown kriging method: {}'.format( method ))
+        data = np.asarray( data, dtype=float )
+        self.coords, self.values = data[:,:ndim], data[:,ndim]
+        self.ndim = ndim
+        self.covfct = covfct
+        self.method = method
+        self.drift = _Drift( data, method, order, ndim ) if method in _DRIFTS else None
+        # mean and variance of the variable
+        self.mu = np.mean( self.values )
+        self.sill = np.var( self.values )
+        # form and factor the matrix of covariances
+        with stage( stats, 'assembly' ):
+            D = pairwise( self.coords, ndim=ndim )
+        with stage( stats, 'covariance' ):
+            K = np.asarray( covfct( D.ravel() ), dtype=float ).reshape( D.shape )
+        if np.any( np.isnan( K ) ):
+            raise ValueError('The matrix of covariances, K, contains NaN values')
+        if stats is not None:
+            stats.systems( K )
+        with stage( stats, 'factor' ):
+            if method != 'simple':
+                F = None if self.drift is None else self.drift.F
+                K = _border( K, None, F )[0]
+                b = np.zeros( len( K ) )
+                b[:len( self.values )] = self.values
+                self.cholesky = None
+                self.lu = scipy.linalg.lu_factor( K )
+                # K^-1 [z,0], so that an estimate is k' * K^-1 * [z,0]
+                self.alpha = scipy.linalg.lu_solve( self.lu, b )
+            else:
+                b = self.values - self.mu
+                try:
+                    self.cholesky = scipy.linalg.cholesky( K, lower=True )
+                    self.lu = None
+                    self.alpha = scipy.linalg.cho_solve( ( self.cholesky, True ), b )
+                except np.linalg.LinAlgError:
+                    # K is not positive definite, fall back to LU
+                    self.cholesky = None
+                    self.lu = scipy.linalg.lu_factor( K )
+                    self.alpha = scipy.linalg.lu_solve( self.lu, b )
+
+    def __len__( self ):
+        return len( self.coords )
+
+    def estimate( self, targets, stats=None, offsets=None ):
+        '''
+        Input:  (targets) <B,ndim> NumPy array of unsampled points,
+                          with the drift variables in further
+                          columns for external drift
+                (stats)   profiling.Stats, or None
+                (offsets) <D,ndim> NumPy array of the points that
+                          discretize a block around each target,
+                          for block kriging, or None
+        Output: (est)     <B> NumPy array of estimates
+                (kvar)    <B> NumPy array of k' * K^-1 * k
+        '''
+        targets = np.atleast_2d( np.asarray( targets, dtype=float ) )
+        B, nd = len( targets ), self.ndim
+        with stage( stats, 'assembly' ):
+            if offsets is None:
+                d = cdist( targets[:,:nd], self.coords )
+            else:
+                points = ( targets[:,None,:nd] + offsets[None,:,:] ).reshape( -1, nd )
+                d = cdist( points, self.coords )
+        with stage( stats, 'covariance' ):
+            k = np.asarray( self.covfct( d.ravel() ), dtype=float ).reshape( d.shape )
+            if offsets is not None:
+                # average over the points of each block
+                k = k.reshape( B, len( offsets ), -1 ).mean( axis=1 )
+        if np.any( np.isnan( k ) ):
+            raise ValueError('The vector of covariances, k, contains NaN values')
+        with stage( stats, 'solve' ):
+            if self.method != 'simple':
+                if self.drift is None:
+                    f = np.ones(( len( k ), 1 ))
+                elif offsets is None:
+                    f = self.drift( targets[:,:nd], targets[:,nd:] )
+                else:
+                    f = self.drift( points, targets[:0,nd:] )
+                    f = f.reshape( B, len( offsets ), -1 ).mean( axis=1 )
+                k = np.hstack(( k, f ))
+                est = k.dot( self.alpha )
+                x = scipy.linalg.lu_solve( self.lu, k.T )
+                kvar = ( x * k.T ).sum( axis=0 )
+            else:
+                est = k.dot( self.alpha ) + self.mu
+                if self.cholesky is not None:
+                    v = scipy.linalg.solve_triangular( self.cholesky, k.T, lower=True )
+                    kvar = ( v * v ).sum( axis=0 )
+                else:
+                    x = scipy.linalg.lu_solve( self.lu, k.T )
+                    kvar = ( x * k.T ).sum( axis=0 )
+        return est, kvar
+
+def _factored( factor, method, u, nugget, stats=None ):
+    '''
+    Krige a single point (u) with a GlobalFactor
+    '''
+    if factor.method != method:
+        raise ValueError('The factor was built for {} kriging'.format( factor.method ))
+    est, kvar = factor.estimate( u, stats )
+    kstd = np.sqrt( factor.sill + nugget - kvar[0] )
+    return est[0], kstd
+
+def _border( K, k, F=None, f=None ):
+    '''
+    Add the unbiasedness constraints to a stack of systems: the
+    drift terms (F) of the data around K, as [[K, F], [F', 0]],
+    and the drift terms (f) of the targets at the end of k.  By
+    default these are ones, the constant mean of ordinary
+    kriging; either K or k may be None
+    '''
+    Kb = kb = None
+    if K is not None:
+        N = K.shape[-1]
+        if F is None:
+            F = np.ones( K.shape[:-1] + ( 1, ) )
+        p = F.shape[-1]
+        Kb = np.zeros( K.shape[:-2] + ( N+p, N+p ) )
+        Kb[...,:N,:N] = K
+        Kb[...,:N,N:] = F
+        Kb[...,N:,:N] = np.swapaxes( F, -1, -2 )
+    if k is not None:
+        N = k.shape[-1]
+        if f is None:
+            f = np.ones( k.shape[:-1] + ( 1, ) )
+        kb = np.concatenate(( k, np.broadcast_to( f, k.shape[:-1] + f.shape[-1:] ) ), axis=-1 )
+    return Kb, kb
+
+class SystemCache( object ):
+    '''
+    Input:  (maxbytes) memory budget of the cached systems
+    --------------------------------------------------------
+    Least recently used cache of inverted kriging systems,
+    keyed on the method and the sorted indices of the neighbors
+    that make up a system.  Nearby nodes of a regular grid often
+    share all N of their nearest neighbors, and kriging them
+    through a cache, see krige(), inverts their common system
+    once; each node then needs only its covariance vector and
+    one matrix-vector product.  The numbers of nodes that found
+    their system already inverted, (hits), and that had to
+    invert it, (misses), are kept as attributes.
+
+    A cache holds the systems of one data set and covariance
+    function, which it is bound to when it is first used; the
+    data set is known by a digest of its coordinates, and the
+    drift of each method by a digest of its terms, so that a
+    cache is never used with systems built from other points.
+    '''
+    def __init__( self, maxbytes=2**28 ):
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._owner = None
+        self._drifts = dict()
+
+    def __len__( self ):
+        return len( self._entries )
+
+    def nbytes( self ):
+        '''
+        Output: memory held by the cached systems, in bytes
+        '''
+        return self._nbytes
+
+    def bind( self, coords, covfct, drift=None ):
+        '''
+        Tie the cache to the data coordinates (coords), (covfct),
+        and the _Drift of a method, if any, raising a ValueError
+        for any other
+        '''
+        coords = np.ascontiguousarray( coords, dtype=float )
+        owner = ( coords.shape, hashlib.sha1( coords.tobytes() ).hexdigest() )
+        if self._owner is None:
+            self._owner = ( owner, covfct )
+        elif self._owner[0] != owner or self._owner[1] is not covfct:
+            raise ValueError('The cache holds systems of another data set or covariance function')
+        if drift is not None:
+            terms = np.r_[ drift.center, drift.scale, drift.F.ravel() ]
+            digest = hashlib.sha1( np.ascontiguousarray( terms ).tobytes() ).hexdigest()
+            if self._drifts.setdefault( drift.key, digest ) != digest:
+                raise ValueError('The cache holds systems of another drift')
+
+    def get( self, method, nbrs ):
+        '''
+        Input:  (method) 'simple' or 'ordinary'
+                (nbrs)   sorted NumPy array of neighbor indices
+        Output:          the cached inverse of their system, or None
+        '''
+        key = ( method, nbrs.tobytes() )
+        inverse = self._entries.get( key )
+        if inverse is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end( key )
+        return inverse
+
+    def put( self, method, nbrs, inverse ):
+        '''
+        Cache the (inverse) of the system of (nbrs), then drop
+        the least recently used systems over the budget
+        '''
+        key = ( method, nbrs.tobytes() )
+        if key in self._entries:
+            return
+        self._entries[key] = inverse
+        self._nbytes += inverse.nbytes
+        self.evict()
+
+    def evict( self ):
+        '''
+        Drop the least recently used systems until the rest fit
+        within (maxbytes), keeping at least the newest one
+        '''
+        while self._nbytes > self.maxbytes and len( self._entries ) > 1:
+            key, old = self._entries.popitem( last=False )
+            self._nbytes -= old.nbytes
+
+    def clear( self ):
+        '''
+        Remove every system, and reset the counts
+        '''
+        self._entries.clear()
+        self._nbytes = 0
+        self.hits = self.misses = 0
+        self._owner = None
+        self._drifts.clear()
+
+def _inverses( coords, nbrs, covfct, method, cache, stats=None, drift=None ):
+    '''
+    <B,N,N> stack, or <B,N+p,N+p> for the bordered systems, of
+    the inverted systems of the rows of sorted indices (nbrs),
+    each distinct set of neighbors looked up in (cache) and only
+    the ones it is missing built and inverted, together
+    '''
+    key = method if drift is None else drift.key
+    with stage( stats, 'cache' ):
+        sets, which = np.unique( nbrs, axis=0, return_inverse=True )
+        inverses = [ cache.get( key, row ) for row in sets ]
+        # nodes sharing a set within the batch reuse its system too
+        cache.hits += len( nbrs ) - len( sets )
+        missing = [ i for i, a in enumerate( inverses ) if a is None ]
+    if missing:
+        K = _matrices( coords, sets[missing], covfct, stats )
+        if method != 'simple':
+            F = None if drift is None else drift.F[ sets[missing] ]
+            K = _border( K, None, F )[0]
+        if stats is not None:
+            stats.systems( K )
+        with stage( stats, 'solve' ):
+            K = np.linalg.inv( K )
+        for i, a in zip( missing, K ):
+            # a copy, so that an entry does not keep the whole
+            # stack alive past what the cache counts for it
+            inverses[i] = a.copy()
+            cache.put( key, sets[i], inverses[i] )
+    return np.stack( inverses )[ which.reshape( -1 ) ]
+
+def _batch( coords, values, targets, nbrs, covfct, method, nugget, mu, sill,
+            cache=None, stats=None, drift=None, f=None, offsets=None ):
+    '''
+    Input:  (coords)  <n,ndim> NumPy array of data coordinates
+            (values)  <n> NumPy array of data values
+            (targets) <B,ndim> NumPy array of unsampled points
+            (nbrs)    <B,N> NumPy array of neighbor indices into (coords)
+            (covfct)  covariance function
+            (method)  'simple', 'ordinary', 'universal', or 'external'
+            (nugget)  nugget value
+            (mu)      mean of the variable
+            (sill)    variance of the variable
+            (cache)   SystemCache of inverted systems, or None
+            (stats)   profiling.Stats, or None
+            (drift)   _Drift of the data, for universal kriging
+                      and external drift
+            (f)       <B,p> NumPy array of the drift terms of
+                      the targets
+            (offsets) <D,ndim> NumPy array of the points that
+                      discretize a block around each target,
+                      for block kriging, or None
+    Output: (est)     <B> NumPy array of estimates
+            (kstd)    <B> NumPy array of kriging standard deviations
+    --------------------------------------------------------------
+    Krige a batch of targets at once; the kriging systems are
+    stacked and handed to LAPACK in a single solve, or, with a
+    (cache), taken from it or inverted only once per distinct
+    set of neighbors
+    '''
+    if cache is not None:
+        # the order of the neighbors does not change the estimate,
+        # so sorting them makes equal sets share a system
+        nbrs = np.sort( nbrs, axis=1 )
+        k = _vectors( coords, targets, nbrs, covfct, stats, offsets )
+        kb = _border( None, k, None, f )[1] if method != 'simple' else k
+        A = _inverses( coords, nbrs, covfct, method, cache, stats, drift )
+        with stage( stats, 'solve' ):
+            x = np.einsum( 'bij,bj->bi', A, kb )
+    else:
+        K, k = _systems( coords, targets, nbrs, covfct, stats, offsets )
+        if method != 'simple':
+            F = None if drift is None else drift.F[nbrs]
+            K, kb = _border( K, k, F, f )
+        else:
+            kb = k
+        if stats is not None:
+            stats.systems( K )
+        with stage( stats, 'solve' ):
+            x = np.linalg.solve( K, kb[...,None] )[...,0]
+    V = values[nbrs]
+    if method != 'simple':
+        est = ( x[:,:V.shape[1]] * V ).sum( axis=1 )
+    else:
+        est = ( x * ( V - mu ) ).sum( axis=1 ) + mu
+    # calculate k' * K * k for the kriging variance
+    kvar = ( x * kb ).sum( axis=1 )
+    kstd = np.sqrt( sill + nugget - kvar )
+    return est, kstd
+
+def _discretize( size, disc ):
+    '''
+    Input:  (size)    ( width, height ), or ( width, length, height ),
+                      of a panel
+            (disc)    ( nx, ny ), or ( nx, ny, nz ), number of
+                      points across it
+    Output: (offsets) <nx*ny,2>, or <nx*ny*nz,3>, NumPy array of the
+                      centers of the cells of a regular grid over
+                      the panel, relative to its center
+    '''
+    axes = [ ( np.arange( n ) + 0.5 ) * s / n - 0.5 * s for s, n in zip( size, disc ) ]
+    return np.column_stack([ a.ravel() for a in np.meshgrid( *axes, indexing='ij' ) ])
+
+def _blockcov( covfct, offsets ):
+    '''
+    Average covariance between every pair of the points that
+    discretize a panel; it only depends on the shape of the
+    panel, not on where it is
+    '''
+    d = np.sqrt( ( ( offsets[:,None,:] - offsets[None,:,:] )**2.0 ).sum( axis=-1 ) )
+    return float( np.mean( covfct( d.ravel() ) ) )
+
+class _Krige( object ):
+    '''
+    Everything krige() needs to estimate one chunk of a grid;
+    the neighbor index or the global factorization is built
+    here, once, rather than for each chunk
+    '''
+    def __init__( self, data, covfct, method, N, nugget, index=None, factor=None,
+                  cache=None, search=None, stats=None, order=1, ndim=2 ):
+        if method not in _METHODS:
+            raise ValueError('Unknown kriging method: {}'.format( method ))
+        data = np.asarray( data, dtype=float )
+        self.search = search
+        self.stats = stats
+        if search is not None:
+            if len( search ) != len( data ) or search.ndim != ndim:
+                raise ValueError('The search was not built on this data set')
+            # the search decides how many neighbors a node gets
+            N = search.ndmax
+        self.coords, self.values = data[:,:ndim], data[:,ndim]
+        self.ndim = ndim
+        self.covfct = covfct
+        self.method = method
+        self.order = order
+        self.N = N
+        self.nugget = nugget
+        self.drift = None
+        if method in _DRIFTS:
+            self.drift = _Drift( data, method, order, ndim )
+        # the bordered system of a node is singular with fewer
+        # neighbors than it has drift terms
+        self.terms = 0 if method == 'simple' else 1
+        if self.drift is not None:
+            self.terms = self.drift.F.shape[1]
+        if 0 < N < self.terms:
+            raise ValueError('{} kriging needs at least {} neighbors, not {}'.format(
+                             method.capitalize(), self.terms, N ))
+        # mean and variance of the variable
+        self.mu = np.mean( self.values )
+        self.sill = np.var( self.values )
+        self.index = None
+        self.factor = None
+        # the points discretizing a panel, and their average
+        # covariance, when kriging blocks, see blockkrige()
+        self.offsets = None
+        self.cvv = None
+        self.c0 = None
+        # systems are only cached for neighborhoods
+        self.cache = cache if N > 0 else None
+        if N > 0:
+            if search is None and index is None:
+                index = NeighborIndex( self.coords, ndim=ndim )
+            elif search is None and ( len( index ) != len( data ) or index.ndim != ndim ):
+                raise ValueError('The index was not built on this data set')
+            self.index = index
+            if cache is not None:
+                cache.bind( self.coords, covfct, self.drift )
+        else:
+            if factor is None:
+                factor = GlobalFactor( data, covfct, method, stats, order, ndim )
+            elif len( factor ) != len( data ) or factor.ndim != ndim:
+                raise ValueError('The factor was not built on this data set')
+            elif factor.method != method:
+                raise ValueError('The factor was built for {} kriging'.format( factor.method ))
+            elif method == 'universal' and factor.drift.order != order:
+                raise ValueError('The factor was built for a drift of order {}'.format( factor.drift.order ))
+            self.factor = factor
+
+    def chunksize( self ):
+        '''
+        Number of targets that keeps a stacked chunk near 32 MB;
+        a target needs an <NxN> system, or a single covariance
+        vector when all of the data are used; for blocks, each
+        covariance is averaged over the points of the panel
+        '''
+        D = 1 if self.offsets is None else len( self.offsets )
+        size = self.N * max( self.N, D ) if self.N > 0 else len( self.coords ) * D
+        return max( 1, _BATCH_ELEMENTS // size )
+
+    def block( self, offsets ):
+        '''
+        Input:  (offsets) <D,ndim> NumPy array of the points that
+                          discretize a panel, about its center
+        --------------------------------------------------------
+        Krige panels of this shape from here on, rather than
+        points; the variance of the panel takes the place of
+        the variance of the variable, see variance()
+        '''
+        self.offsets = offsets
+        self.cvv = _blockcov( self.covfct, offsets )
+        self.c0 = _blockcov( self.covfct, offsets[:1] )
+
+    def variance( self ):
+        '''
+        Variance that the kriging variance is taken from: the
+        variance of the variable plus the nugget at a point, and
+        for a panel of D points that less the average semivariance
+        between them, C(0) - cvv, with the nugget averaged over
+        them, so that a one point panel is a point
+        '''
+        if self.offsets is None:
+            return self.sill + self.nugget
+        D = len( self.offsets )
+        return self.sill + self.nugget / D - ( self.c0 - self.cvv )
+
+    def _searched( self, targets, f ):
+        '''
+        Krige the nodes with at least (ndmin) data in their search
+        neighborhood, and no fewer than the drift terms, a group of nodes with the same number of
+        data at a time; the rest are left as NaN without solving
+        '''
+        with stage( self.stats, 'search' ):
+            nbrs, counts = self.search.search( targets )
+        est = np.full( len( targets ), np.nan )
+        kstd = np.full( len( targets ), np.nan )
+        counts[ counts < max( self.search.ndmin, self.terms, 1 ) ] = 0
+        for c in np.unique( counts[ counts > 0 ] ):
+            rows = np.flatnonzero( counts == c )
+            est[rows], kstd[rows] = _batch( self.coords, self.values, targets[rows],
+                                            nbrs[rows,:c], self.covfct, self.method,
+                                            0, self.mu, self.variance(), self.cache,
+                                            self.stats, self.drift,
+                                            None if f is None else f[rows], self.offsets )
+        return est, kstd
+
+    def __call__( self, targets ):
+        # the drift terms of the targets, from their coordinates, or
+        # from the drift variables in the columns after them
+        f = None
+        nd = self.ndim
+        if self.drift is not None and self.N > 0 and self.offsets is not None:
+            # average the drift terms over the points of each panel
+            points = ( targets[:,None,:nd] + self.offsets[None,:,:] ).reshape( -1, nd )
+            f = self.drift( points, targets[:0,nd:] )
+            f = f.reshape( len( targets ), len( self.offsets ), -1 ).mean( axis=1 )
+        elif self.drift is not None and self.N > 0:
+            f = self.drift( targets[:,:nd], targets[:,nd:] )
+        elif self.drift is None and targets.shape[1] > nd:
+            targets = targets[:,:nd]
+        if self.search is not None:
+            return self._searched( targets[:,:nd], f )
+        if self.N > 0:
+            with stage( self.stats, 'search' ):
+                nbrs = self.index.nearest( targets[:,:nd], self.N )[1]
+            return _batch( self.coords, self.values, targets[:,:nd], nbrs, self.covfct,
+                           self.method, 0, self.mu, self.variance(), self.cache,
+                           self.stats, self.drift, f, self.offsets )
+        est, kvar = self.factor.estimate( targets, self.stats, self.offsets )
+        return est, np.sqrt( self.variance() - kvar )
+
+# state of a worker process, set up once by _initworker()
+_worker = dict()
+
+def _share( array ):
+    '''
+    Copy (array) into a new block of shared memory, and return
+    the block with a (name, shape, dtype) spec to attach to it
+    '''
+    shm = shared_memory.SharedMemory( create=True, size=max( array.nbytes, 1 ) )
+    view = np.ndarray( array.shape, array.dtype, buffer=shm.buf )
+    view[...] = array
+    return shm, ( shm.name, array.shape, array.dtype.str )
+
+def _zeros( shape, dtype=float ):
+    '''
+    A new block of shared memory holding zeros of (shape), made
+    in place rather than copied from a private array, with a
+    (name, shape, dtype) spec to attach to it, as from _share()
+    '''
+    dtype = np.dtype( dtype )
+    nbytes = int( np.prod( shape ) ) * dtype.itemsize
+    shm = shared_memory.SharedMemory( create=True, size=max( nbytes, 1 ) )
+    np.ndarray( shape, dtype, buffer=shm.buf ).fill( 0 )
+    return shm, ( shm.name, tuple( shape ), dtype.str )
+
+def _attach( spec ):
+    '''
+    Attach to a block of shared memory made by _share()
+    '''
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory( name=name )
+    return shm, np.ndarray( shape, dtype, buffer=shm.buf )
+
+def _initworker( specs, covfct, method, N, nugget, index, factor, cache, search,
+                 profile, order, ndim ):
+    '''
+    Attach a worker process to the shared data, grid, and
+    output arrays, and set up its kriging state once
+    '''
+    shms, arrays = zip( *[ _attach( spec ) for spec in specs ] )
+    data, grid, est, kstd = arrays
+    # hold on to the blocks for the life of the worker
+    _worker['shms'] = shms
+    _worker['arrays'] = grid, est, kstd
+    _worker['kriger'] = _Krige( data, covfct, method, N, nugget, index, factor, cache,
+                                search, None, order, ndim )
+    _worker['profile'] = profile
+
+def _runworker( i, j ):
+    '''
+    Krige rows i:j of the shared grid into the shared output,
+    and return the stats of the chunk when they are kept
+    '''
+    grid, est, kstd = _worker['arrays']
+    kriger = _worker['kriger']
+    if _worker['profile']:
+        kriger.stats = Stats()
+    est[i:j,0], kstd[i:j,0] = kriger( grid[i:j] )
+    if _worker['profile']:
+        return kriger.stats.asdict()
+
+def _pkrige( kriger, data, grid, chunksize, n_jobs ):
+    '''
+    Krige (grid) in chunks on a pool of (n_jobs) processes.  The
+    data, grid and outputs live in shared memory, and the workers
+    set up their kriging state once, so a task is only the start
+    and stop rows of a chunk.  Each chunk is written to its own
+    rows of the output, so the result does not depend on the
+    order in which the chunks finish.
+    '''
+    M = len( grid )
+    arrays = [ np.asarray( data, dtype=float ), grid,
+               np.zeros(( M, 1 )), np.zeros(( M, 1 )) ]
+    shms, specs = list(), list()
+    try:
+        for array in arrays:
+            shm, spec = _share( array )
+            shms.append( shm )
+            specs.append( spec )
+        # fork, where it is available, hands the covariance function
+        # to the workers without pickling it; elsewhere it is pickled
+        # once per worker
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context( 'fork' ) if 'fork' in methods else None
+        initargs = ( specs, kriger.covfct, kriger.method, kriger.N, kriger.nugget,
+                     kriger.index, kriger.factor, kriger.cache, kriger.search,
+                     kriger.stats is not None, kriger.order, kriger.ndim )
+        starts = list( range( 0, M, chunksize ) )
+        stops = [ min( i + chunksize, M ) for i in starts ]
+        with ProcessPoolExecutor( n_jobs, mp_context=context,
+                                  initializer=_initworker, initargs=initargs ) as pool:
+            # consume the results to raise any errors from the workers
+            for stats in pool.map( _runworker, starts, stops ):
+                if stats is not None:
+                    kriger.stats.merge( stats )
+        # copy the results out of shared memory
+        est = np.ndarray( ( M, 1 ), float, buffer=shms[2].buf ).copy()
+        kstd = np.ndarray( ( M, 1 ), float, buffer=shms[3].buf ).copy()
+    finally:
+        for shm in shms:
+            shm.close()
+            shm.unlink()
     return est, kstd
+
+def krige( data, covfct, grid, method='simple', N=0, nugget=0, chunksize=None,
+           index=None, factor=None, n_jobs=1, cache=None, search=None, stats=None,
+           order=1, ndim=2 ):
+    '''
+    Krige an <M,ndim> array of points representing a grid.
+
+    Use simple, ordinary, universal or external drift kriging,
+    some number N of neighboring points, and a nugget value.
+
+    With (ndim) of 3, the first three columns of (data) and of
+    (grid) are x, y and z, and the variable is the fourth column
+    of (data); in general it is the column after the (ndim)
+    coordinates.  An (index), (factor) or (search) must be built
+    with the same (ndim).
+
+    Universal kriging, method='universal', replaces the constant
+    mean of ordinary kriging with a polynomial drift in the
+    coordinates of (order) one or two.  Kriging with external drift, method=
+    'external', uses a constant and the drift variables given in
+    the columns of (data) after the variable of interest, and in
+    the columns of (grid) after the coordinates.
+
+    The grid is kriged in chunks of (chunksize) points, and
+    each chunk is solved as one stacked system; by default the
+    chunks are sized to keep the stacked matrices near 32 MB.
+
+    The N closest points are found with (index), a
+    neighbors.NeighborIndex built on (data).  With N=0 the
+    covariance matrix is factored once, see GlobalFactor, and
+    reused for every point; pass (factor) to reuse it across
+    calls.  Either one is built here if it is not given.
+
+    With (n_jobs) other than one, the chunks are kriged on a
+    pool of that many processes, or one per CPU for None or -1.
+
+    With N>0, (cache), a SystemCache, keeps the inverted system
+    of each set of neighbors, so that nodes sharing one are only
+    solved once; each worker process keeps a copy of its own.
+
+    In place of the N closest points, (search), a neighbors.
+    SearchNeighborhood, picks the data for each node within a
+    search ellipse, balanced over sectors; nodes with fewer than
+    its (ndmin) data, or than the drift terms, are skipped and
+    left as NaN.
+
+    (stats), a profiling.Stats, records the time spent in each
+    stage; the stats of worker processes are added to it as
+    their chunks finish, without calling its callback.
+    '''
+    grid = np.asarray( grid, dtype=float )
+    if grid.ndim == 1:
+        grid = grid[None,:]
+    kriger = _Krige( data, covfct, method, N, nugget, index, factor, cache, search,
+                     stats, order, ndim )
+    M = len( grid )
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    if chunksize is None:
+        chunksize = kriger.chunksize()
+        if n_jobs > 1:
+            # give each worker a few chunks to balance the load
+            chunksize = max( 1, min( chunksize, -( -M // ( 4 * n_jobs ) ) ) )
+    if n_jobs > 1:
+        return _pkrige( kriger, data, grid, chunksize, n_jobs )
+    est = np.zeros(( M, 1 ))
+    kstd = np.zeros(( M, 1 ))
+    for i in range( 0, M, chunksize ):
+        j = min( i + chunksize, M )
+        est[i:j,0], kstd[i:j,0] = kriger( grid[i:j] )
+    return est, kstd
+
+def blockkrige( data, covfct, centers, size, disc=4, method='simple', N=0,
+                nugget=0, chunksize=None, index=None, factor=None, cache=None,
+                search=None, stats=None, order=1, ndim=2 ):
+    '''
+    Input:  (data)    NumPy array of data, as for krige()
+            (covfct)  covariance function
+            (centers) <M,ndim> NumPy array of the centers of the panels
+            (size)    extent of every panel along each axis, e.g.
+                      ( width, height ), or an <M,ndim> NumPy array
+                      of the size of each one
+            (disc)    number of points discretizing a panel along
+                      each axis, ( nx, ny ) or ( nx, ny, nz ), or
+                      one number for all of them
+    Output: (est)     <M,1> NumPy array of block estimates
+            (kstd)    <M,1> NumPy array of block kriging standard
+                      deviations
+    --------------------------------------------------------
+    Krige the average of the variable over each rectangular panel,
+    or block of a 3D volume, rather than its value at a point.  The
+    covariance between a datum and a panel is the mean of its
+    covariances with the points of a regular grid over the panel, and the block
+    variance comes from the mean covariance between those points;
+    both are worked out for a whole chunk of panels at once.  The
+    latter only depends on the shape of a panel, so it is worked
+    out once for each distinct (size), and panels of the same
+    shape share it.  Either one costs far less than kriging each
+    of the points and averaging them.
+
+    As in krige(), the variance at a point is the variance of the
+    variable plus (nugget); that of a panel is the variance of the
+    variable less the mean semivariance C(0) - cvv between its
+    points, where cvv is their mean covariance, plus (nugget)
+    averaged over them.  A one point panel so gives the kstd of
+    krige().
+
+    The neighbors of a panel are those of its center; the other
+    options, and the kriging methods but external drift, which
+    has no drift variables inside the panels, are as for krige().
+    '''
+    if method == 'external':
+        raise ValueError('Block kriging needs the drift inside the panels')
+    centers = np.asarray( centers, dtype=float )
+    if centers.ndim == 1:
+        centers = centers[None,:]
+    centers = centers[:,:ndim]
+    M = len( centers )
+    sizes = np.broadcast_to( np.asarray( size, dtype=float ), ( M, ndim ) )
+    disc = np.broadcast_to( disc, ( ndim, ) )
+    # the distinct panel shapes, and the shape of each panel
+    shapes, which = np.unique( sizes, axis=0, return_inverse=True )
+    which = np.ravel( which )
+    kriger = _Krige( data, covfct, method, N, nugget, index, factor, cache, search,
+                     stats, order, ndim )
+    est = np.zeros(( M, 1 ))
+    kstd = np.zeros(( M, 1 ))
+    for s, shape in enumerate( shapes ):
+        kriger.block( _discretize( shape, disc ) )
+        rows = np.flatnonzero( which == s )
+        step = chunksize or kriger.chunksize()
+        for i in range( 0, len( rows ), step ):
+            r = rows[i:i+step]
+            est[r,0], kstd[r,0] = kriger( centers[r] )
+    return est, kstd
+
+def _gridchunks( grid, chunksize, done, size ):
+    '''
+    Yield (offset, points) chunks of (grid) from row (done) on;
+    (grid) is an <M,ndim> array, an ( origin, spacing, shape ) grid
+    specification, or an iterable of <m,ndim> arrays
+    '''
+    if isinstance( grid, tuple ) and len( grid ) == 3:
+        origin, spacing, shape = grid
+        for i in range( done, size, chunksize ):
+            yield i, gridpoints( origin, spacing, shape, i, i + chunksize )
+    elif isinstance( grid, np.ndarray ):
+        for i in range( done, size, chunksize ):
+            yield i, grid[i:i+chunksize]
+    else:
+        offset = 0
+        for chunk in grid:
+            chunk = np.asarray( chunk, dtype=float )
+            # skip the rows finished by an earlier run
+            skip = min( max( done - offset, 0 ), len( chunk ) )
+            for i in range( skip, len( chunk ), chunksize ):
+                yield offset + i, chunk[i:i+chunksize]
+            offset += len( chunk )
+
+def _fingerprint( data, covfct, grid, size, method, N, nugget, chunksize, order, ndim ):
+    '''
+    Digest of the inputs of a streamkrige() run, recorded with its
+    progress so that a run is only resumed with the same inputs;
+    a generator of chunks is only known by its (size), and the
+    covariance function by its repr and its values out to the
+    extent of the data, since lambdas and closures share a repr
+    '''
+    data = np.ascontiguousarray( data, dtype=float )
+    if isinstance( grid, tuple ):
+        spec = [ np.asarray( g, dtype=float ).tolist() for g in grid ]
+    elif isinstance( grid, np.ndarray ):
+        spec = hashlib.sha1( np.ascontiguousarray( grid, dtype=float ).tobytes() ).hexdigest()
+    else:
+        spec = None
+    # the addresses in the repr of a function change from run to run
+    model = re.sub( r' at 0x[0-9a-fA-F]+', '', repr( covfct ) )
+    extent = np.sqrt( ( np.ptp( data[:,:ndim], axis=0 )**2.0 ).sum() ) if len( data ) else 0.0
+    values = np.asarray( covfct( np.linspace( 0, extent, 257 ) ), dtype=float )
+    model = [ model, hashlib.sha1( np.ascontiguousarray( values ).tobytes() ).hexdigest() ]
+    inputs = { 'data': [ list( data.shape ), hashlib.sha1( data.tobytes() ).hexdigest() ],
+               'covfct': model, 'grid': spec, 'size': size, 'method': method,
+               'N': int( N ), 'nugget': float( nugget ), 'chunksize': int( chunksize ),
+               'order': order, 'ndim': ndim }
+    return hashlib.sha1( json.dumps( inputs, sort_keys=True ).encode() ).hexdigest()
+
+def streamkrige( data, covfct, grid, estfile, kstdfile, method='simple', N=0,
+                 nugget=0, chunksize=None, index=None, factor=None, size=None,
+                 resume=True, cache=None, search=None, stats=None, order=1, ndim=2 ):
+    '''
+    Input:  (data)     NumPy array of data, as for krige()
+            (covfct)   covariance function
+            (grid)     an <M,ndim> NumPy array of points, an
+                       ( origin, spacing, shape ) specification of a
+                       regular grid or volume, see utilities.
+                       gridpoints(), or a generator of <m,ndim>
+                       arrays of points
+            (estfile)  filename of the .npy file for the estimates
+            (kstdfile) filename of the .npy file for the kriging
+                       standard deviations
+            (size)     total number of points, needed when (grid)
+                       is a generator of chunks
+            (resume)   pick up an interrupted run where it stopped
+    Output: (est)      <M,1> read-only memmap of the estimates
+            (kstd)     <M,1> read-only memmap of the kriging
+                       standard deviations
+    --------------------------------------------------------
+    Krige a grid that does not need to fit in memory, writing
+    each chunk of results straight to disk.  The number of rows
+    completed is recorded in (estfile)+'.progress' after each
+    chunk, so that a run can be resumed from the last chunk
+    that was written.  The progress also records a digest of the
+    data, covariance function, method, N, nugget, grid and
+    chunksize, and a run with other inputs is refused rather than
+    resumed; the file is removed once the run is complete.  The
+    other arguments are as for krige().
+    '''
+    if isinstance( grid, tuple ) and len( grid ) == 3:
+        size = int( np.prod( grid[2] ) )
+    elif not isinstance( grid, np.ndarray ) and hasattr( grid, '__len__' ):
+        grid = np.asarray( grid, dtype=float )
+    if isinstance( grid, np.ndarray ):
+        size = len( grid )
+    if size is None:
+        raise ValueError('The number of points, size, is needed for a generator of chunks')
+    kriger = _Krige( data, covfct, method, N, nugget, index, factor, cache, search,
+                     stats, order, ndim )
+    if chunksize is None:
+        chunksize = kriger.chunksize()
+    progress = estfile + '.progress'
+    key = _fingerprint( data, covfct, grid, size, method, N, nugget, chunksize, order, ndim )
+    done = 0
+    if resume and os.path.exists( progress ):
+        with open( progress ) as f:
+            state = json.load( f )
+        if state['size'] != size:
+            raise ValueError('The interrupted run was for a grid of {} points'.format( state['size'] ))
+        if state.get( 'inputs' ) != key:
+            raise ValueError('The interrupted run was for other inputs; pass resume=False to start over')
+        done = state['rows']
+        est = np.lib.format.open_memmap( estfile, mode='r+' )
+        kstd = np.lib.format.open_memmap( kstdfile, mode='r+' )
+        if est.shape != ( size, 1 ) or kstd.shape != ( size, 1 ):
+            raise ValueError('The output files do not match the grid')
+    else:
+        est = np.lib.format.open_memmap( estfile, mode='w+', shape=( size, 1 ) )
+        kstd = np.lib.format.open_memmap( kstdfile, mode='w+', shape=( size, 1 ) )
+    for i, points in _gridchunks( grid, chunksize, done, size ):
+        j = i + len( points )
+        est[i:j,0], kstd[i:j,0] = kriger( points )
+        # make the results durable before recording them as done
+        est.flush()
+        kstd.flush()
+        with open( progress + '.tmp', 'w' ) as f:
+            json.dump( { 'size': size, 'rows': j, 'inputs': key }, f )
+        os.replace( progress + '.tmp', progress )
+    del est, kstd
+    # a finished run has nothing to resume
+    if os.path.exists( progress ):
+        os.remove( progress )
+    return ( np.lib.format.open_memmap( estfile, mode='r' ),
+             np.lib.format.open_memmap( kstdfile, mode='r' ) )
@@ -1,86 +1,456 @@
+import math
 import numpy as np
+import scipy.optimize
 import geostatsmodels.variograms as variograms
 
 def opt( fct, x, y, c, parameterRange=None, meshSize=1000 ):
     '''
     Optimize parameters for a model of the semivariogram
     '''
-    if parameterRange == None:
+    if parameterRange is None:
         parameterRange = [ x[1], x[-1] ]
-    mse = np.zeros( meshSize )
     a = np.linspace( parameterRange[0], parameterRange[1], meshSize )
-    for i in range( meshSize ):
-        mse[i] = np.mean( ( y - fct( x, a[i], c ) )**2.0 )
+    x = np.asarray( x, dtype=float )
+    try:
+        # evaluate every candidate range at once, one per row
+        sv = np.broadcast_to( fct( x[None,:], a[:,None], c ), ( len( a ), len( x ) ) )
+    except ( TypeError, ValueError ):
+        # a model that takes one range at a time
+        sv = np.array([ fct( x, ai, c ) for ai in a ])
+    mse = np.mean( ( y - sv )**2.0, axis=1 )
     return a[ mse.argmin() ]
-    
+
+def nested( h, fcts, param ):
+    '''
+    Input:  (h)     scalar or NumPy ndarray of distances
+            (fcts)  list of model functions
+            (param) ranges and sills of the models, in pairs,
+                    followed by a nugget if there is one more
+    Output:         the semivariance of the sum of the models
+    '''
+    sv = np.zeros( np.shape( h ) )
+    for i, fct in enumerate( fcts ):
+        sv = sv + fct( h, param[2*i], param[2*i+1] )
+    if len( param ) > 2 * len( fcts ):
+        sv = sv + nugget( h, 0, param[-1] )
+    return sv
+
+def fitparams( x, y, fct, counts=None, nugget=False ):
+    '''
+    Input:  (x)      <L> NumPy array of lag distances
+            (y)      <L> NumPy array of semivariogram values, or
+                     <V,L> for V semivariograms at the same lags
+            (fct)    model function, or a list of model functions
+                     for a nested model
+            (counts) number of pairs at each lag, <L> or <V,L>,
+                     used to weight the fit
+            (nugget) True to fit a nugget as well
+    Output: (param)  <P> NumPy array of the range and sill of each
+                     model, followed by the nugget if it was fit;
+                     <V,P> when there are V semivariograms
+    --------------------------------------------------------
+    Fit the ranges, sills, and nugget of a model of the
+    semivariogram by weighted least squares.  Lags without a
+    value, NaN in (y), are left out of the fit, and a semivariogram
+    with no lags left gets a row of NaN.  The ranges are kept
+    within three times the largest lag fitted.
+    '''
+    fcts = list( fct ) if isinstance( fct, ( list, tuple ) ) else [ fct ]
+    x = np.asarray( x, dtype=float )
+    y = np.asarray( y, dtype=float )
+    single = y.ndim == 1
+    y = np.atleast_2d( y )
+    if counts is None:
+        counts = np.ones( y.shape )
+    counts = np.broadcast_to( np.asarray( counts, dtype=float ), y.shape )
+    S = len( fcts )
+    # the ranges must be positive, the sills and nugget non-negative
+    lower = [ 1e-9 * x.max(), 0.0 ] * S + [ 0.0 ] * nugget
+    params = list()
+    for yv, wv in zip( y, counts ):
+        keep = np.isfinite( yv ) & ( wv > 0 )
+        if not keep.any():
+            params.append( np.full( len( lower ), np.nan ) )
+            continue
+        xs, ys, ws = x[keep], yv[keep], np.sqrt( wv[keep] )
+        # the lags say nothing of ranges far past the last of them
+        upper = [ 3.0 * xs.max(), np.inf ] * S + [ np.inf ] * nugget
+        # start with the structures spread over the lags, sharing
+        # what is left of the largest value after the nugget
+        n0 = 0.5 * ys[0] if nugget else 0.0
+        p0 = list()
+        for i in range( S ):
+            p0 += [ xs.max() * ( i + 1 ) / ( S + 1.0 ), max( ys.max() - n0, 1e-9 ) / S ]
+        if nugget:
+            p0.append( n0 )
+        residuals = lambda p: ws * ( nested( xs, fcts, p ) - ys )
+        fit = scipy.optimize.least_squares( residuals, p0, bounds=( lower, upper ) )
+        params.append( fit.x )
+    params = np.array( params )
+    if single:
+        return params[0]
+    return params
+
 def typetest( h, a, lta, gta ):
     '''
     Input:  (h)   scalar or NumPy ndarray
             (a)   scalar representing the range parameter
             (lta) function to perfrom for values less than (a)
             (gta) function to perform for values greater than (a)
-    Output:       scalar or array, depending on (h)
+    Output:       scalar or array, depending on (h), with the
+                  elements of an array kept in their original order
     '''
-    # if (h) is a numpy ndarray, then..
-    try:
-        # apply lta() to elements less than a
-        lt = lta( h[ np.where( h <= a ) ] )
-        # apply gta() to elements greater than a
-        gt = gta( h[ np.where( h > a ) ] )
-        return np.hstack((lt,gt))
-    # otherwise, if (h) is a scalar..
-    except TypeError:
+    # if (h) is a scalar..
+    if np.ndim( h ) == 0:
         if h <= a:
             return lta( h )
         else:
             return gta( h )
-        
-def nugget( h, a, c ):
+    # otherwise, if (h) is a numpy ndarray, then..
+    h = np.asarray( h )
+    out = np.empty( h.shape )
+    lt = h <= a
+    # apply lta() to elements less than a
+    out[lt] = lta( h[lt] )
+    # apply gta() to elements greater than a
+    out[~lt] = gta( h[~lt] )
+    return out
+
+# number of elements a model evaluates at a time, so that
+# its scratch space stays small for large distance matrices
+_BLOCK = 2**16
+
+def _evaluate( kernel, h, out, *param ):
+    '''
+    Input:  (kernel) function kernel( h, out, tmp, *param ) that
+                     writes a model evaluated at (h) into (out),
+                     using (tmp) for scratch space; (out) may be
+                     (h) itself
+            (h)      scalar or NumPy ndarray of distances
+            (out)    NumPy ndarray for the result, or None
+            (param)  parameters of the model, scalars or arrays
+                     that broadcast against (h)
+    Output:          scalar or array, depending on (h)
+    --------------------------------------------------------
+    Evaluate a model without reordering (h) or making full size
+    temporaries: with scalar parameters a large array is worked
+    through in blocks of _BLOCK elements.  The result is float32
+    for float32 input or (out), and float64 otherwise.
+    '''
+    h = np.asarray( h )
+    param = [ float( p ) if np.ndim( p ) == 0 else np.asarray( p, dtype=float )
+              for p in param ]
+    shape = np.broadcast_shapes( h.shape, *[ np.shape( p ) for p in param ] )
+    if out is None:
+        dtype = h.dtype if h.dtype == np.float32 else np.float64
+        out = np.empty( shape, dtype )
+    elif out.shape != shape:
+        raise ValueError('The output has shape {}, not {}'.format( out.shape, shape ))
+    blocked = ( h.shape == shape and out.size > _BLOCK and
+                out.flags.c_contiguous and h.flags.c_contiguous )
+    if blocked:
+        hf, of = h.reshape( -1 ), out.reshape( -1 )
+        tmp = np.empty( _BLOCK, out.dtype )
+        for i in range( 0, out.size, _BLOCK ):
+            j = min( i + _BLOCK, out.size )
+            kernel( hf[i:j], of[i:j], tmp[:j-i], *param )
+    else:
+        kernel( h, out, np.empty( shape, out.dtype ), *param )
+    if out.ndim == 0:
+        return out[()]
+    return out
+
+def _nugget( h, out, tmp, a, c ):
+    # c where h > 0, otherwise zero
+    np.greater( h, 0.0, out=out )
+    np.multiply( out, c, out=out )
+
+def nugget( h, a, c, out=None ):
     '''
     Nugget model of the semivariogram
     '''
-    c = float(c)
-    lta = lambda x: 0+x*0
-    gta = lambda x: c+x*0
-    return typetest( h, 0, lta, gta )
+    return _evaluate( _nugget, h, out, a, c )
+
+def _linear( h, out, tmp, a, c ):
+    # c * min( h/a, 1 )
+    np.divide( h, a, out=out )
+    np.minimum( out, 1.0, out=out )
+    np.multiply( out, c, out=out )
 
-def linear( h, a, c ):
+def linear( h, a, c, out=None ):
     '''
     Linear model of the semivariogram
     '''
-    a, c = float(a), float(c)
-    lta = lambda x: (c/a)*x
-    gta = lambda x: c+x*0
-    return typetest( h, a, lta, gta )
+    return _evaluate( _linear, h, out, a, c )
+
+def _spherical( h, out, tmp, a, c ):
+    # with r = min( h/a, 1 ), c * r * ( 1.5 - 0.5*r**2 )
+    np.divide( h, a, out=out )
+    np.minimum( out, 1.0, out=out )
+    np.multiply( out, out, out=tmp )
+    np.multiply( tmp, -0.5, out=tmp )
+    np.add( tmp, 1.5, out=tmp )
+    np.multiply( out, tmp, out=out )
+    np.multiply( out, c, out=out )
 
-def spherical( h, a, c ):
+def spherical( h, a, c, out=None ):
     '''
     Spherical model of the semivariogram
     '''
-    a, c = float(a), float(c)
-    lta = lambda x: c*( 1.5*(x/a) - 0.5*(x/a)**3.0 )
-    gta = lambda x: c+x*0
-    return typetest( h, a, lta, gta )
+    return _evaluate( _spherical, h, out, a, c )
 
-def exponential( h, a, c ):
+def _exponential( h, out, tmp, a, c ):
+    # c - c * exp( -3*h/a )
+    np.divide( h, a, out=out )
+    np.multiply( out, -3.0, out=out )
+    np.exp( out, out=out )
+    np.multiply( out, c, out=out )
+    np.subtract( c, out, out=out )
+
+def exponential( h, a, c, out=None ):
     '''
     Exponential model of the semivariogram
     '''
-    a, c = float( a ), float( c )
-    return c*( 1.0 - np.exp( -3.0*h/a ) )
+    return _evaluate( _exponential, h, out, a, c )
+
+def _gaussian( h, out, tmp, a, c ):
+    # c - c * exp( -3*(h/a)**2 )
+    np.divide( h, a, out=out )
+    np.multiply( out, out, out=out )
+    np.multiply( out, -3.0, out=out )
+    np.exp( out, out=out )
+    np.multiply( out, c, out=out )
+    np.subtract( c, out, out=out )
 
-def gaussian( h, a, c ):
+def gaussian( h, a, c, out=None ):
     '''
     Gaussian model of the semivariogram
     '''
-    a, c = float( a ), float( c )
-    return c*( 1.0 - np.exp( -3.0*h**2.0/a**2.0 ) )
-    
-def power( h, w, c ):
+    return _evaluate( _gaussian, h, out, a, c )
+
+def _power( h, out, tmp, w, c ):
+    # c * h**w
+    np.power( h, w, out=out )
+    np.multiply( out, c, out=out )
+
+def power( h, w, c, out=None ):
     '''
     Power model of the semivariogram
     '''
-    return c*h**w
+    return _evaluate( _power, h, out, w, c )
+
+# the in-place kernel and the scalar form of each model
+_KERNELS = { nugget: _nugget, linear: _linear, spherical: _spherical,
+             exponential: _exponential, gaussian: _gaussian, power: _power }
+
+def _sspherical( h, a, c ):
+    r = min( h / a, 1.0 )
+    return c * r * ( 1.5 - 0.5 * r * r )
+
+_SCALARS = { nugget: lambda h, a, c: c if h > 0.0 else 0.0,
+             linear: lambda h, a, c: c * min( h / a, 1.0 ),
+             spherical: _sspherical,
+             exponential: lambda h, a, c: c - c * math.exp( -3.0 * h / a ),
+             gaussian: lambda h, a, c: c - c * math.exp( -3.0 * ( h / a )**2 ),
+             power: lambda h, w, c: c * h**w }
+
+class Covariance( object ):
+    '''
+    Input:  (structures) list of ( fct, param ) pairs, a model
+                         function and its range and sill, e.g.
+                         [ ( spherical, ( 10, 1.5 ) ),
+                           ( exponential, ( 40, 0.5 ) ) ]
+            (nugget)     the nugget effect
+    --------------------------------------------------------
+    Covariance of a nested model of the semivariogram, the sill,
+    (nugget) plus the sills of the structures, minus the sum of
+    the structures and the nugget.  The parameters are cast to
+    floats and the kernels looked up once, here, so a call only
+    runs the in-place ufuncs of the models; a scalar distance
+    takes a pure Python path through the math module instead.
+
+    Calling the object on (h), with an optional (out) array,
+    gives the covariance; variogram() gives the semivariance.
+    Only the structures and nugget are pickled, so it is cheap
+    to send to worker processes.
+    '''
+    def __init__( self, structures, nugget=0.0 ):
+        self.structures = [ ( fct, tuple( float( p ) for p in param ) )
+                            for fct, param in structures ]
+        self.nugget = float( nugget )
+        # the sill of the whole model
+        self.sill = self.nugget + sum( param[-1] for fct, param in self.structures )
+        self._kernels = [ ( _KERNELS.get( fct ) or self._generic( fct ), param )
+                          for fct, param in self.structures ]
+        self._scalars = [ ( _SCALARS.get( fct, fct ), param )
+                          for fct, param in self.structures ]
+
+    @staticmethod
+    def _generic( fct ):
+        # a kernel for a model function from outside this module
+        def kernel( h, out, tmp, *param ):
+            out[...] = fct( h, *param )
+        return kernel
+
+    @classmethod
+    def fromparams( cls, fcts, param ):
+        '''
+        Input:  (fcts)  list of model functions
+                (param) ranges and sills of the models, in pairs,
+                        followed by a nugget if there is one more,
+                        as from fitparams()
+        Output:         Covariance of the nested model
+        '''
+        structures = [ ( fct, param[2*i:2*i+2] ) for i, fct in enumerate( fcts ) ]
+        nugget = param[-1] if len( param ) > 2 * len( fcts ) else 0.0
+        return cls( structures, nugget )
+
+    def __reduce__( self ):
+        return ( Covariance, ( self.structures, self.nugget ) )
+
+    def __repr__( self ):
+        return 'Covariance({!r}, nugget={!r})'.format( self.structures, self.nugget )
+
+    def _gamma( self, h, out, tmp ):
+        # the first structure is written straight into (out),
+        # the rest are summed into it through (buf), so when
+        # (out) is (h) the distances are copied out of its way
+        if ( len( self._kernels ) > 1 or self.nugget ) and np.shares_memory( h, out ):
+            h = h.copy()
+        kernel, param = self._kernels[0]
+        kernel( h, out, tmp, *param )
+        buf = None
+        for kernel, param in self._kernels[1:]:
+            if buf is None:
+                buf = np.empty_like( out )
+            kernel( h, buf, tmp, *param )
+            np.add( out, buf, out=out )
+        if self.nugget:
+            if buf is None:
+                buf = np.empty_like( out )
+            _nugget( h, buf, tmp, 0.0, self.nugget )
+            np.add( out, buf, out=out )
+
+    def scalar( self, h ):
+        '''
+        Input:  (h) a single distance
+        Output:     the covariance at (h) as a Python float
+        '''
+        h = float( h )
+        sv = self.nugget if h > 0.0 else 0.0
+        for fct, param in self._scalars:
+            sv += fct( h, *param )
+        return self.sill - sv
+
+    def variogram( self, h, out=None ):
+        '''
+        Input:  (h)   scalar or NumPy ndarray of distances
+                (out) NumPy ndarray for the result, or None
+        Output:       the semivariance at (h)
+        '''
+        if out is None and np.ndim( h ) == 0:
+            return self.sill - self.scalar( h )
+        return _evaluate( self._gamma, h, out )
+
+    def __call__( self, h, out=None ):
+        if out is None and np.ndim( h ) == 0:
+            return self.scalar( h )
+        sv = _evaluate( self._gamma, h, out )
+        if out is None:
+            out = sv
+        # the sill minus the semivariance, in place
+        np.subtract( self.sill, out, out=out )
+        return out[()] if out.ndim == 0 else out
+
+class Tabulated( object ):
+    '''
+    Input:  (covfct)     covariance function, e.g. from covariance()
+            (maxdist)    largest distance held in the table; beyond
+                         it (covfct) is evaluated exactly
+            (resolution) spacing of the table, or None to halve the
+                         spacing until the error is within (tol)
+            (tol)        bound on the absolute error of the table,
+                         by default 1e-6 of the covariance at zero
+    --------------------------------------------------------
+    Covariance read from a table of (covfct) at evenly spaced
+    distances, by linear interpolation, in place of (covfct)
+    wherever a covariance function is taken, e.g. by kriging.
+    The position of a distance in the table is worked out
+    directly from the spacing, so a lookup costs a multiply and
+    two gathers instead of an exp() or power.  The covariance
+    at zero distance, which a nugget makes discontinuous, is
+    kept exact.  The largest error found at the midpoints of
+    the table is kept as (error).
+    '''
+    def __init__( self, covfct, maxdist, resolution=None, tol=None ):
+        self.covfct = covfct
+        self.maxdist = float( maxdist )
+        # the value at zero, and its limit from above
+        self.c0 = float( covfct( 0.0 ) )
+        if tol is None:
+            tol = 1e-6 * abs( self.c0 )
+        self.tol = tol
+        n = 256 if resolution is None else int( np.ceil( self.maxdist / resolution ) )
+        while True:
+            x = np.linspace( 0.0, self.maxdist, n + 1 )
+            x[0] = np.finfo( float ).tiny
+            table = np.asarray( covfct( x ), dtype=float )
+            mid = ( np.arange( n ) + 0.5 ) * ( self.maxdist / n )
+            self.error = np.abs( covfct( mid ) - 0.5 * ( table[:-1] + table[1:] ) ).max()
+            # stop at a given resolution, or at about 2**24 entries
+            if resolution is not None or self.error <= tol or n >= 2**24:
+                break
+            n *= 2
+        self.resolution = self.maxdist / n
+        self._scale = n / self.maxdist
+        self._n = n
+        self._table = table
+        self._slope = np.append( np.diff( table ), 0.0 )
+        # copies for float32 distances, so gathers need no casts
+        self._tables = { np.dtype( np.float64 ): ( self._table, self._slope ),
+                         np.dtype( np.float32 ): ( self._table.astype( np.float32 ),
+                                                   self._slope.astype( np.float32 ) ) }
+        # only a nugget needs zero distances looked at separately
+        self._jump = self.c0 != table[0]
+
+    def __repr__( self ):
+        return 'Tabulated({!r}, maxdist={!r}, resolution={!r})'.format(
+            self.covfct, self.maxdist, self.resolution )
+
+    def _lookup( self, h, out, tmp ):
+        # the exact cases, found before (out), which may be (h),
+        # is written over
+        zero = h == 0.0 if self._jump else None
+        far = None
+        if h.size and h.max() > self.maxdist:
+            far = h > self.maxdist
+            hfar = h[far]
+        # the position of each distance in the table
+        np.multiply( h, self._scale, out=tmp )
+        np.minimum( tmp, self._n, out=tmp )
+        i = tmp.astype( np.intp )
+        np.subtract( tmp, i, out=tmp )
+        # table[i] + ( position - i ) * ( table[i+1] - table[i] )
+        table, slope = self._tables.get( out.dtype, self._tables[ np.dtype( np.float64 ) ] )
+        np.take( slope, i, out=out )
+        np.multiply( out, tmp, out=out )
+        np.add( out, np.take( table, i ), out=out )
+        if zero is not None:
+            np.copyto( out, self.c0, where=zero )
+        if far is not None:
+            out[far] = self.covfct( hfar )
+
+    def __call__( self, h, out=None ):
+        if out is None and np.ndim( h ) == 0:
+            h = float( h )
+            if h == 0.0:
+                return self.c0
+            if h > self.maxdist:
+                return float( self.covfct( h ) )
+            x = h * self._scale
+            i = int( x )
+            return float( self._table[i] + ( x - i ) * self._slope[i] )
+        return _evaluate( self._lookup, h, out )
 
 def semivariance( fct, param ): 
     '''
@@ -89,36 +459,45 @@ def semivariance( fct, param ):
     Output: (inner) function that only takes data as input
                     parameters are set internally
     '''
-    def inner( h ):
-        return fct(h,*param)
-    return inner
+    return Covariance( [ ( fct, param ) ] ).variogram
     
 def covariance( fct, param ): 
     '''
     Input:  (fct)   function that takes data and parameters
             (param) list or tuple of parameters
-    Output: (inner) function that only takes data as input
+    Output: (inner) Covariance that only takes data as input
                     parameters are set internally
     '''
-    def inner( h ):
-        return param[-1] - fct(h,*param)
-    return inner
+    return Covariance( [ ( fct, param ) ] )
 
-def fitmodel( data, fct, lags, tol ):
+def fitmodel( data, fct, lags, tol, ndim=2, fit=False, nugget=False ):
     '''
     Input:  (P)      ndarray, data
             (model)  modeling function
                       - spherical
                       - exponential
                       - gaussian
+                     or, with (fit), a list of them for a nested model
             (lags)   lag distances
             (tol)    tolerance
+            (ndim)   number of spatial coordinates, 2 or 3;
+                     the variable is the column after them
+            (fit)    True to fit the ranges and sills with fitparams(),
+                     weighted by the number of pairs at each lag,
+                     rather than search for the range with the sill
+                     set to the variance of the variable
+            (nugget) True to fit a nugget as well; implies (fit)
     Output: (covfct) function modeling the covariance
     '''
+    if fit or nugget:
+        lag, sv, n = variograms.semivariogram( data, lags, tol, ndim, counts=True )
+        fcts = list( fct ) if isinstance( fct, ( list, tuple ) ) else [ fct ]
+        param = fitparams( lag, sv, fcts, counts=n, nugget=nugget )
+        return Covariance.fromparams( fcts, param )
     # calculate the semivariogram
-    sv = variograms.semivariogram( data, lags, tol )
+    sv = variograms.semivariogram( data, lags, tol, ndim )
     # calculate the sill
-    c = np.var( data[:,2] )
+    c = np.var( data[:,ndim] )
     # calculate the optimal parameters
     a = opt( fct, sv[0], sv[1], c )
     # return a covariance function
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+import numpy as np
+from scipy.spatial import cKDTree
+
+class NeighborIndex( object ):
+    '''
+    Input:  (data)     NumPy array where the first (ndim) columns
+                       are the spatial coordinates, x, y (and z)
+            (leafsize) number of points in a leaf of the KD-tree
+            (ndim)     number of spatial coordinates, 2 or 3
+    --------------------------------------------------------
+    Spatial index over the coordinates of a data set; build
+    it once per data set and pass it to kriging.krige(),
+    kriging.simple(), or kriging.ordinary() so that each
+    neighbor search costs O(log n) instead of a full sort
+    '''
+    def __init__( self, data, leafsize=16, ndim=2 ):
+        self.coords = np.asarray( data, dtype=float )[:,:ndim]
+        self.ndim = ndim
+        self.tree = cKDTree( self.coords, leafsize=leafsize )
+
+    def __len__( self ):
+        return len( self.coords )
+
+    def nearest( self, u, N, workers=1 ):
+        '''
+        Input:  (u)       a point, or an <M,ndim> array of points
+                (N)       number of neighboring points
+                (workers) number of threads used for a batch
+        Output: (d)       distances to the N closest data points,
+                          <N> for a point, <M,N> for an array
+                (idx)     rows of the data for these points,
+                          sorted from closest to farthest
+        '''
+        u = np.asarray( u, dtype=float )
+        single = u.ndim == 1
+        u = np.atleast_2d( u )
+        # there cannot be more neighbors than points
+        N = min( N, len( self ) )
+        d, idx = self.tree.query( u, k=N, workers=workers )
+        # query() drops the last axis when N is one
+        d = d.reshape( len( u ), N )
+        idx = idx.reshape( len( u ), N )
+        if single:
+            return d[0], idx[0]
+        return d, idx
+
+    def radius( self, u, r, workers=1 ):
+        '''
+        Input:  (u)       a point, or an <M,ndim> array of points
+                (r)       search radius
+                (workers) number of threads used for a batch
+        Output: (idx)     rows of the data within (r) of the point,
+                          sorted from closest to farthest; a list
+                          of such arrays for an array of points
+        '''
+        u = np.asarray( u, dtype=float )
+        single = u.ndim == 1
+        u = np.atleast_2d( u )
+        found = self.tree.query_ball_point( u, r, workers=workers )
+        counts = np.array( [ len( f ) for f in found ], dtype=np.intp )
+        if counts.sum() == 0:
+            idx = [ np.zeros( 0, dtype=np.intp ) for f in found ]
+            return idx[0] if single else idx
+        # flatten the neighbors of every point into one array
+        f = np.concatenate( [ f for f in found if len( f ) ] ).astype( np.intp )
+        p = np.repeat( np.arange( len( u ) ), counts )
+        # sort the neighbors by point, then by distance to that point
+        d = ( ( self.coords[f] - u[p] )**2.0 ).sum( axis=1 )
+        f = f[ np.lexsort(( d, p )) ]
+        idx = np.split( f, np.cumsum( counts )[:-1] )
+        if single:
+            return idx[0]
+        return idx
+
+class SearchNeighborhood( object ):
+    '''
+    Input:  (data)       NumPy array where the first (ndim) columns
+                         are the spatial coordinates, x, y (and z)
+            (radius)     search radius along the major axis
+            (ndmax)      most data used for a node
+            (ndmin)      fewest data needed to krige a node
+            (anisotropy) ratio of the minor to the major radius
+            (angle)      azimuth of the major axis, in degrees
+                         clockwise from north
+            (noct)       most data taken from one sector around a
+                         node, or zero for no limit
+            (sectors)    number of sectors, 8 for octants or 4 for
+                         quadrants, starting from north
+            (leafsize)   number of points in a leaf of the KD-tree
+            (ndim)       number of spatial coordinates, 2 or 3
+            (vertical)   ratio of the vertical to the major radius,
+                         in 3D
+    --------------------------------------------------------
+    Moving search neighborhood for kriging.krige(): the data
+    within an ellipse around each node, closest first by the
+    anisotropic distance, at most (noct) from each sector and
+    (ndmax) in all.  The KD-tree is built on coordinates that
+    turn the ellipse into a circle, so the search is a plain
+    radius query, done for a whole batch of nodes at once.
+
+    In 3D the ellipse is an ellipsoid, with its major and minor
+    axes in the horizontal plane and a third, vertical, radius
+    of (vertical) times (radius); the sectors are split into
+    those above and those below the node, so that 8 sectors are
+    the quadrants above and below, as in GSLIB.
+    '''
+    def __init__( self, data, radius, ndmax, ndmin=1, anisotropy=1.0, angle=0.0,
+                  noct=0, sectors=8, leafsize=16, ndim=2, vertical=1.0 ):
+        if not 0 < anisotropy <= 1:
+            raise ValueError('The anisotropy ratio must be in (0, 1]')
+        if ndim == 3 and ( sectors % 2 or not vertical > 0 ):
+            raise ValueError('A 3D search needs an even number of sectors and a positive vertical ratio')
+        self.coords = np.asarray( data, dtype=float )[:,:ndim]
+        self.ndim = ndim
+        self.vertical = float( vertical )
+        self.radius = float( radius )
+        self.ndmax = int( ndmax )
+        self.ndmin = int( ndmin )
+        self.anisotropy = float( anisotropy )
+        self.angle = float( angle )
+        self.noct = int( noct )
+        self.sectors = int( sectors )
+        # rows of the transform: along the major axis, and across
+        # it stretched by the anisotropy
+        t = np.deg2rad( self.angle )
+        self.transform = np.array( [ [ np.sin( t ), np.cos( t ) ],
+                                     [ np.cos( t ) / self.anisotropy,
+                                       -np.sin( t ) / self.anisotropy ] ] )
+        if ndim == 3:
+            # and the vertical axis, stretched by its own ratio
+            self.transform = np.block( [ [ self.transform, np.zeros(( 2, 1 )) ],
+                                         [ np.zeros(( 1, 2 )), 1.0 / self.vertical ] ] )
+        self.tree = cKDTree( self.coords.dot( self.transform.T ), leafsize=leafsize )
+
+    def __len__( self ):
+        return len( self.coords )
+
+    def search( self, u, workers=1 ):
+        '''
+        Input:  (u)       <M,ndim> array of points
+                (workers) number of threads used for the queries
+        Output: (idx)     <M,ndmax> rows of the data found for each
+                          point, closest first, padded with -1
+                (counts)  <M> number of data found for each point
+        '''
+        u = np.atleast_2d( np.asarray( u, dtype=float ) )
+        M, n = len( u ), len( self )
+        v = u.dot( self.transform.T )
+        if self.noct == 0:
+            # the closest (ndmax) within the radius are all we need
+            k = min( self.ndmax, n )
+            d, idx = self.tree.query( v, k=k, distance_upper_bound=self.radius,
+                                      workers=workers )
+            idx = idx.reshape( M, k )
+            idx[ idx == n ] = -1
+            counts = ( idx >= 0 ).sum( axis=1 )
+            if k < self.ndmax:
+                idx = np.c_[ idx, -np.ones( ( M, self.ndmax - k ), dtype=np.intp ) ]
+            return idx, counts
+        # otherwise every datum in the ellipse is a candidate
+        found = self.tree.query_ball_point( v, self.radius, workers=workers )
+        counts = np.array( [ len( f ) for f in found ], dtype=np.intp )
+        idx = -np.ones( ( M, self.ndmax ), dtype=np.intp )
+        if counts.sum() == 0:
+            return idx, np.zeros( M, dtype=np.intp )
+        f = np.concatenate( [ f for f in found if len( f ) ] ).astype( np.intp )
+        p = np.repeat( np.arange( M ), counts )
+        d = ( ( self.tree.data[f] - v[p] )**2.0 ).sum( axis=1 )
+        # the sector of each candidate, by its bearing from the node
+        delta = self.coords[f] - u[p]
+        dx, dy = delta[:,0], delta[:,1]
+        azimuth = ( 90.0 - np.rad2deg( np.arctan2( dy, dx ) ) ) % 360.0
+        if self.ndim == 3:
+            # half of the sectors above the node, and half below
+            half = self.sectors // 2
+            sector = ( azimuth * half / 360.0 ).astype( np.intp ) % half
+            sector += half * ( delta[:,2] < 0 )
+        else:
+            sector = ( azimuth * self.sectors / 360.0 ).astype( np.intp ) % self.sectors
+        # rank the candidates by distance within each node and sector
+        order = np.lexsort(( d, sector, p ))
+        group = p[order] * self.sectors + sector[order]
+        start = np.r_[ 0, np.flatnonzero( np.diff( group ) ) + 1 ]
+        rank = np.arange( len( order ) ) - np.repeat( start, np.diff( np.r_[ start, len( order ) ] ) )
+        keep = order[ rank < self.noct ]
+        # then take the closest (ndmax) of those left for each node
+        keep = keep[ np.lexsort(( d[keep], p[keep] )) ]
+        pk = p[keep]
+        counts = np.bincount( pk, minlength=M )
+        start = np.r_[ 0, np.cumsum( counts )[:-1] ]
+        rank = np.arange( len( keep ) ) - start[pk]
+        use = rank < self.ndmax
+        idx[ pk[use], rank[use] ] = f[ keep[use] ]
+        return idx, np.minimum( counts, self.ndmax )
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+import time
+import warnings
+import contextlib
+import numpy as np
+
+# shared by every stage when there are no stats to keep
+_NULL = contextlib.nullcontext()
+
+class _Timer( object ):
+    '''
+    Context manager adding the time spent in it to a stage
+    '''
+    __slots__ = ( 'stats', 'name', 'start' )
+
+    def __init__( self, stats, name ):
+        self.stats = stats
+        self.name = name
+
+    def __enter__( self ):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__( self, *exc ):
+        self.stats.add( self.name, time.perf_counter() - self.start )
+        return False
+
+class Stats( object ):
+    '''
+    Input:  (callback)  function callback( stage, seconds ) called
+                        as each stage finishes, or None
+            (condition) condition number above which a kriging
+                        system is counted as ill-conditioned, or
+                        None to skip the check
+            (maxsize)   largest system whose condition number is
+                        worked out; larger ones are only counted
+            (sample)    number of the systems of each batch whose
+                        condition number is worked out, spread
+                        evenly through it, or None for all of them
+    --------------------------------------------------------
+    Opt-in record of where a kriging or variogram job spends
+    its time; pass it as (stats) to kriging.kmatrices(), simple(),
+    ordinary(), krige(), or variograms.variogram().  It keeps
+    the cumulative time and number of calls of each stage, e.g.
+    'search', 'assembly', 'covariance', 'solve', the number of
+    systems of each size, and the number of ill-conditioned
+    systems, with a RuntimeWarning for them.  The condition
+    numbers take an SVD each, so they are timed as a stage of
+    their own, 'condition', and only a (sample) of each batch
+    is checked.  Without it the stages cost a shared no-op
+    context manager each.
+    '''
+    def __init__( self, callback=None, condition=1e12, maxsize=1000, sample=1 ):
+        self.callback = callback
+        self.condition = condition
+        self.maxsize = maxsize
+        self.sample = sample
+        self.times = dict()
+        self.calls = dict()
+        self.sizes = dict()
+        self.illconditioned = 0
+        self.maxcondition = 0.0
+
+    def stage( self, name ):
+        '''
+        Input:  (name) name of a stage
+        Output:        context manager timing the stage
+        '''
+        return _Timer( self, name )
+
+    def add( self, name, seconds, calls=1 ):
+        '''
+        Add (seconds) and (calls) to the stage (name)
+        '''
+        self.times[name] = self.times.get( name, 0.0 ) + seconds
+        self.calls[name] = self.calls.get( name, 0 ) + calls
+        if self.callback is not None:
+            self.callback( name, seconds )
+
+    def systems( self, K ):
+        '''
+        Input:  (K) an <N,N> kriging system, or a <B,N,N> stack
+        --------------------------------------------------------
+        Count the systems by size, and check the conditioning of
+        a (sample) of them
+        '''
+        K = np.asarray( K )
+        count = 1 if K.ndim == 2 else len( K )
+        N = K.shape[-1]
+        self.sizes[N] = self.sizes.get( N, 0 ) + count
+        if self.condition is None or N > self.maxsize or count == 0:
+            return
+        if K.ndim == 3 and self.sample is not None and self.sample < count:
+            K = K[ np.unique( np.linspace( 0, count - 1, self.sample ).astype( int ) ) ]
+        with self.stage( 'condition' ), np.errstate( all='ignore' ):
+            cond = np.atleast_1d( np.linalg.cond( K ) )
+        # a singular system has an infinite condition number
+        cond[ ~np.isfinite( cond ) ] = np.inf
+        bad = int( np.sum( cond > self.condition ) )
+        self.maxcondition = max( self.maxcondition, float( cond.max() ) )
+        if bad:
+            self.illconditioned += bad
+            warnings.warn( 'ill-conditioned kriging system', RuntimeWarning, stacklevel=3 )
+
+    def merge( self, other ):
+        '''
+        Input:  (other) Stats, or its asdict(), to add to these
+        '''
+        if isinstance( other, Stats ):
+            other = other.asdict()
+        for name, seconds in other['times'].items():
+            self.times[name] = self.times.get( name, 0.0 ) + seconds
+            self.calls[name] = self.calls.get( name, 0 ) + other['calls'][name]
+        for N, count in other['sizes'].items():
+            self.sizes[int( N )] = self.sizes.get( int( N ), 0 ) + count
+        self.illconditioned += other['illconditioned']
+        self.maxcondition = max( self.maxcondition, other['maxcondition'] )
+
+    def asdict( self ):
+        '''
+        Output: the stats as a dictionary of plain Python types
+        '''
+        return { 'times': dict( self.times ), 'calls': dict( self.calls ),
+                 'sizes': dict( self.sizes ), 'illconditioned': self.illconditioned,
+                 'maxcondition': self.maxcondition }
+
+    def report( self ):
+        '''
+        Output: a table of the stages, slowest first, as a string
+        '''
+        lines = [ '{:<12} {:>10} {:>10}'.format( 'stage', 'seconds', 'calls' ) ]
+        for name in sorted( self.times, key=self.times.get, reverse=True ):
+            lines.append( '{:<12} {:>10.4f} {:>10d}'.format( name, self.times[name], self.calls[name] ) )
+        sizes = ', '.join( '{}x{}: {}'.format( N, N, c ) for N, c in sorted( self.sizes.items() ) )
+        lines.append( 'systems      {}'.format( sizes or 'none' ) )
+        lines.append( 'ill-conditioned {} (largest condition number {:.3g})'.format(
+                      self.illconditioned, self.maxcondition ) )
+        return '\n'.join( lines )
+
+def stage( stats, name ):
+    '''
+    Input:  (stats) Stats, or None
+            (name)  name of a stage
+    Output:         context manager timing the stage in (stats),
+                    or a shared one that does nothing for None
+    '''
+    if stats is None:
+        return _NULL
+    return stats.stage( name )
@@ -1,75 +1,376 @@
 #!/usr/bin/env python
 
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import geostatsmodels.kriging as k
-import random
+from geostatsmodels.neighbors import NeighborIndex
 
-def gridpath( xdim, ydim ):
+class GridPath( object ):
     '''
-    Input:  (xdim) iterable describing the start, stop, and no. steps
-            (ydim) iterable describing the start, stop, and no. steps
-    Output: (path) path through the 2D grid, a list of lists
-                   each element has an index, an address in the gird,
-                   and an address in space
+    Input:  (order) NumPy array, a permutation of the flat
+                    indices of the cells of a grid, i*ny+j for
+                    the cell (i,j), or (i*ny+j)*nz+k for the
+                    cell (i,j,k), in the order they are visited
+            (xrng)  NumPy array of the x coordinates of the grid
+            (yrng)  NumPy array of the y coordinates of the grid
+            (zrng)  NumPy array of the z coordinates of a 3D
+                    grid, or None
+    --------------------------------------------------------
+    Path through a 2D or 3D grid, held as one array of indices;
+    the cell addresses and the coordinates of the cells are
+    worked out from it when they are asked for
     '''
+    def __init__( self, order, xrng, yrng, zrng=None ):
+        self.order = order
+        self.xrng = xrng
+        self.yrng = yrng
+        self.zrng = zrng
+        self.rngs = [ xrng, yrng ] if zrng is None else [ xrng, yrng, zrng ]
+        self.shape = tuple( len( r ) for r in self.rngs )
+
+    def __len__( self ):
+        return len( self.order )
+
+    def cells( self, start=0, stop=None ):
+        '''
+        Output: (i,j)   NumPy arrays of the addresses of the cells
+                        at steps start:stop of the path, (i,j,k)
+                        for a 3D grid
+        '''
+        return np.unravel_index( self.order[start:stop], self.shape )
+
+    def coords( self, start=0, stop=None ):
+        '''
+        Output: (x,y)   NumPy arrays of the coordinates of the cells
+                        at steps start:stop of the path, (x,y,z)
+                        for a 3D grid
+        '''
+        cells = self.cells( start, stop )
+        return tuple( r[c] for r, c in zip( self.rngs, cells ) )
+
+    def __iter__( self ):
+        '''
+        Step through the path, yielding an index, an address in
+        the grid, and an address in space for each cell
+        '''
+        for idx in self.order:
+            cell = tuple( int( c ) for c in np.unravel_index( int( idx ), self.shape ) )
+            yield idx, cell, tuple( r[c] for r, c in zip( self.rngs, cell ) )
+
+def gridpath( xdim, ydim, rng=None, levels=0, zdim=None ):
+    '''
+    Input:  (xdim)   iterable describing the start, stop, and no. steps
+            (ydim)   iterable describing the start, stop, and no. steps
+            (rng)    numpy.random.Generator, or a seed
+            (levels) number of coarser grids to visit first
+            (zdim)   iterable describing the start, stop, and no.
+                     steps in z, for a 3D grid, or None
+    Output: (path)   GridPath through the 2D or 3D grid
+    --------------------------------------------------------
+    Random path through a grid.  With (levels) above zero it is
+    a multigrid path: the cells on every 2**levels-th row and
+    column (and level) are visited first, then those on every
+    2**(levels-1)-th, and so on down to the full grid, in a
+    random order within each level
+    '''
+    rng = np.random.default_rng( rng )
     # dim = ( start, stop, steps )
-    xrng = np.linspace( *xdim )
-    yrng = np.linspace( *ydim )
+    dims = [ xdim, ydim ] if zdim is None else [ xdim, ydim, zdim ]
+    rngs = [ np.linspace( *dim ) for dim in dims ]
+    shape = tuple( int( dim[2] ) for dim in dims )
     # total number of steps in the random path
-    N = xdim[2] * ydim[2]
-    # an array of indices
-    idx = np.arange( N )
+    N = int( np.prod( shape ) )
     # shuffle the indices
-    random.shuffle( idx )
-    # create a list for the path
-    path = list()
-    # create a counter
-    t = 0
-    # for each cell in the x dimension
-    for i in range( xdim[2] ):
-    	# for each cell in the y dimension
-        for j in range( ydim[2] ):
-            # record a shuffled index value, idx[t],
-            # an integer cell address (i,j), and a
-            # physical address in feet, ( xrng[i], yrng[j] )
-            path.append( [ idx[t], (i,j), (xrng[i],yrng[j]) ] )
-            # increment t for the shuffled indices, idx
-	    t += 1
-    # sort the shuffled indices
-    # thereby shuffling the path
-    path.sort()
-    return path
-
-def sgs( data, model, hs, bw, xs, ys=None, pad=0.0 ):
-    '''
-    Input:  (data)   <N,3> NumPy array of data
-            (hs)     NumPy array of distances
-            (bw)     bandwidth of the semivariogram
+    order = rng.permutation( N )
+    if levels > 0:
+        # the coarsest grid each cell in the path lies on
+        cells = np.unravel_index( order, shape )
+        level = np.zeros( N, dtype=np.int8 )
+        for l in range( 1, levels + 1 ):
+            step = 2**l
+            on = np.ones( N, dtype=bool )
+            for c in cells:
+                on &= c % step == 0
+            level[on] = l
+        # coarse to fine, keeping the shuffled order within a level
+        order = order[ np.argsort( -level, kind='stable' ) ]
+    return GridPath( order, *rngs )
+
+def _offsets( radius, spacing ):
+    '''
+    Input:  (radius)  search radius
+            (spacing) spacing of the grid in x, y (and z)
+    Output: (delta)   <K,ndim> NumPy array of the cell offsets
+                      within (radius) of a cell, closest first
+            (dist)    NumPy array of the lengths of the offsets
+    '''
+    reach = [ int( np.ceil( radius / ds ) ) if ds > 0 else 0 for ds in spacing ]
+    axes = np.meshgrid( *[ np.arange( -r, r+1 ) for r in reach ], indexing='ij' )
+    delta = np.column_stack([ a.ravel() for a in axes ])
+    dist = np.sqrt( ( ( delta * np.asarray( spacing ) )**2.0 ).sum( axis=1 ) )
+    # leave out the cell itself, and cells beyond the radius
+    keep = ( dist <= radius ) & np.any( delta != 0, axis=1 )
+    delta, dist = delta[keep], dist[keep]
+    order = np.argsort( dist, kind='stable' )
+    return delta[order], dist[order]
+
+class _SGS( object ):
+    '''
+    Everything sgs() sets up before it visits the first cell:
+    the grid, the index of the data, and the cell offsets used
+    to search the simulated cells.  It is built once and shared
+    by every realization.
+    '''
+    def __init__( self, data, covfct, xs, ys, pad, N, nugget, radius, levels=0, zs=None ):
+        data = np.asarray( data, dtype=float )
+        # a 3D grid for 3D data, with z in the third column
+        ndim = 2 if zs is None else 3
+        self.coords, self.values = data[:,:ndim], data[:,ndim]
+        self.covfct = covfct
+        self.shape = ( xs, ys ) if zs is None else ( xs, ys, zs )
+        self.N = N
+        self.nugget = nugget
+        self.levels = levels
+        # mean and variance of the variable
+        self.mu = np.mean( self.values )
+        self.sill = np.var( self.values )
+        # lay out the grid
+        self.rngs = [ np.linspace( self.coords[:,a].min()-pad, self.coords[:,a].max()+pad, n )
+                      for a, n in enumerate( self.shape ) ]
+        spacing = [ r[1] - r[0] if len( r ) > 1 else 0.0 for r in self.rngs ]
+        if radius is None:
+            radius = 2.0 * np.sqrt( N ) * max( spacing )
+        self.offsets = _offsets( radius, spacing )
+        self.index = NeighborIndex( self.coords, ndim=ndim )
+
+    def __call__( self, rng, M=None ):
+        '''
+        Input:  (rng) numpy.random.Generator for the path and draws
+                (M)   <xs,ys>, or <xs,ys,zs>, NumPy array to write
+                      the realization into, or None
+        Output: (M)   the realization
+        '''
+        shape = self.shape
+        ndim = len( shape )
+        N = self.N
+        coords, values = self.coords, self.values
+        rngs = self.rngs
+        delta, dist = self.offsets
+        # the offsets along each axis, as separate arrays
+        deltas = [ np.ascontiguousarray( d ) for d in delta.T ]
+        Nd = min( N, len( coords ) )
+        # create array for the output, and a mask of the cells
+        # that can be used to condition the cells after them
+        if M is None:
+            M = np.zeros( shape )
+        done = np.zeros( shape, dtype=bool )
+        # random path through the grid
+        dims = [ ( r[0], r[-1], n ) for r, n in zip( rngs, shape ) ]
+        path = gridpath( dims[0], dims[1], rng, self.levels,
+                         dims[2] if ndim == 3 else None ).order
+        # a buffer for the points used to krige a cell, and its index
+        P = np.empty(( Nd + N, ndim + 1 ))
+        nbrs = np.arange( N )[None,:]
+        # the addresses of the cells are worked out a block of the
+        # path at a time, rather than for the whole grid at once
+        block = 2**16
+        # a kriging variance above the sill is drawn with no spread
+        with np.errstate( invalid='ignore' ):
+            for start in range( 0, len( path ), block ):
+                cells = np.unravel_index( path[start:start+block], shape )
+                locs = np.column_stack([ r[c] for r, c in zip( rngs, cells ) ])
+                cells = zip( *[ c.tolist() for c in cells ] )
+                for at, loc in zip( cells, locs ):
+                    # the closest data
+                    d, idx = self.index.nearest( loc, Nd )
+                    if d[0] == 0.0:
+                        # a cell on a datum takes its value, and is left out of the
+                        # simulated cells so that it is not used twice
+                        M[at] = values[ idx[0] ]
+                        continue
+                    nd = len( idx )
+                    P[:nd,:ndim], P[:nd,ndim] = coords[idx], values[idx]
+                    # the closest simulated cells
+                    c = [ i + di for i, di in zip( at, deltas ) ]
+                    inside = ( c[0] >= 0 ) & ( c[0] < shape[0] )
+                    for a in range( 1, ndim ):
+                        inside &= ( c[a] >= 0 ) & ( c[a] < shape[a] )
+                    c, cd = tuple( ci[inside] for ci in c ), dist[inside]
+                    sim = done[c]
+                    c, cd = tuple( ci[sim][:N] for ci in c ), cd[sim][:N]
+                    ns = len( cd )
+                    for a in range( ndim ):
+                        P[nd:nd+ns,a] = rngs[a][ c[a] ]
+                    P[nd:nd+ns,ndim] = M[c]
+                    # keep the N closest of these points
+                    keep = np.argsort( np.r_[ d, cd ], kind='stable' )[:N]
+                    Q = P[keep]
+                    # krige the cell
+                    est, kstd = k._batch( Q[:,:ndim], Q[:,ndim], loc[None,:], nbrs[:,:len( Q )],
+                                          self.covfct, 'simple', self.nugget, self.mu, self.sill )
+                    # draw from the conditional distribution
+                    kstd = kstd[0] if kstd[0] > 0 else 0.0
+                    M[at] = est[0] + kstd * rng.standard_normal()
+                    done[at] = True
+        return M
+
+def sgs( data, covfct, xs, ys=None, pad=0.0, N=8, nugget=0, radius=None, seed=None,
+         levels=0, zs=None ):
+    '''
+    Input:  (data)   <N,3> NumPy array of data, or <N,4> of x,
+                     y, z and the variable for a 3D grid
+            (covfct) covariance function
             (xs)     number of cells in the x dimension
             (ys)     number of cells in the y dimension
-    Output: (M)      <xsteps,ysteps> NumPy array of data
-                     representing the simulated distribution
-                     of the variable of interest 
+            (pad)    distance to extend the grid past the data
+            (N)      number of neighboring points, data or
+                     simulated cells, used to krige each cell
+            (nugget) nugget value
+            (radius) search radius for simulated cells; by
+                     default twice sqrt(N) cells
+            (seed)   seed, or a numpy.random.Generator
+            (levels) number of coarser grids to simulate first,
+                     see gridpath()
+            (zs)     number of cells in the z dimension, for a
+                     3D grid, or None for a 2D one
+    Output: (M)      <xsteps,ysteps>, or <xsteps,ysteps,zsteps>,
+                     NumPy array of data representing the
+                     simulated distribution of the variable
+                     of interest 
+    --------------------------------------------------------
+    Sequential Gaussian simulation.  The cells are visited along
+    a random, optionally multigrid, path; each is kriged, by simple kriging about the
+    mean of the data, from its N closest data and previously
+    simulated cells, and is set to the estimate plus the kriging
+    standard deviation times a standard normal draw.  The data
+    should already be normal scores, see zscoretrans.to_norm().
+
+    The data are searched with a neighbors.NeighborIndex, and the
+    simulated cells by scanning the cells around each cell in
+    order of distance, so that adding a cell costs nothing.  The
+    simulated values are written into a buffer allocated once,
+    and the path is turned into cell addresses a block at a time,
+    so a 3D volume needs little beyond its output and its mask.
     '''
     # check for meshsize in second dimension
-    if ys == None:
-	      ys = xs
-    # create path
-    xdim = ( data[:,0].min()-pad, data[:,0].max()+pad, xs )
-    ydim = ( data[:,1].min()-pad, data[:,1].max()+pad, ys )
-    path = gridpath( xdim, ydim )
-    # create array for the output
-    M = np.zeros((xs,ys))
-    # for each cell in the grid..
-    for step in path :
-        # grab the index, the cell address, and the physical location
-        idx, cell, loc = step
-        # perform the kriging
-        kv = k.krige( data, model, hs, bw, loc, 4 )
-        # add the kriging estimate to the output
-        M[cell[0],cell[1]] = kv
-        # add the kriging estimate to a spatial location
-        newdata = [ loc[0], loc[1], kv ]
-        # add this new point to the data used for kriging
-        data = np.vstack(( data, newdata ))
-    return M
+    if ys is None:
+        ys = xs
+    sim = _SGS( data, covfct, xs, ys, pad, N, nugget, radius, levels, zs )
+    return sim( np.random.default_rng( seed ) )
+
+# state of a worker process, set up once by _initworker()
+_worker = dict()
+
+def _initworker( sim, filename, spec ):
+    '''
+    Give a worker process the shared simulation setup, and
+    attach it to the stack of realizations, on disk or in
+    shared memory
+    '''
+    _worker['sim'] = sim
+    if filename is not None:
+        _worker['out'] = np.lib.format.open_memmap( filename, mode='r+' )
+    else:
+        _worker['shm'], _worker['out'] = k._attach( spec )
+
+def _runworker( r, seq ):
+    '''
+    Simulate realization r from its own seed sequence
+    '''
+    out = _worker['out']
+    _worker['sim']( np.random.default_rng( seq ), out[r] )
+    if isinstance( out, np.memmap ):
+        out.flush()
+
+def realizations( data, covfct, R, xs, ys=None, pad=0.0, N=8, nugget=0, radius=None,
+                  seed=None, n_jobs=1, filename=None, quantiles=None, levels=0, zs=None ):
+    '''
+    Input:  (data)      <N,3> NumPy array of data, or <N,4> of x,
+                        y, z and the variable with (zs)
+            (covfct)    covariance function
+            (R)         number of realizations
+            (seed)      seed for numpy.random.SeedSequence
+            (n_jobs)    number of processes, or one per CPU
+                        for None or -1
+            (filename)  .npy file for the realizations, or None
+                        to keep them in memory
+            (quantiles) sequence of quantiles in [0,1] to compute
+                        at each cell, or None
+    Output: (sims)      <R,xs,ys> realizations, <R,xs,ys,zs> in 3D,
+                        a read-only memmap of (filename) when it
+                        is given
+            (stats)     dictionary of the 'mean' and 'var' of the
+                        realizations at each cell, <xs,ys>, and
+                        their 'quantiles', <Q,xs,ys>, if asked for;
+                        <xs,ys,zs> and <Q,xs,ys,zs> in 3D
+    --------------------------------------------------------
+    Run R realizations of sgs(), the other arguments of which
+    are as for sgs().  Each realization draws from its own
+    stream, spawned from one SeedSequence, so a realization
+    does not depend on the number of processes or on the order
+    in which they finish.  The grid, the index of the data and
+    the search offsets are set up once and shared by the
+    workers; each worker writes its realizations straight into
+    the stacked output.  The mean and variance are updated as
+    each realization is finished, and the quantiles are
+    computed a block of rows at a time, so neither needs all
+    of the realizations in memory at once.
+    '''
+    if ys is None:
+        ys = xs
+    if n_jobs is None or n_jobs < 0:
+        n_jobs = os.cpu_count() or 1
+    sim = _SGS( data, covfct, xs, ys, pad, N, nugget, radius, levels, zs )
+    seqs = np.random.SeedSequence( seed ).spawn( R )
+    shape = ( R, ) + sim.shape
+    shm, spec = None, None
+    if filename is not None:
+        sims = np.lib.format.open_memmap( filename, mode='w+', shape=shape )
+    elif n_jobs > 1:
+        shm, spec = k._zeros( shape )
+        sims = np.ndarray( shape, float, buffer=shm.buf )
+    else:
+        sims = np.zeros( shape )
+    # running mean and sum of squared deviations at each cell
+    mean = np.zeros( sim.shape )
+    m2 = np.zeros( sim.shape )
+    def update( r ):
+        x = np.asarray( sims[r] )
+        delta = x - mean
+        mean[...] += delta / ( r + 1 )
+        m2[...] += delta * ( x - mean )
+    try:
+        if n_jobs > 1:
+            if filename is not None:
+                sims.flush()
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context( 'fork' ) if 'fork' in methods else None
+            with ProcessPoolExecutor( n_jobs, mp_context=context, initializer=_initworker,
+                                      initargs=( sim, filename, spec ) ) as pool:
+                # map() hands back the realizations in order
+                for r, _ in enumerate( pool.map( _runworker, range( R ), seqs ) ):
+                    update( r )
+        else:
+            for r in range( R ):
+                sim( np.random.default_rng( seqs[r] ), sims[r] )
+                update( r )
+        stats = { 'mean': mean, 'var': m2 / max( R, 1 ) }
+        if quantiles is not None:
+            q = np.zeros( ( len( quantiles ), ) + sim.shape )
+            rows = max( 1, 2**22 // max( R * int( np.prod( sim.shape[1:] ) ), 1 ) )
+            for i in range( 0, xs, rows ):
+                q[:,i:i+rows] = np.quantile( sims[:,i:i+rows], quantiles, axis=0 )
+            stats['quantiles'] = q
+        if shm is not None:
+            sims = sims.copy()
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    if filename is not None:
+        sims.flush()
+        del sims
+        sims = np.lib.format.open_memmap( filename, mode='r' )
+    return sims, stats
@@ -1,57 +1,415 @@
 #!/usr/bin/env python
 
+import os
+import re
+import json
+import hashlib
+import itertools
+import warnings
 import scipy
 import scipy.stats
 import numpy as np
-from scipy.spatial.distance import pdist, squareform
+from scipy.spatial.distance import pdist, squareform, cdist
 
-def readGeoEAS( fn ):
+def _readheader( f ):
     '''
-    Input:  (fn)   filename describing a GeoEAS file
-    Output: (data) NumPy array
-    --------------------------------------------------
-    Read GeoEAS files as described by the GSLIB manual
+    Read the title and the variable names from the top of
+    an open GeoEAS file, leaving it at the first row of data
     '''
-    f = open( fn, "r" )
     # title of the data set
-    title = f.readline()
+    title = f.readline().strip()
     # number of variables
-    nvar = int( f.readline() )
+    nvar = int( f.readline().split()[0] )
     # variable names
     columns = [ f.readline().strip() for i in range( nvar ) ]
-    # make a list for the data
-    data = list()
-    # for each line of the data
-    while True:
-        # read a line
-        line = f.readline()
-        # if that line is empty
-        if line == '':
-            # the jump out of the while loop
-            break
-        # otherwise, append that line to the data list
-        else:
-            data.append( line )
-    # strip off the newlines, and split by whitespace
-    data = [ i.strip().split() for i in data ]
-    # turn a list of list of strings into an array of floats
-    data = np.array( data, dtype=np.float )
-    # combine the data with the variable names into a DataFrame
-    # df = pandas.DataFrame( data, columns=columns,  )
+    return title, columns
+
+def _parse( lines, nvar, missing ):
+    '''
+    Parse rows of numbers in bulk into an <N,nvar> array, with
+    the values equal to the missing value code(s) set to NaN
+    '''
+    data = np.loadtxt( lines, dtype=float, ndmin=2 )
+    if data.size == 0:
+        data = data.reshape( 0, nvar )
+    if missing is not None:
+        data[ np.isin( data, missing ) ] = np.nan
+    return data
+
+def readGeoEASHeader( fn ):
+    '''
+    Input:  (fn)      filename describing a GeoEAS file
+    Output: (title)   title of the data set
+            (columns) list of the variable names
+    '''
+    with open( fn, "r" ) as f:
+        return _readheader( f )
+
+def readGeoEAS( fn, header=False, missing=None, cache=None ):
+    '''
+    Input:  (fn)      filename describing a GeoEAS file
+            (header)  also return the variable names
+            (missing) missing value code, or a list of them,
+                      e.g., -999; these values are read as NaN
+            (cache)   GeoEASCache, or the name of its directory,
+                      to keep the parsed file in
+    Output: (data)    NumPy array, read-only when it is mapped
+                      from the cache
+            (columns) list of the variable names, with (header)
+    --------------------------------------------------
+    Read GeoEAS files as described by the GSLIB manual
+    '''
+    if cache is not None:
+        if not isinstance( cache, GeoEASCache ):
+            cache = GeoEASCache( cache )
+        data, columns = cache.load( fn, missing )
+    else:
+        with open( fn, "r" ) as f:
+            title, columns = _readheader( f )
+            # parse the rest of the file as one block of numbers
+            data = _parse( f, len( columns ), missing )
+    if header:
+        return data, columns
     return data
+
+# the files of a GeoEASCache entry, or of one being written;
+# anything else in its directory is left alone
+_CACHEFILE = re.compile( r'^[0-9a-f]{40}(\.\d+\.tmp)?\.(npy|json)$' )
+
+class GeoEASCache( object ):
+    '''
+    Input:  (directory) directory to keep the cache in
+            (maxbytes)  size of the cache, past which the least
+                        recently used files are evicted
+    --------------------------------------------------
+    Cache of parsed GeoEAS files.  Each file is stored as a
+    column-major .npy file, with its title and variable names
+    in a .json file beside it, under a key made from the path,
+    size, and modification time of the source, so a changed
+    source is parsed again.  Later loads memory-map the .npy
+    file rather than parsing any text.  Only these files count
+    toward (maxbytes) or are removed, so the directory may hold
+    others.
+    '''
+    def __init__( self, directory, maxbytes=2**30 ):
+        self.directory = directory
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir( directory ):
+            os.makedirs( directory )
+
+    def key( self, fn, missing=None ):
+        '''
+        Input:  (fn)      filename of a GeoEAS file
+                (missing) missing value code(s) it is read with
+        Output: (key)     name of the cache entry for the file
+        '''
+        st = os.stat( fn )
+        if missing is not None:
+            missing = np.atleast_1d( missing ).tolist()
+        source = [ os.path.abspath( fn ), st.st_size, st.st_mtime_ns, missing ]
+        return hashlib.sha1( json.dumps( source ).encode() ).hexdigest()
+
+    def load( self, fn, missing=None ):
+        '''
+        Input:  (fn)      filename of a GeoEAS file
+                (missing) missing value code(s), as for readGeoEAS()
+        Output: (data)    read-only memmap of the data
+                (columns) list of the variable names
+        '''
+        base = os.path.join( self.directory, self.key( fn, missing ) )
+        if os.path.exists( base + '.npy' ) and os.path.exists( base + '.json' ):
+            self.hits += 1
+            # mark the entry as recently used
+            os.utime( base + '.npy' )
+        else:
+            self.misses += 1
+            with open( fn, "r" ) as f:
+                title, columns = _readheader( f )
+                data = _parse( f, len( columns ), missing )
+            # write to temporary names, then move them into place,
+            # so that a reader never sees half of an entry
+            tmp = '{}.{}.tmp'.format( base, os.getpid() )
+            with open( tmp + '.npy', 'wb' ) as f:
+                np.save( f, np.asfortranarray( data ) )
+            with open( tmp + '.json', 'w' ) as f:
+                json.dump( { 'source': os.path.abspath( fn ), 'title': title,
+                             'columns': columns }, f )
+            os.replace( tmp + '.json', base + '.json' )
+            os.replace( tmp + '.npy', base + '.npy' )
+            self.evict( keep=base + '.npy' )
+        with open( base + '.json' ) as f:
+            columns = json.load( f )['columns']
+        return np.load( base + '.npy', mmap_mode='r' ), columns
+
+    def _files( self ):
+        '''
+        Output: paths of the files of the cache in its directory
+        '''
+        return [ os.path.join( self.directory, name )
+                 for name in os.listdir( self.directory ) if _CACHEFILE.match( name ) ]
+
+    def nbytes( self ):
+        '''
+        Output: total size of the files in the cache
+        '''
+        return sum( os.path.getsize( path ) for path in self._files() )
+
+    def evict( self, keep=None ):
+        '''
+        Remove the least recently used entries until the cache
+        is no larger than (maxbytes), sparing the entry (keep)
+        '''
+        entries = list()
+        total = 0
+        for path in self._files():
+            size = os.path.getsize( path )
+            total += size
+            if path.endswith( '.npy' ) and not path.endswith( '.tmp.npy' ):
+                meta = path[:-4] + '.json'
+                if os.path.exists( meta ):
+                    size += os.path.getsize( meta )
+                entries.append(( os.path.getmtime( path ), path, size ))
+        for used, path, size in sorted( entries ):
+            if total <= self.maxbytes:
+                break
+            if path == keep:
+                continue
+            for fn in ( path, path[:-4] + '.json' ):
+                if os.path.exists( fn ):
+                    os.remove( fn )
+            total -= size
+
+    def clear( self ):
+        '''
+        Remove every entry from the cache
+        '''
+        for path in self._files():
+            os.remove( path )
+
+def iterGeoEAS( fn, chunksize=1000000, missing=None ):
+    '''
+    Input:  (fn)        filename describing a GeoEAS file
+            (chunksize) number of rows in each chunk
+            (missing)   missing value code(s), as for readGeoEAS()
+    Output:             generator of NumPy arrays of at most
+                        (chunksize) rows of the data
+    --------------------------------------------------
+    Read a GeoEAS file a chunk at a time, for files too
+    large to read at once; see readGeoEASHeader() for the
+    variable names
+    '''
+    with open( fn, "r" ) as f:
+        title, columns = _readheader( f )
+        while True:
+            lines = list( itertools.islice( f, chunksize ) )
+            if not lines:
+                break
+            yield _parse( lines, len( columns ), missing )
+
+def writeGeoEAS( fn, data, columns, title='', missing=None, fmt='%.7g', chunksize=1000000 ):
+    '''
+    Input:  (fn)        filename for the GeoEAS file
+            (data)      NumPy array, or memmap, with one column per
+                        variable; a 1D array is one variable
+            (columns)   list of the variable names
+            (title)     title of the data set
+            (missing)   missing value code written in place of NaN
+            (fmt)       format of the numbers
+            (chunksize) number of rows written at a time
+    --------------------------------------------------
+    Write a GeoEAS file as described by the GSLIB manual,
+    e.g., to export kriged or simulated grids; the rows are
+    formatted a chunk at a time, so a memmap is never read
+    into memory all at once
+    '''
+    if np.ndim( data ) == 1:
+        data = data.reshape( -1, 1 )
+    if data.shape[1] != len( columns ):
+        raise ValueError('There are {} columns of data, and {} names'.format( data.shape[1], len( columns ) ))
+    with open( fn, "w" ) as f:
+        f.write( title + '\n' )
+        f.write( '{}\n'.format( len( columns ) ) )
+        for name in columns:
+            f.write( name + '\n' )
+        for i in range( 0, len( data ), chunksize ):
+            chunk = np.asarray( data[i:i+chunksize], dtype=float )
+            if missing is not None:
+                chunk = np.where( np.isnan( chunk ), missing, chunk )
+            np.savetxt( f, chunk, fmt=fmt )
     
-def pairwise( data ):
+def pairwise( data, condensed=False, dtype=None, ndim=2 ):
     '''
-    Input:  (data) NumPy array where the first two columns
-                   are the spatial coordinates, x and y
+    Input:  (data)      NumPy array where the first (ndim) columns
+                        are the spatial coordinates, x, y (and z)
+            (condensed) if True, return only the n*(n-1)/2 distances
+                        above the diagonal, as from scipy's pdist()
+            (dtype)     NumPy dtype of the distances, e.g. np.float32
+                        to halve the memory used; float64 by default
+            (ndim)      number of spatial coordinates, 2 or 3
+    Output:             square, or condensed, array of the distances
+    --------------------------------------------------------
+    For large data sets see tiles() and pairlist(), which never
+    hold all n**2 distances at once
     '''
     # determine the size of the data
     npoints, cols = data.shape
+    d = pdist( data[:,:ndim] )
+    if dtype is not None:
+        d = d.astype( dtype, copy=False )
+    if condensed:
+        return d
     # give a warning for large data sets
     if npoints > 10000:
-        print("You have more than 10,000 data points, this might take a minute.")
+        warnings.warn( "pairwise() of %d points builds a %d x %d matrix; "
+                       "use tiles() or pairlist() to bound the memory"
+                       % ( npoints, npoints, npoints ), RuntimeWarning )
     # return the square distance matrix
-    return squareform( pdist( data[:,:2] ) )
+    return squareform( d )
+
+def tiles( data, other=None, blocksize=None, dtype=None, ndim=2 ):
+    '''
+    Input:  (data)      NumPy array where the first (ndim) columns
+                        are the spatial coordinates, x, y (and z)
+            (other)     second array of points, or None for (data)
+            (blocksize) rows and columns in one tile; by default
+                        as many as fit in about 2**22 distances
+            (dtype)     NumPy dtype of the tiles, float64 by default
+            (ndim)      number of spatial coordinates, 2 or 3
+    Output:             generator of ( rows, cols, tile ), where
+                        (rows) and (cols) are slices of (data) and
+                        (other), and (tile) is the dense block of
+                        the distance matrix between them
+    --------------------------------------------------------
+    The full matrix is pairwise( data ), or cdist( data, other ),
+    computed one tile at a time so that only one tile is in
+    memory at once; for (other) of None only the tiles on or
+    above the diagonal are yielded
+    '''
+    xy = np.asarray( data, dtype=float )[:,:ndim]
+    if other is None:
+        uv = xy
+    else:
+        uv = np.asarray( other, dtype=float )[:,:ndim]
+    if blocksize is None:
+        blocksize = int( np.sqrt( _PAIR_ELEMENTS ) )
+    for s in range( 0, len( xy ), blocksize ):
+        rows = slice( s, min( s + blocksize, len( xy ) ) )
+        # the lower triangle mirrors the upper one
+        start = s if other is None else 0
+        for t in range( start, len( uv ), blocksize ):
+            cols = slice( t, min( t + blocksize, len( uv ) ) )
+            tile = cdist( xy[rows], uv[cols] )
+            if dtype is not None:
+                tile = tile.astype( dtype, copy=False )
+            yield rows, cols, tile
+
+# number of distances computed together in one block of pairs
+_PAIR_ELEMENTS = 2**22
+
+def pairblocks( data, maxdist=None, dtype=None, ndim=2 ):
+    '''
+    Input:  (data)    NumPy array where the first (ndim) columns
+                      are the spatial coordinates, x, y (and z)
+            (maxdist) largest distance of interest, or None
+            (dtype)   NumPy dtype of the distances, float64 by default
+            (ndim)    number of spatial coordinates, 2 or 3
+    Output:           generator of ( i, j, d ) NumPy arrays, each
+                      block holding rows i < j of (data) for pairs
+                      of points no more than (maxdist) apart, and
+                      the distances d between them
+    --------------------------------------------------------
+    Visit every pair of points once without forming the full
+    distance matrix: the points are swept along the axis over
+    which they spread the furthest, a block of rows at a time,
+    against only the columns within (maxdist) along that axis,
+    so the memory used is bounded by the block size rather than
+    growing as n**2.  The long axis makes the slab of columns
+    in reach of a row the thinnest part of the cloud, e.g. along
+    the strike of a set of drillholes rather than across it.
+    '''
+    xy = np.asarray( data, dtype=float )[:,:ndim]
+    n = len( xy )
+    axis = int( np.argmax( np.ptp( xy, axis=0 ) ) ) if n else 0
+    order = np.argsort( xy[:,axis], kind='stable' )
+    xy = xy[order]
+    x = xy[:,axis]
+    s = 0
+    while s < n:
+        # size the block from the columns in reach of its first row
+        if maxdist is None:
+            width = n - s
+        else:
+            width = np.searchsorted( x, x[s] + maxdist, side='right' ) - s
+        e = min( n, s + max( 1, _PAIR_ELEMENTS // max( width, 1 ) ) )
+        while True:
+            if maxdist is None:
+                hi = n
+            else:
+                hi = np.searchsorted( x, x[e-1] + maxdist, side='right' )
+            # halve the block while its rows reach too many columns
+            if ( e - s ) * ( hi - s ) <= _PAIR_ELEMENTS or e - s == 1:
+                break
+            e = s + ( e - s ) // 2
+        d = cdist( xy[s:e], xy[s:hi] )
+        # each pair once, from a row to the columns after it
+        keep = np.arange( hi - s )[None,:] > np.arange( e - s )[:,None]
+        if maxdist is not None:
+            keep &= d <= maxdist
+        p, q = np.nonzero( keep )
+        i, j = order[ s + p ], order[ s + q ]
+        d = d[ p, q ]
+        if dtype is not None:
+            d = d.astype( dtype, copy=False )
+        yield np.minimum( i, j ), np.maximum( i, j ), d
+        s = e
+
+def pairlist( data, maxdist, dtype=None, ndim=2 ):
+    '''
+    Input:  (data)    NumPy array where the first (ndim) columns
+                      are the spatial coordinates, x, y (and z)
+            (maxdist) largest distance of interest
+            (dtype)   NumPy dtype of the distances, float64 by default
+            (ndim)    number of spatial coordinates, 2 or 3
+    Output:           ( i, j, d ), a sparse list of the pairs of rows
+                      i < j of (data) no more than (maxdist) apart,
+                      sorted by i then j, and their distances d
+    --------------------------------------------------------
+    The memory used grows with the number of pairs within
+    (maxdist) rather than with n**2; variograms.lagindices()
+    and the geoplot functions accept the result in place of
+    a square distance matrix
+    '''
+    blocks = list( pairblocks( data, maxdist, dtype, ndim ) )
+    if not blocks:
+        return ( np.empty( 0, dtype=np.intp ), np.empty( 0, dtype=np.intp ),
+                 np.empty( 0, dtype=dtype or float ) )
+    i, j, d = [ np.concatenate( b ) for b in zip( *blocks ) ]
+    # the same order as np.where() over the upper triangle
+    order = np.lexsort( ( j, i ) )
+    return i[order], j[order], d[order]
+
+def gridpoints( origin, spacing, shape, start=0, stop=None ):
+    '''
+    Input:  (origin)  x, y (and z) coordinates of the first grid node
+            (spacing) distance between nodes in x, y (and z)
+            (shape)   number of nodes in x, y (and z)
+            (start)   first flat index of the nodes to return
+            (stop)    one past the last flat index, or None
+    Output: (points)  <stop-start,2>, or <stop-start,3>, NumPy array
+                      of the coordinates of nodes start:stop
+    --------------------------------------------------------
+    Nodes are numbered with x as the first axis, so flat index
+    i*ny+j is the node (i,j) at x0+i*dx, y0+j*dy, and in 3D
+    (i*ny+j)*nz+k is the node (i,j,k); this lets a large grid,
+    or volume, be generated a piece at a time
+    '''
+    size = int( np.prod( shape ) )
+    if stop is None:
+        stop = size
+    cells = np.unravel_index( np.arange( start, min( stop, size ) ), shape )
+    return np.column_stack([ origin[a] + c * spacing[a] for a, c in enumerate( cells ) ])
 
 def degree_to_bearing( deg ):
     bearing = None
@@ -71,67 +429,47 @@ def bearing( p0, p1 ):
     '''
     Input:  (p0,p1) two iterables representing x and y coordinates
     Output:         the bearing, a degree in the range [0,360) from
-                    due North clockwise aroung the compass face
+                    due North clockwise aroung the compass face,
+                    as from azimuths()
     '''
     y = p1[1] - p0[1]
     x = p1[0] - p0[0]
-    rad, deg = None, None
-    if x != 0:
-        rad = np.arctan( y / float( x ) )
-        deg = np.rad2deg( rad )
-    else:
-        if y > 0:
-            deg = 90
-        elif y < 0:
-            deg = 270
-    if( x < 0 )&( y > 0 ):
-        deg = 180 + deg
-    elif( x < 0 )&( y < 0 ):
-        deg = 270 - deg
-    elif( x > 0 )&( y < 0 ):
-        deg = 360 + deg
-    return degree_to_bearing( deg )
+    if x == 0 and y == 0:
+        raise ValueError('The points coincide, so they have no bearing')
+    return float( azimuths( x, y ) )
+
+def azimuths( dx, dy ):
+    '''
+    Input:  (dx,dy) NumPy arrays of the x and y components of
+                    vectors between pairs of points
+    Output:         NumPy array of bearings, degrees in [0,360)
+                    from due North clockwise, as from bearing()
+    '''
+    return ( 90.0 - np.rad2deg( np.arctan2( dy, dx ) ) ) % 360.0
 
 def bearings( data, indices ):
     '''
     Input:  (data)    the original data set: x, y, variable
             (indices) the output of variograms.lagindices()
-    Output:           a list of list of bearings corresponding
-                      to variograms.lagindices()
-    '''
-    # indices is a list of lists
-    # each list in indices represents a set of points at a certain lag
-    # for a given lag, we have a list of index pairs
-    # each pair represents the indices of two points in the data set having a given lag
-    # --deep breath--
-    # for each lag-set, we go through all of the index-pairs, and calculate the bearing
-    # in the end, instead of a list of lag-sets containing index-pairs,
-    # we have a list of lag-sets containing bearings
-    return [ bearing( *data[ idx ] ) for idx in indices ]
+    Output:           NumPy array of the bearings from the first
+                      to the second point of each pair in (indices)
+    '''
+    # each row of indices is a pair of rows of the data set having
+    # a given lag; the bearings of all of the pairs are computed at once
+    indices = np.asarray( indices, dtype=int ).reshape( -1, 2 )
+    head, tail = data[ indices[:,0] ], data[ indices[:,1] ]
+    return azimuths( tail[:,0] - head[:,0], tail[:,1] - head[:,1] )
 
 def inangle( theta, angle, atol ):
     '''
-    Input:  (theta) angle inquestion
+    Input:  (theta) angle inquestion, a scalar or NumPy array
             (angle) reference angle
             (atol)  tolerance about (angle)
     Output:         True or False, depending on whether
-                    theta is in [angle-atol,angle+atol)
+                    theta is in [angle-atol,angle+atol),
+                    wrapping around the compass; elementwise
+                    for an array
     '''
     lower = angle - atol
-    upper = angle + atol
-    if( lower >= 0 )&( upper <= 360 ):
-        if( theta >= lower )&( theta < upper ):
-            return True
-    if( lower < 0 ):
-        lower %= 360
-        if( theta > upper )&( theta >= lower ):
-            return True
-        elif( theta >= 0 )&( theta < upper ):
-            return True
-    if( upper > 360 ):
-        upper %= 360
-        if( theta >= lower )&( theta < 0 ):
-            return True
-        if( theta >= 0 )&( theta < upper ):
-            return True
-    return False
+    # the distance clockwise from the lower bound to theta
+    return ( np.asarray( theta ) - lower ) % 360 < 2 * atol
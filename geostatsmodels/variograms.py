@@ -2,11 +2,13 @@
 import numpy as np
 
 import geostatsmodels.utilities as utilities
+from geostatsmodels.profiling import stage
 
 
 def lagindices(pwdist, lag, tol):
     '''
-    Input:  (pwdist) square NumPy array of pairwise distances
+    Input:  (pwdist) square NumPy array of pairwise distances, or
+                     the ( i, j, d ) pair list of utilities.pairlist()
             (lag)    the distance, h, between points
             (tol)    the tolerance we are comfortable with around (lag)
     Output: (ind)    list of tuples; the first element is the row of
@@ -14,6 +16,11 @@ def lagindices(pwdist, lag, tol):
                      of a point (lag)+/-(tol) away from the first point,
                      e.g., (3,5) corresponds fo data[3,:], and data[5,:]
     '''
+    if isinstance(pwdist, tuple):
+        # a sparse pair list already holds each pair once, i < j
+        i, j, d = pwdist
+        keep = (d >= lag - tol) & (d < lag + tol)
+        return np.c_[i[keep], j[keep]]
     # grab the coordinates in a given range: lag +/- tolerance
     i, j = np.where((pwdist >= lag - tol) & (pwdist < lag + tol))
     # take out the repeated elements,
@@ -27,7 +34,8 @@ def anilagindices(data, pwdist, lag, tol, angle, atol):
     Input:  (data)   NumPy array where the frist two columns
                      are the spatial coordinates, x and y, and
                      the third column is the variable of interest
-            (pwdist) square NumPy array of pairwise distances
+            (pwdist) square NumPy array of pairwise distances, or
+                     the ( i, j, d ) pair list of utilities.pairlist()
             (lag)    the distance, h, between points
             (tol)    the tolerance we are comfortable with around (lag)
             (angle)  float, [0,360), North = 0 --> 360 clockwise
@@ -35,20 +43,19 @@ def anilagindices(data, pwdist, lag, tol, angle, atol):
     '''
     index = lagindices(pwdist, lag, tol)
     brngs = utilities.bearings(data, index)
-    bridx = list(zip(brngs, index))
-    index = [idx.tolist() for br, idx in bridx if utilities.inangle(br, angle, atol)]
-    # add 180 to the angle and take the modulus
-    angle = (angle + 180) % 360
-    index += [idx.tolist() for br, idx in bridx if utilities.inangle(br, angle, atol)]
-    return np.array(index)
+    # pairs about the angle, then about the opposite angle
+    ahead = utilities.inangle(brngs, angle, atol)
+    behind = utilities.inangle(brngs, (angle + 180) % 360, atol)
+    return np.r_[index[ahead], index[behind]]
 
 
-def semivariance(data, indices):
+def semivariance(data, indices, ndim=2):
     '''
-    Input:  (data)    NumPy array where the first two columns
-                      are the spatial coordinates, x and y, and
-                      the third column is the variable of interest
+    Input:  (data)    NumPy array where the first (ndim) columns
+                      are the spatial coordinates, x, y (and z),
+                      and the next is the variable of interest
             (indices) indices of paired data points in (data)
+            (ndim)    number of spatial coordinates, 2 or 3
     Output:  (z)      semivariance value at lag (h) +/- (tol)
     '''
     # take the squared difference between
@@ -56,66 +63,238 @@ def semivariance(data, indices):
     # the semivariance is half the mean squared difference
     i=indices[:, 0]
     j=indices[:, 1]
-    z=(data[i, 2] - data[j, 2])**2.0
+    z=(data[i, ndim] - data[j, ndim])**2.0
     return np.mean(z) / 2.0
 
 
-def semivariogram(data, lags, tol):
+def semivariogram(data, lags, tol, ndim=2, counts=False):
     '''
-    Input:  (data) NumPy array where the first two columns
-                   are the spatial coordinates, x and y
+    Input:  (data) NumPy array where the first (ndim) columns
+                   are the spatial coordinates, x, y (and z)
             (lag)  the distance, h, between points
             (tol)  the tolerance we are comfortable with around (lag)
-    Output: (sv)   <2xN> NumPy array of lags and semivariogram values
+            (ndim) number of spatial coordinates, 2 or 3
+            (counts) True to add the number of pairs at each lag
+    Output: (sv)   <2xN> NumPy array of lags and semivariogram values,
+                   or <3xN> with the number of pairs
     '''
-    return variogram(data, lags, tol, 'semivariogram')
+    return variogram(data, lags, tol, 'semivariogram', ndim=ndim, counts=counts)
 
 
-def covariance(data, indices):
+def covariance(data, indices, ndim=2):
     '''
-    Input:  (data) NumPy array where the first two columns
-                   are the spatial coordinates, x and y
+    Input:  (data) NumPy array where the first (ndim) columns
+                   are the spatial coordinates, x, y (and z)
             (lag)  the distance, h, between points
             (tol)  the tolerance we are comfortable with around (lag)
+            (ndim) number of spatial coordinates, 2 or 3
     Output:  (z)   covariance value at lag (h) +/- (tol)
     '''
     # grab the indices of the points
     # that are lag +/- tolerance apart
     i=indices[:, 0]
     j=indices[:, 1]
-    return np.cov(data[i, 2], data[j, 2])[0][1]
+    return np.cov(data[i, ndim], data[j, ndim])[0][1]
 
 
-def covariogram(data, lags, tol):
+def covariogram(data, lags, tol, ndim=2, counts=False):
     '''
-    Input:  (data) NumPy array where the first two columns
-                   are the spatial coordinates, x and y
+    Input:  (data) NumPy array where the first (ndim) columns
+                   are the spatial coordinates, x, y (and z)
             (lag)  the distance, h, between points
             (tol)  the tolerance we are comfortable with around (lag)
-    Output: (cv)   <2xN> NumPy array of lags and covariogram values
+            (ndim) number of spatial coordinates, 2 or 3
+            (counts) True to add the number of pairs at each lag
+    Output: (cv)   <2xN> NumPy array of lags and covariogram values,
+                   or <3xN> with the number of pairs
     '''
-    return variogram(data, lags, tol, 'covariogram')
+    return variogram(data, lags, tol, 'covariogram', ndim=ndim, counts=counts)
 
 
-def variogram(data, lags, tol, method):
+def _lagbins(d, lags, tol):
     '''
-    Input:  (data) NumPy array where the first two columns
-                   are the spatial coordinates, x and y
+    Input:  (d)    NumPy array of distances
+            (lags) NumPy array of lag distances
+            (tol)  the tolerance about each lag
+    Output:        generator of ( lag, mask ), the position of a lag
+                   in (lags) and a boolean mask of (d) within
+                   (tol) of it; or a single ( bins, mask ) pair with
+                   the lag position of each masked distance when
+                   the lags do not overlap
+    '''
+    order = np.argsort(lags, kind='stable')
+    lo = lags[order] - tol
+    hi = lags[order] + tol
+    if np.all(lo[1:] >= hi[:-1]):
+        # interleave the bounds of the lags; a distance falls inside
+        # a lag when an odd number of bounds are at or below it
+        edges = np.c_[lo, hi].ravel()
+        k = np.searchsorted(edges, d, side='right')
+        mask = k % 2 == 1
+        yield order[k[mask] // 2], mask
+    else:
+        for lag in range(len(lags)):
+            yield lag, (d >= lags[lag] - tol) & (d < lags[lag] + tol)
+
+
+def lagsums(data, lags, tol, stats=None, ndim=2):
+    '''
+    Input:  (data) NumPy array where the first (ndim) columns
+                   are the spatial coordinates, x, y (and z),
+                   and the next is the variable of interest
+            (lags) the distances, h, between points
+            (tol)  the tolerance we are comfortable with around (lag)
+            (stats) profiling.Stats to record the time spent on the
+                   pairs and the lags, or None
+            (ndim) number of spatial coordinates, 2 or 3
+    Output: (sums) <5xN> NumPy array; for each lag, the number of
+                   pairs, the sum of their squared differences,
+                   the sums of the head and of the tail values, and
+                   the sum of the products of the heads and tails
+    ----------------------------------------------------------------
+    The pairs are streamed from utilities.pairblocks() and only
+    these sums are kept, so the memory used does not grow with
+    the number of pairs.  The values are centered on their mean
+    before they are summed; the head of a pair is its point with
+    the lower row in (data), as in lagindices().
+    '''
+    lags = np.atleast_1d(np.asarray(lags, dtype=float))
+    z = data[:, ndim] - np.mean(data[:, ndim])
+    sums = np.zeros((5, len(lags)))
+    blocks = utilities.pairblocks(data, lags.max() + tol, ndim=ndim)
+    while True:
+        with stage(stats, 'pairs'):
+            block = next(blocks, None)
+        if block is None:
+            break
+        i, j, d = block
+        with stage(stats, 'binning'):
+            for lag, mask in _lagbins(d, lags, tol):
+                head, tail = z[i[mask]], z[j[mask]]
+                terms = [np.ones(len(head)), (head - tail)**2.0, head, tail, head * tail]
+                if np.ndim(lag) == 0:
+                    sums[:, lag] += [t.sum() for t in terms]
+                else:
+                    for k, t in enumerate(terms):
+                        sums[k] += np.bincount(lag, t, minlength=len(lags))
+    return sums
+
+
+def _sectorbins(angles, atol):
+    '''
+    Input:  (angles) the directions of the sectors, [0,360)
+            (atol)   number of degrees about each angle
+    Output:          ( start, step, group ), when the sectors, folded
+                     onto [0,180) with their opposite directions, are
+                     evenly spaced by (step) from (start) and do not
+                     overlap, with the folded sector of each angle in
+                     (group); None otherwise
+    '''
+    folded, group = np.unique(angles % 180.0, return_inverse=True)
+    step = 180.0 / len(folded)
+    even = np.allclose(np.diff(folded), step, rtol=0, atol=1e-9)
+    if not even or 2 * atol > step + 1e-9:
+        return None
+    return folded[0] - atol, step, np.ravel(group)
+
+
+def directional(data, lags, tol, angles, atol, ndim=2):
+    '''
+    Input:  (data)   NumPy array where the first (ndim) columns
+                     are the spatial coordinates, x, y (and z),
+                     and the next is the variable of interest
+            (lags)   the distances, h, between points
+            (tol)    the tolerance we are comfortable with around (lag)
+            (angles) the directions of the sectors, [0,360),
+                     North = 0 --> 360 clockwise
+            (atol)   number of degrees about each angle to consider
+            (ndim)   number of spatial coordinates, 2 or 3
+    Output: (sv)     <SxN> NumPy array of the semivariance in each
+                     of S sectors at each of N lags, NaN where a
+                     sector has no pairs at a lag
+    ----------------------------------------------------------------
+    Directional semivariograms for all of the sectors at once.  The
+    pairs are streamed from utilities.pairblocks(), and the bearing
+    of every pair in a block is found in one pass; as in
+    anilagindices(), a pair counts toward a sector when its bearing
+    is within (atol) of the angle or of the opposite angle.  When
+    the sectors do not overlap, e.g. when they tile the circle, the
+    sector of each pair is worked out from its bearing and all of
+    the sectors and lags are counted with one np.bincount(); as in
+    _lagbins(), overlapping sectors are counted one at a time.  In
+    3D the lags are 3D distances, and the bearings are those of the
+    pairs projected onto the horizontal plane.
+    '''
+    lags = np.atleast_1d(np.asarray(lags, dtype=float))
+    angles = np.atleast_1d(np.asarray(angles, dtype=float))
+    L = len(lags)
+    bins = _sectorbins(angles, atol)
+    # one row per sector, or per folded sector when they tile
+    S = len(angles) if bins is None else bins[2].max() + 1
+    n = np.zeros((S, L))
+    ssd = np.zeros((S, L))
+    for i, j, d in utilities.pairblocks(data, lags.max() + tol, ndim=ndim):
+        brngs = utilities.azimuths(data[j, 0] - data[i, 0], data[j, 1] - data[i, 1])
+        sq = (data[i, ndim] - data[j, ndim])**2.0
+        for lag, mask in _lagbins(d, lags, tol):
+            b, z = brngs[mask], sq[mask]
+            if bins is not None:
+                start, step, group = bins
+                # the folded bearing from the start of the first
+                # sector, its sector, and whether it falls inside
+                r = (b - start) % 180.0
+                k = np.floor(r / step)
+                ins = (r - k * step < 2 * atol) & (k < S)
+                lag = lag[ins] if np.ndim(lag) else lag
+                cell = k[ins].astype(int) * L + lag
+                n += np.bincount(cell, minlength=S * L).reshape(S, L)
+                ssd += np.bincount(cell, z[ins], minlength=S * L).reshape(S, L)
+                continue
+            for s, angle in enumerate(angles):
+                ins = (utilities.inangle(b, angle, atol) |
+                       utilities.inangle(b, (angle + 180) % 360, atol))
+                if np.ndim(lag) == 0:
+                    n[s, lag] += ins.sum()
+                    ssd[s, lag] += z[ins].sum()
+                else:
+                    n[s] += np.bincount(lag[ins], minlength=L)
+                    ssd[s] += np.bincount(lag[ins], z[ins], minlength=L)
+    if bins is not None:
+        n, ssd = n[bins[2]], ssd[bins[2]]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return ssd / n / 2.0
+
+
+def variogram(data, lags, tol, method, stats=None, ndim=2, counts=False):
+    '''
+    Input:  (data) NumPy array where the first (ndim) columns
+                   are the spatial coordinates, x, y (and z)
             (lag)  the distance, h, between points
             (tol)  the tolerance we are comfortable with around (lag)
             (method) either 'semivariogram', or 'covariogram'
-    Output: (cv)   <2xN> NumPy array of lags and variogram values
+            (stats) profiling.Stats to record the time spent on the
+                   pairs and the lags, or None
+            (ndim) number of spatial coordinates, 2 or 3
+            (counts) True to add the number of pairs at each lag,
+                   e.g. to weight a fit with model.fitparams()
+    Output: (cv)   <2xN> NumPy array of lags and variogram values,
+                   or <3xN> with the number of pairs
     '''
-    # calculate the pairwise distances
-    pwdist = utilities.pairwise(data)
-    # create a list of lists of indices of points having the ~same lag
-    index = [lagindices(pwdist, lag, tol) for lag in lags]
+    # accumulate the sums over the pairs at each lag
+    n, ssd, shead, stail, sprod = lagsums(data, lags, tol, stats, ndim)
     # remove empty "lag" sets, prevents zero division error in [co|semi]variance()
-    index = list(filter(lambda x: len(x) > 0, index))
+    keep = n > 0
+    n, ssd, shead, stail, sprod = n[keep], ssd[keep], shead[keep], stail[keep], sprod[keep]
+    lags = np.atleast_1d(lags)[keep]
     # calculate the variogram at different lags given some tolerance
     if method in ['semivariogram', 'semi', 'sv', 's']:
-        v = [semivariance(data, indices) for indices in index]
+        v = ssd / n / 2.0
     elif method in ['covariogram', 'cov', 'co', 'cv', 'c']:
-        v = [covariance(data, indices) for indices in index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            v = (sprod - shead * stail / n) / (n - 1)
+    else:
+        raise ValueError('Unknown variogram method: {}'.format(method))
     # bundle the semivariogram values with their lags
+    if counts:
+        return np.c_[lags, v, n].T
     return np.c_[lags, v].T
@@ -24,14 +24,10 @@ def cdf( d ):
     xu = np.unique( xs )
     # number of unique data points
     U = len( xu )
-    # initialize an array of U zeros
-    cdf = np.zeros((U))
-    # for each unique data point..
-    for i in range( U ):
-        # count the number of points less than
-        # this point, and then divide by the
-        # total number of data points
-    	cdf[i] = len( xs[ xs < xu[i] ] ) / N
+    # for each unique data point, count the number
+    # of points less than this point, and then divide
+    # by the total number of data points
+    cdf = np.searchsorted( xs, xu, side='left' ) / N
     # f : input value --> output percentage describing
     # the number of points less than the input scalar
     # in the modeled distribution; if 5 is 20% into
@@ -61,23 +57,85 @@ def fit( d ):
     *range - here, I mean "maximum minus minimum"
     **range - here I mean the output of a mapping
     '''
-    x, y = d[:,0], d[:,1]
+    # sort the mapping by its domain
+    order = np.argsort( d[:,0], kind='stable' )
+    x, y = d[order,0], d[order,1]
     def f(t):
-        # return the minimum of the range
-        if t <= x.min():
-            return y[ np.argmin(x) ]
-        # return the maximum of the range
-        elif t >= x.max():
-            return y[ np.argmax(x) ]
-        # otherwise, interpolate linearly
-        else:
-            intr = scipy.interpolate.interp1d( x, y )
-            return intr(t)
+        # interpolate linearly, clamping values outside of
+        # the domain to the ends of the range; this works on
+        # a scalar or on a whole array at once
+        return np.interp( t, x, y )
     return f
-    
-def to_norm( data ):
+
+class NormalScore( object ):
+    '''
+    Input:  (d)    data to fit, a 1D NumPy array of observational
+                   data, or a data set whose column after its
+                   (ndim) coordinates is the variable of interest
+            (ndim) number of spatial coordinates, 2 or 3
+    --------------------------------------------------------
+    Normal score transform of a data set.  Fit it once, then
+    transform() and inverse_transform() whole arrays, of any
+    shape, with array operations; the mapping is the one used
+    by to_norm() and from_norm()
+    '''
+    def __init__( self, d=None, ndim=2 ):
+        self.ndim = ndim
+        if d is not None:
+            self.fit( d )
+
+    def fit( self, d ):
+        '''
+        Input:  (d)    data to fit
+        Output: (self) the fitted transform
+        '''
+        d = np.asarray( d, dtype=float )
+        if d.ndim > 1:
+            d = d[:,self.ndim]
+        f, finv = cdf( d )
+        # the data values, and the cdf values they map to
+        self.x, self.p = f[:,0], f[:,1]
+        # the lowest value maps to a cdf of zero, an infinite z-score,
+        # which is replaced by the lowest of the finite z-scores
+        scores = scipy.stats.norm(0,1).ppf( self.p )
+        finite = scores[ np.isfinite( scores ) ]
+        self.lo = finite.min() if len( finite ) else np.nan
+        self.hi = finite.max() if len( finite ) else np.nan
+        return self
+
+    def mapping( self ):
+        '''
+        Output: (finv) the inverse mapping of the fitted cdf,
+                       as returned by to_norm()
+        '''
+        return np.vstack(( self.p, self.x )).T
+
+    def transform( self, x ):
+        '''
+        Input:  (x) NumPy array of data values
+        Output: (z) NumPy array of z-scores, the same shape as (x)
+        '''
+        # take x to a value in [0,1], then to a z-score
+        p = np.interp( x, self.x, self.p )
+        z = scipy.stats.norm(0,1).ppf( p )
+        # convert infinite values
+        return np.clip( z, self.lo, self.hi )
+
+    def inverse_transform( self, z ):
+        '''
+        Input:  (z) NumPy array of z-scores
+        Output: (x) NumPy array of data values, the same shape as (z)
+        '''
+        # convert z-scores to cdf values in [0,1], then use
+        # the inverse cdf to map them back to the data
+        p = scipy.stats.norm(0,1).cdf( z )
+        return np.interp( p, self.p, self.x )
+
+def to_norm( data, ndim=2 ):
     '''
-    Input  (data) 1D NumPy array of observational data
+    Input  (data) 1D NumPy array of observational data, or a data
+                  set of (ndim) coordinates and the variable
+           (ndim) number of spatial coordinates, 2 or 3
     Output (z)    1D NumPy array of z-score transformed data
            (inv)  inverse mapping to retrieve original distribution
     '''
@@ -85,39 +143,19 @@ def to_norm( data ):
     dims = data.shape
     # if there is more than one dimension..
     if len( dims ) > 1:
-        # take the third column of the second dimension
-        z = data[:,2]
+        # take the column after the coordinates
+        z = data[:,ndim]
     # otherwise just use data as is
     else:
         z = data
-    # grab the number of data points
-    N = len( z )
-    # grab the cumulative distribution function
-    f, inv = cdf( z )
-    # h will return the cdf of z
-    # by interpolating the mapping f
-    h = fit( f )
-    # ppf will return the inverse cdf
-    # of the standard normal distribution
-    ppf = scipy.stats.norm(0,1).ppf
-    # for each data point..
-    for i in range( N ):
-        # h takes z to a value in [0,1]
-        p = h( z[i] )
-        # ppf takes p (in [0,1]) to a z-score
-        z[i] = ppf( p )
-    # convert positive infinite values
-    posinf = np.isposinf( z )
-    z = np.where( posinf, np.nan, z )
-    z = np.where( np.isnan( z ), np.nanmax( z ), z )
-    # convert negative infinite values
-    neginf = np.isneginf( z )
-    z = np.where( neginf, np.nan, z )
-    z = np.where( np.isnan( z ), np.nanmin( z ), z )
+    # fit the transform, and apply it to all of the data at once
+    ns = NormalScore( z )
+    z = ns.transform( z )
+    inv = ns.mapping()
     # if the whole data set was passed, then add the
     # transformed variable and recombine with data
     if len( dims ) > 1:
-        z = np.vstack(( data[:,:2].T, z )).T
+        z = np.vstack(( data[:,:ndim].T, z )).T
     return z, inv
 
 def from_norm( data, inv ):
@@ -137,8 +175,8 @@ def from_norm( data, inv ):
     # convert z-score data to cdf values in [0,1]
     f = scipy.stats.norm(0,1).cdf( d )
     # use inverse cdf to map [0,1] values to the
-    # original distribution, then add the mu and sd
-    z = np.array( [ h(i) for i in f ] )
+    # original distribution, all at once
+    z = h( f )
     # reshape the data
     z = np.reshape( z, data.shape )
     return z
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
 import geostatsmodels.utilities as u
-import geostatsmodels.kriging as k
+import geostatsmodels.model as md
 import geostatsmodels.simulation as s
+import geostatsmodels.zscoretrans as z
+from geostatsmodels.geoplot import YPcmap
 from pylab import *
 import numpy as np
 
@@ -18,11 +20,14 @@ lags, tol = np.linspace( 10, 50, 10 ), 5
 
 # if the data is not normally distributed,
 # perfrom a z-score transformation
-d, inv = u.to_norm( d )
+d, inv = z.to_norm( d )
+
+# fit a spherical model of the covariance
+covfct = md.fitmodel( d, md.spherical, lags, tol )
 
 # perform sequential Gaussian simulation using
-# a spherical model, on a 5x5 grid
-m = s.sgs( d, k.spherical, lags, tol, 5, 5 )
+# the spherical model, on a 5x5 grid
+m = s.sgs( d, covfct, 5, 5, seed=318 )
 
 # use the [:,::-1].T to a) reverse the order of the columns
 # and then b) transpose the data, this takes it from Python
@@ -44,10 +49,10 @@ array([[ 0.03499825, -0.56577758, -0.53807829,  0.45723896,  0.33959872],
 
 # assuming you have matplotlib and  pylab installed, 
 # you can visulize the untransformed data
-matshow( m[:,::-1].T, cmap=u.YPcmap )
+matshow( m[:,::-1].T, cmap=YPcmap )
 
 # perform the back-transformation
-n = u.from_norm( m, inv )
+n = z.from_norm( m, inv )
 
 print(n[:,::-1].T)
 
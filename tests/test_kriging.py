@@ -0,0 +1,330 @@
+#!/usr/bin/env python
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from geostatsmodels import kriging, model, neighbors, utilities
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+data = np.c_[ rng.uniform( 0, 100, ( 60, 2 ) ), rng.normal( 5, 2, 60 ) ]
+grid = rng.uniform( 0, 100, ( 25, 2 ) )
+covfct = model.covariance( model.exponential, ( 40, 4.0 ) )
+eps = 1e-8
+
+class KrigeTestCases( unittest.TestCase ):
+	'''Tests for kriging.krige()'''
+
+	def check( self, method, N ):
+		'''
+		Does the batched krige() agree with kriging
+		each point of the grid one at a time?
+		'''
+		fct = kriging.simple if method == 'simple' else kriging.ordinary
+		est, kstd = kriging.krige( data, covfct, grid, method, N, nugget=0.5, chunksize=7 )
+		self.assertEqual( est.shape, ( len( grid ), 1 ) )
+		self.assertEqual( kstd.shape, ( len( grid ), 1 ) )
+		for i, u in enumerate( grid ):
+			e, s = fct( data, covfct, u, N, nugget=0.5 )
+			self.assertTrue( abs( est[i,0] - e ) < eps )
+			self.assertTrue( abs( kstd[i,0] - s ) < eps )
+
+	def test_simple_global( self ):
+		self.check( 'simple', 0 )
+
+	def test_simple_neighbors( self ):
+		self.check( 'simple', 6 )
+
+	def test_ordinary_global( self ):
+		self.check( 'ordinary', 0 )
+
+	def test_ordinary_neighbors( self ):
+		self.check( 'ordinary', 6 )
+
+	def test_parallel( self ):
+		'''
+		Does kriging on a pool of processes return the
+		same results, in the same order, as one process?
+		'''
+		for N in [ 0, 6 ]:
+			a = kriging.krige( data, covfct, grid, 'ordinary', N, chunksize=4 )
+			b = kriging.krige( data, covfct, grid, 'ordinary', N, chunksize=4, n_jobs=2 )
+			self.assertTrue( np.array_equal( a[0], b[0] ) )
+			self.assertTrue( np.array_equal( a[1], b[1] ) )
+
+	def test_cache( self ):
+		'''
+		Does kriging through a SystemCache give the same results,
+		and count the nodes that share a set of neighbors?
+		'''
+		points = utilities.gridpoints( ( 0, 0 ), ( 5, 5 ), ( 20, 20 ) )
+		for method in [ 'simple', 'ordinary' ]:
+			cache = kriging.SystemCache()
+			a = kriging.krige( data, covfct, points, method, 6 )
+			b = kriging.krige( data, covfct, points, method, 6, chunksize=50, cache=cache )
+			self.assertTrue( np.allclose( a, b, atol=eps, equal_nan=True ) )
+			self.assertEqual( cache.hits + cache.misses, len( points ) )
+			self.assertEqual( cache.misses, len( cache ) )
+			self.assertTrue( cache.hits > 0 )
+			# each entry owns its memory, which is all that is counted
+			self.assertTrue( all( a.base is None for a in cache._entries.values() ) )
+			self.assertEqual( cache.nbytes(), sum( a.nbytes for a in cache._entries.values() ) )
+			kriging.krige( data, covfct, points, method, 6, cache=cache )
+			self.assertEqual( cache.hits, 2 * len( points ) - len( cache ) )
+			cache.maxbytes = 1
+			cache.evict()
+			self.assertEqual( len( cache ), 1 )
+			self.assertRaises( ValueError, kriging.krige, data[:-1], covfct, points, method, 6, cache=cache )
+			moved = np.c_[ 2 * data[:,:2], data[:,2] ]
+			self.assertRaises( ValueError, kriging.krige, moved, covfct, points, method, 6, cache=cache )
+
+	def test_tabulated( self ):
+		'''
+		Does a tabulated covariance stand in for the model
+		in simple() and ordinary() to within its error?
+		'''
+		table = model.Tabulated( covfct, 150.0, tol=1e-7 )
+		self.assertTrue( table.error <= 1e-7 )
+		self.assertEqual( table( 0.0 ), covfct( 0.0 ) )
+		for fct in [ kriging.simple, kriging.ordinary ]:
+			for u in grid[:5]:
+				a = fct( data, covfct, u, 6, nugget=0.5 )
+				b = fct( data, table, u, 6, nugget=0.5 )
+				self.assertTrue( np.allclose( a, b, atol=1e-5 ) )
+
+class StreamKrigeTestCases( unittest.TestCase ):
+	'''Tests for kriging.streamkrige()'''
+
+	def setUp( self ):
+		self.dir = tempfile.mkdtemp()
+		self.est = os.path.join( self.dir, 'est.npy' )
+		self.kstd = os.path.join( self.dir, 'kstd.npy' )
+		self.spec = ( ( 0, 0 ), ( 10, 20 ), ( 11, 6 ) )
+		self.points = utilities.gridpoints( *self.spec )
+
+	def tearDown( self ):
+		shutil.rmtree( self.dir )
+
+	def test_spec( self ):
+		'''
+		Does kriging a grid specification to disk match krige()?
+		'''
+		a = kriging.krige( data, covfct, self.points, 'ordinary', 6 )
+		b = kriging.streamkrige( data, covfct, self.spec, self.est, self.kstd,
+		                         'ordinary', 6, chunksize=8 )
+		self.assertTrue( np.allclose( a[0], b[0] ) )
+		self.assertTrue( np.allclose( a[1], b[1] ) )
+
+	def test_resume( self ):
+		'''
+		Does an interrupted run pick up where it stopped?
+		'''
+		def chunks( stop ):
+			for i in range( 0, len( self.points ), 10 ):
+				if i == stop:
+					raise KeyboardInterrupt
+				yield self.points[i:i+10]
+		size = len( self.points )
+		self.assertRaises( KeyboardInterrupt, kriging.streamkrige, data, covfct,
+		                   chunks( 30 ), self.est, self.kstd, N=6, chunksize=4, size=size )
+		with open( self.est + '.progress' ) as f:
+			self.assertEqual( json.load( f )['rows'], 30 )
+		b = kriging.streamkrige( data, covfct, chunks( None ), self.est, self.kstd,
+		                         N=6, chunksize=4, size=size )
+		a = kriging.krige( data, covfct, self.points, N=6 )
+		self.assertTrue( np.allclose( a[0], b[0] ) )
+		self.assertTrue( np.allclose( a[1], b[1] ) )
+		self.assertFalse( os.path.exists( self.est + '.progress' ) )
+
+	def test_rerun( self ):
+		'''
+		Is a finished run into the same files done again with new
+		data, and is an interrupted one refused with new data or
+		another tabulated model?
+		'''
+		def chunks( stop ):
+			for i in range( 0, len( self.points ), 10 ):
+				if i == stop:
+					raise KeyboardInterrupt
+				yield self.points[i:i+10]
+		scaled = np.c_[ data[:,:2], 10 * data[:,2] ]
+		a = np.array( kriging.streamkrige( data, covfct, self.spec, self.est, self.kstd, 'ordinary', 6 )[0] )
+		b = kriging.streamkrige( scaled, covfct, self.spec, self.est, self.kstd, 'ordinary', 6 )
+		self.assertTrue( np.allclose( b[0], 10 * a ) )
+		size = len( self.points )
+		self.assertRaises( KeyboardInterrupt, kriging.streamkrige, data, covfct,
+		                   chunks( 30 ), self.est, self.kstd, N=6, chunksize=4, size=size )
+		self.assertRaises( ValueError, kriging.streamkrige, scaled, covfct,
+		                   chunks( None ), self.est, self.kstd, N=6, chunksize=4, size=size )
+		# tabulated models, and lambdas, of other covariances differ too
+		other = model.covariance( model.exponential, ( 20, 4.0 ) )
+		for near, far in [ ( model.Tabulated( covfct, 150.0 ), model.Tabulated( other, 150.0 ) ),
+		                   ( lambda h: covfct( h ), lambda h: other( h ) ) ]:
+			self.assertRaises( KeyboardInterrupt, kriging.streamkrige, data, near, chunks( 30 ),
+			                   self.est, self.kstd, N=6, chunksize=4, size=size, resume=False )
+			self.assertRaises( ValueError, kriging.streamkrige, data, far,
+			                   chunks( None ), self.est, self.kstd, N=6, chunksize=4, size=size )
+			done = kriging.streamkrige( data, near, chunks( None ), self.est, self.kstd, N=6,
+			                            chunksize=4, size=size )
+			self.assertEqual( len( done[0] ), size )
+
+class GlobalFactorTestCases( unittest.TestCase ):
+	'''Tests for kriging.GlobalFactor'''
+
+	def test_factor( self ):
+		'''
+		Does kriging with a factorization of K agree
+		with kriging each point from scratch?
+		'''
+		for method in [ 'simple', 'ordinary' ]:
+			fct = kriging.simple if method == 'simple' else kriging.ordinary
+			factor = kriging.GlobalFactor( data, covfct, method )
+			est, kstd = kriging.krige( data, covfct, grid, method, factor=factor )
+			for i, u in enumerate( grid ):
+				e, s = fct( data, covfct, u, nugget=0 )
+				f, t = fct( data, covfct, u, nugget=0, factor=factor )
+				self.assertTrue( abs( e - f ) < eps and abs( s - t ) < eps )
+				self.assertTrue( abs( est[i,0] - e ) < eps )
+				self.assertTrue( abs( kstd[i,0] - s ) < eps )
+
+	def test_wrong_method( self ):
+		'''
+		Is a factorization for the wrong method refused?
+		'''
+		factor = kriging.GlobalFactor( data, covfct, 'simple' )
+		self.assertRaises( ValueError, kriging.ordinary, data, covfct, grid[0], factor=factor )
+		self.assertRaises( ValueError, kriging.krige, data, covfct, grid, 'ordinary', factor=factor )
+
+class DriftTestCases( unittest.TestCase ):
+	'''Tests for universal kriging and kriging with external drift'''
+
+	def test_universal( self ):
+		'''
+		Does universal kriging reproduce a trend of its order
+		exactly, with all of the data or N of them, and agree
+		when its systems are cached?
+		'''
+		x, y = data[:,0], data[:,1]
+		for order, trend in [ ( 1, lambda x, y: 3 + 0.2 * x - 0.1 * y ),
+		                      ( 2, lambda x, y: 1 + 0.01 * x * y - 0.02 * y * y ) ]:
+			field = np.c_[ data[:,:2], trend( x, y ) ]
+			for N in [ 0, 10 ]:
+				est, kstd = kriging.krige( field, covfct, grid, 'universal', N, order=order )
+				self.assertTrue( np.allclose( est[:,0], trend( grid[:,0], grid[:,1] ) ) )
+			cached = kriging.krige( field, covfct, grid, 'universal', 10, order=order,
+			                        cache=kriging.SystemCache() )
+			self.assertTrue( np.allclose( cached[0], est ) )
+			e, s = kriging.universal( field, covfct, grid[3], 10, order=order )
+			self.assertTrue( abs( e - est[3,0] ) < eps )
+
+	def test_too_few( self ):
+		'''
+		Is a quadratic drift, with six terms, refused fewer than
+		six neighbors, and are the nodes of a search with fewer
+		left as NaN?
+		'''
+		for N in [ 3, 5 ]:
+			self.assertRaises( ValueError, kriging.krige, data, covfct, grid, 'universal', N, order=2 )
+		search = neighbors.SearchNeighborhood( data, 20.0, 5 )
+		self.assertRaises( ValueError, kriging.krige, data, covfct, grid, 'universal', order=2, search=search )
+		search = neighbors.SearchNeighborhood( data, 20.0, 10 )
+		counts = search.search( grid )[1]
+		self.assertTrue( np.any( counts < 6 ) and np.any( counts >= 6 ) )
+		est, kstd = kriging.krige( data, covfct, grid, 'universal', order=2, search=search )
+		self.assertTrue( np.array_equal( np.isnan( est[:,0] ), counts < 6 ) )
+
+	def test_external( self ):
+		'''
+		Does kriging with external drift reproduce a variable
+		that is a linear function of the drift variable?
+		'''
+		drift = rng.normal( 0, 1, len( data ) )
+		field = np.c_[ data[:,:2], 3 + 2 * drift, drift ]
+		target = rng.normal( 0, 1, len( grid ) )
+		for N in [ 0, 10 ]:
+			est, kstd = kriging.krige( field, covfct, np.c_[ grid, target ], 'external', N )
+			self.assertTrue( np.allclose( est[:,0], 3 + 2 * target ) )
+		self.assertRaises( ValueError, kriging.krige, field, covfct, grid, 'external', 10 )
+		self.assertRaises( ValueError, kriging.krige, data, covfct, grid, 'external', 10 )
+		cache = kriging.SystemCache()
+		kriging.krige( field, covfct, np.c_[ grid, target ], 'external', 10, cache=cache )
+		other = np.c_[ field[:,:3], 2 * drift ]
+		self.assertRaises( ValueError, kriging.krige, other, covfct, np.c_[ grid, target ], 'external', 10, cache=cache )
+
+class ThreeDTestCases( unittest.TestCase ):
+	'''Tests for kriging 3D data'''
+
+	def test_3d( self ):
+		'''
+		With ndim=3, do the global, neighborhood and single point
+		paths agree, and does universal kriging reproduce a trend
+		in z?
+		'''
+		xyz = np.c_[ data[:,:2], rng.uniform( 0, 50, len( data ) ), data[:,2] ]
+		targets = np.c_[ grid, grid[:,0] / 2 ]
+		for method in [ 'simple', 'ordinary' ]:
+			a = kriging.krige( xyz, covfct, targets, method, ndim=3 )
+			b = kriging.krige( xyz, covfct, targets, method, len( xyz ), ndim=3 )
+			self.assertTrue( np.allclose( a, b ) )
+		e, s = kriging.ordinary( xyz, covfct, targets[4], 10, ndim=3 )
+		est, kstd = kriging.krige( xyz, covfct, targets, 'ordinary', 10, ndim=3 )
+		self.assertTrue( abs( e - est[4,0] ) < eps and abs( s - kstd[4,0] ) < eps )
+		# the estimates would change without the third coordinate
+		self.assertFalse( np.allclose( est, kriging.krige( data, covfct, grid, 'ordinary', 10 )[0] ) )
+		trend = np.c_[ xyz[:,:3], 2 + 0.1 * xyz[:,2] ]
+		est = kriging.krige( trend, covfct, targets, 'universal', 10, ndim=3 )[0]
+		self.assertTrue( np.allclose( est[:,0], 2 + 0.1 * targets[:,2] ) )
+		self.assertRaises( ValueError, kriging.krige, xyz, covfct, targets, 'ordinary', 10,
+		                   index=kriging.NeighborIndex( xyz ), ndim=3 )
+
+class BlockKrigeTestCases( unittest.TestCase ):
+	'''Tests for kriging.blockkrige()'''
+
+	def test_average( self ):
+		'''
+		Using all of the data, is a block estimate the average
+		of the point estimates over the discretization, and is
+		the block variance that of the textbook system, taken
+		from the variance of the variable?
+		'''
+		offsets = kriging._discretize( ( 10, 6 ), ( 3, 2 ) )
+		points = ( grid[:,None,:] + offsets ).reshape( -1, 2 )
+		for method in [ 'simple', 'ordinary' ]:
+			est, kstd = kriging.blockkrige( data, covfct, grid, ( 10, 6 ), ( 3, 2 ), method )
+			pest = kriging.krige( data, covfct, points, method )[0]
+			self.assertTrue( np.allclose( est[:,0], pest.reshape( len( grid ), -1 ).mean( axis=1 ) ) )
+			nbrs = kriging.blockkrige( data, covfct, grid, ( 10, 6 ), ( 3, 2 ), method, len( data ) )
+			self.assertTrue( np.allclose( nbrs[0], est ) and np.allclose( nbrs[1], kstd ) )
+		# ordinary block variance worked out directly
+		P = grid[0] + offsets
+		K = covfct( utilities.pairwise( data[:,:2] ) )
+		kb = covfct( np.sqrt( ( ( data[:,None,:2] - P )**2 ).sum( -1 ) ) ).mean( axis=1 )
+		n = len( data )
+		A = np.block([ [ K, np.ones(( n, 1 )) ], [ np.ones(( 1, n )), np.zeros(( 1, 1 )) ] ])
+		b = np.r_[ kb, 1 ]
+		cvv = covfct( utilities.pairwise( P ) ).mean()
+		var = np.var( data[:,2] ) - ( covfct( np.zeros( 1 ) )[0] - cvv )
+		self.assertTrue( abs( kstd[0,0] - np.sqrt( var - np.linalg.solve( A, b ).dot( b ) ) ) < eps )
+
+	def test_shapes( self ):
+		'''
+		Does a one point panel give point kriging, and are panels
+		of several sizes each kriged as on their own?
+		'''
+		for nugget in [ 0, 1 ]:
+			est, kstd = kriging.blockkrige( data, covfct, grid, ( 5, 5 ), ( 1, 1 ), 'ordinary', 8, nugget )
+			pest, pstd = kriging.krige( data, covfct, grid, 'ordinary', 8, nugget )
+			self.assertTrue( np.allclose( est, pest ) and np.allclose( kstd, pstd ) )
+		sizes = np.array([ ( 10, 6 ), ( 4, 4 ) ] * 12 + [ ( 2, 8 ) ], dtype=float )
+		est, kstd = kriging.blockkrige( data, covfct, grid, sizes, ( 3, 3 ), 'ordinary', 8,
+		                                cache=kriging.SystemCache() )
+		for i in [ 0, 1, 24 ]:
+			e, s = kriging.blockkrige( data, covfct, grid[i], sizes[i], ( 3, 3 ), 'ordinary', 8 )
+			self.assertTrue( abs( e[0,0] - est[i,0] ) < eps and abs( s[0,0] - kstd[i,0] ) < eps )
+		self.assertRaises( ValueError, kriging.blockkrige, data, covfct, grid, ( 5, 5 ),
+		                   ( 2, 2 ), 'external', 8 )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+import pickle
+import unittest
+from geostatsmodels import model, variograms
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+h = rng.uniform( 0, 20, ( 40, 30 ) )
+a, c = 7.0, 2.0
+
+class ModelTestCases( unittest.TestCase ):
+	'''Tests for the models of the semivariogram in model.py'''
+
+	def test_spherical( self ):
+		'''
+		Does spherical() keep unsorted distances in their order?
+		'''
+		sv = model.spherical( h, a, c )
+		r = np.minimum( h / a, 1.0 )
+		self.assertEqual( sv.shape, h.shape )
+		self.assertTrue( np.allclose( sv, c * ( 1.5 * r - 0.5 * r**3.0 ) ) )
+		self.assertTrue( abs( model.spherical( 3.0, a, c ) - c * ( 1.5 * 3 / a - 0.5 * ( 3 / a )**3.0 ) ) < 1e-12 )
+
+	def test_out( self ):
+		'''
+		Do the models write into (out), even when it is (h)?
+		'''
+		for fct in [ model.nugget, model.linear, model.spherical,
+		             model.exponential, model.gaussian ]:
+			sv = fct( h, a, c )
+			out = np.empty_like( h )
+			self.assertTrue( fct( h, a, c, out=out ) is out )
+			self.assertTrue( np.array_equal( out, sv ) )
+			g = h.copy()
+			fct( g, a, c, out=g )
+			self.assertTrue( np.array_equal( g, sv ) )
+		nested = model.Covariance( [ ( model.spherical, ( a, 0.6 ) ),
+		                             ( model.exponential, ( a / 2, 0.4 ) ) ], 0.3 )
+		for fct in [ nested, nested.variogram ]:
+			sv = fct( h )
+			g = h.copy()
+			self.assertTrue( fct( g, out=g ) is g )
+			self.assertTrue( np.allclose( g, sv ) )
+
+	def test_float32( self ):
+		'''
+		Do the models keep float32 distances in float32?
+		'''
+		sv = model.exponential( h.astype( np.float32 ), a, c )
+		self.assertEqual( sv.dtype, np.float32 )
+		self.assertTrue( np.allclose( sv, model.exponential( h, a, c ), atol=1e-5 ) )
+
+	def test_covariance( self ):
+		'''
+		Is the covariance the sill minus the semivariance?
+		'''
+		covfct = model.covariance( model.gaussian, ( a, c ) )
+		self.assertTrue( np.allclose( covfct( h ), c - model.gaussian( h, a, c ) ) )
+		self.assertEqual( covfct( 0.0 ), c )
+
+	def test_nested( self ):
+		'''
+		Does a nested Covariance match model.nested(), on arrays,
+		scalars, and after a round trip through pickle?
+		'''
+		param = [ 5.0, 1.5, 20.0, 0.5, 0.2 ]
+		fcts = [ model.spherical, model.exponential ]
+		cov = model.Covariance.fromparams( fcts, param )
+		self.assertAlmostEqual( cov.sill, 2.2 )
+		self.assertTrue( np.allclose( cov.variogram( h ), model.nested( h, fcts, param ) ) )
+		self.assertTrue( np.allclose( cov( h ), 2.2 - model.nested( h, fcts, param ) ) )
+		self.assertAlmostEqual( cov( h[0,0] ), cov( h[:1,:1] )[0,0] )
+		self.assertEqual( cov( 0.0 ), 2.2 )
+		clone = pickle.loads( pickle.dumps( cov ) )
+		self.assertTrue( np.array_equal( clone( h ), cov( h ) ) )
+
+class FitTestCases( unittest.TestCase ):
+	'''Tests for fitting models of the semivariogram'''
+
+	x = np.linspace( 1, 50, 25 )
+
+	def test_opt( self ):
+		'''
+		Does opt() find the range on its mesh?
+		'''
+		y = model.spherical( self.x, 20.0, c )
+		a = model.opt( model.spherical, self.x, y, c, [ 10, 30 ], 201 )
+		self.assertTrue( abs( a - 20.0 ) < 1e-9 )
+		# a model that only takes a scalar range
+		def scalar( h, a, c ):
+			a, c = float( a ), float( c )
+			return model.spherical( h, a, c )
+		a = model.opt( scalar, self.x, y, c, [ 10, 30 ], 201 )
+		self.assertTrue( abs( a - 20.0 ) < 1e-9 )
+
+	def test_fitparams( self ):
+		'''
+		Does fitparams() recover the parameters of a nested
+		model with a nugget, for more than one semivariogram?
+		'''
+		fcts = [ model.spherical, model.exponential ]
+		param = np.array([ 10.0, 1.0, 40.0, 2.0, 0.3 ])
+		y = model.nested( self.x, fcts, param )
+		fit = model.fitparams( self.x, y, fcts, counts=np.arange( 25 ) + 1, nugget=True )
+		self.assertTrue( np.allclose( fit, param, rtol=1e-4 ) )
+		fit = model.fitparams( self.x, np.vstack(( y, 2.0 * y )), fcts, nugget=True )
+		self.assertEqual( fit.shape, ( 2, 5 ) )
+		self.assertTrue( np.allclose( fit[1], param * [ 1, 2, 1, 2, 2 ], rtol=1e-4 ) )
+		# a semivariogram without any lags does not stop the others
+		empty = np.vstack(( y, np.full( 25, np.nan ), y ))
+		fit = model.fitparams( self.x, empty, fcts, counts=[ 1 ] * 25, nugget=True )
+		self.assertTrue( np.all( np.isnan( fit[1] ) ) )
+		self.assertTrue( np.allclose( fit[[ 0, 2 ]], param, rtol=1e-4 ) )
+		fit = model.fitparams( self.x, y, fcts, counts=np.zeros( 25 ) )
+		self.assertTrue( np.all( np.isnan( fit ) ) and fit.shape == ( 4, ) )
+
+	def test_fitmodel( self ):
+		'''
+		Does fitmodel() fit the sill and nugget, weighted by the
+		pairs at each lag, when asked to?
+		'''
+		rng = np.random.RandomState( 7 )
+		data = np.c_[ rng.uniform( 0, 100, ( 300, 2 ) ), rng.normal( 0, 2, 300 ) ]
+		lags = np.linspace( 5, 50, 10 )
+		lag, sv, n = variograms.semivariogram( data, lags, 2.5, counts=True )
+		cov = model.fitmodel( data, model.spherical, lags, 2.5, nugget=True )
+		param = model.fitparams( lag, sv, model.spherical, counts=n, nugget=True )
+		self.assertTrue( np.allclose( cov.variogram( lag ), model.nested( lag, [ model.spherical ], param ) ) )
+		self.assertAlmostEqual( cov.nugget, param[-1] )
+		self.assertAlmostEqual( cov.sill, param[1] + param[2] )
+		# the ranges stay near the lags
+		fit = model.fitparams( lag, sv, [ model.spherical, model.exponential ], counts=n, nugget=True )
+		self.assertTrue( fit[0] <= 3 * lag.max() and fit[2] <= 3 * lag.max() )
+
+if __name__ == '__main__':
+    unittest.main()
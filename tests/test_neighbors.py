@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import unittest
+from geostatsmodels import kriging, model
+from geostatsmodels.neighbors import NeighborIndex, SearchNeighborhood
+from scipy.spatial.distance import cdist
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+data = np.c_[ rng.uniform( 0, 100, ( 80, 2 ) ), rng.normal( 5, 2, 80 ) ]
+grid = rng.uniform( 0, 100, ( 20, 2 ) )
+index = NeighborIndex( data )
+
+class NeighborIndexTestCases( unittest.TestCase ):
+	'''Tests for neighbors.py'''
+
+	def test_nearest( self ):
+		'''
+		Does nearest() find the same points as a full sort?
+		'''
+		d, idx = index.nearest( grid, 5 )
+		full = cdist( grid, data[:,:2] )
+		self.assertTrue( np.array_equal( idx, full.argsort( axis=1 )[:,:5] ) )
+		self.assertTrue( np.allclose( d, np.sort( full, axis=1 )[:,:5] ) )
+		d, idx = index.nearest( grid[0], 5 )
+		self.assertEqual( idx.shape, ( 5, ) )
+
+	def test_radius( self ):
+		'''
+		Does radius() find every point within the radius, closest first?
+		'''
+		found = index.radius( grid, 15.0 )
+		full = cdist( grid, data[:,:2] )
+		for i, idx in enumerate( found ):
+			self.assertEqual( set( idx ), set( np.where( full[i] <= 15.0 )[0] ) )
+			self.assertTrue( np.all( np.diff( full[i,idx] ) >= 0 ) )
+
+	def test_krige_with_index( self ):
+		'''
+		Does passing an index change the kriging results?
+		'''
+		covfct = model.covariance( model.exponential, ( 40, 4.0 ) )
+		a = kriging.krige( data, covfct, grid, 'ordinary', N=6 )
+		b = kriging.krige( data, covfct, grid, 'ordinary', N=6, index=index )
+		self.assertTrue( np.allclose( a, b ) )
+		e, s = kriging.ordinary( data, covfct, grid[0], N=6, index=index )
+		self.assertTrue( abs( e - b[0][0,0] ) < 1e-8 )
+
+class SearchNeighborhoodTestCases( unittest.TestCase ):
+	'''Tests for the moving search neighborhood'''
+
+	def test_octants( self ):
+		'''
+		Does search() take the closest data in the ellipse, at
+		most (noct) from each octant and (ndmax) in all?
+		'''
+		search = SearchNeighborhood( data, 30.0, 10, anisotropy=0.5, angle=30.0, noct=2 )
+		idx, counts = search.search( grid )
+		t = np.deg2rad( 30.0 )
+		for m, u in enumerate( grid ):
+			dx, dy = ( data[:,:2] - u ).T
+			d = np.hypot( dx * np.sin( t ) + dy * np.cos( t ), ( dx * np.cos( t ) - dy * np.sin( t ) ) / 0.5 )
+			octant = ( ( 90 - np.rad2deg( np.arctan2( dy, dx ) ) ) % 360 // 45 ).astype( int )
+			taken, per = list(), np.zeros( 8 )
+			for i in np.argsort( d ):
+				if d[i] <= 30.0 and per[ octant[i] ] < 2:
+					taken.append( i )
+					per[ octant[i] ] += 1
+			self.assertEqual( list( idx[m,:counts[m]] ), taken[:10] )
+			self.assertTrue( np.all( idx[m,counts[m]:] == -1 ) )
+
+	def test_krige_with_search( self ):
+		'''
+		Does a search without limits krige like the N closest
+		points, and are nodes without enough data skipped?
+		'''
+		covfct = model.covariance( model.exponential, ( 40, 4.0 ) )
+		a = kriging.krige( data, covfct, grid, 'ordinary', N=6 )
+		b = kriging.krige( data, covfct, grid, 'ordinary', search=SearchNeighborhood( data, 1e9, 6 ) )
+		self.assertTrue( np.allclose( a, b, equal_nan=True ) )
+		search = SearchNeighborhood( data, 10.0, 6, ndmin=3 )
+		est, kstd = kriging.krige( data, covfct, grid, 'simple', search=search )
+		counts = search.search( grid )[1]
+		self.assertTrue( np.all( np.isnan( est[ counts < 3 ] ) ) )
+		self.assertFalse( np.any( np.isnan( est[ counts >= 3 ] ) ) )
+		self.assertTrue( 0 < np.sum( counts < 3 ) < len( grid ) )
+
+	def test_3d( self ):
+		'''
+		Does a 3D search stay within its ellipsoid, taking at
+		most (noct) from each quadrant above and below a node?
+		'''
+		xyz = np.c_[ data[:,:2], rng.uniform( 0, 100, len( data ) ) ]
+		search = SearchNeighborhood( xyz, 40.0, 12, noct=2, ndim=3, vertical=0.5 )
+		idx, counts = search.search( np.c_[ grid, grid[:,0] ] )
+		for m, u in enumerate( np.c_[ grid, grid[:,0] ] ):
+			found = xyz[ idx[m,:counts[m]] ] - u
+			d = np.sqrt( ( found[:,:2]**2 ).sum( axis=1 ) + ( found[:,2] / 0.5 )**2 )
+			self.assertTrue( np.all( d <= 40.0 ) )
+			quadrant = ( ( 90 - np.rad2deg( np.arctan2( found[:,1], found[:,0] ) ) ) % 360 // 90 ).astype( int )
+			octant = quadrant + 4 * ( found[:,2] < 0 )
+			self.assertTrue( np.all( np.bincount( octant ) <= 2 ) )
+
+if __name__ == '__main__':
+    unittest.main()
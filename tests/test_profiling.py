@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import unittest
+import warnings
+from geostatsmodels import kriging, model, variograms
+from geostatsmodels.profiling import Stats
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+data = np.c_[ rng.uniform( 0, 100, ( 60, 2 ) ), rng.normal( 5, 2, 60 ) ]
+grid = rng.uniform( 0, 100, ( 25, 2 ) )
+covfct = model.covariance( model.exponential, ( 40, 4.0 ) )
+
+class StatsTestCases( unittest.TestCase ):
+	'''Tests for the profiling of kriging and variograms'''
+
+	def test_krige( self ):
+		'''
+		Are the stages and systems of krige() recorded, without
+		changing its results, and is the callback called?
+		'''
+		seen = list()
+		stats = Stats( callback=lambda name, seconds: seen.append( name ) )
+		a = kriging.krige( data, covfct, grid, 'ordinary', 6, chunksize=10, stats=stats )
+		b = kriging.krige( data, covfct, grid, 'ordinary', 6, chunksize=10 )
+		self.assertTrue( np.array_equal( a, b ) )
+		self.assertEqual( stats.calls['search'], 3 )
+		self.assertEqual( stats.calls['solve'], 3 )
+		self.assertEqual( stats.sizes, { 7: len( grid ) } )
+		self.assertEqual( sum( stats.calls.values() ), len( seen ) )
+		self.assertTrue( all( t >= 0 for t in stats.times.values() ) )
+		self.assertEqual( stats.calls['condition'], 3 )
+		# no condition numbers at all, or those of every system
+		stats = Stats( condition=None )
+		kriging.krige( data, covfct, grid, 'ordinary', 6, chunksize=10, stats=stats )
+		self.assertTrue( 'condition' not in stats.calls )
+		self.assertEqual( stats.sizes, { 7: len( grid ) } )
+		stats = Stats( sample=None )
+		kriging.krige( data, covfct, grid, 'ordinary', 6, chunksize=10, stats=stats )
+		self.assertEqual( stats.calls['condition'], 3 )
+
+	def test_single_point( self ):
+		'''
+		Are simple() and kmatrices() recorded, and a singular
+		system counted as ill-conditioned?
+		'''
+		stats = Stats()
+		kriging.simple( data, covfct, grid[0], 6, stats=stats )
+		self.assertEqual( set( stats.calls ), { 'search', 'covariance', 'assembly', 'solve',
+		                                        'condition' } )
+		self.assertEqual( stats.illconditioned, 0 )
+		twice = np.r_[ data, data[:1] ]
+		with warnings.catch_warnings( record=True ) as caught:
+			warnings.simplefilter( 'always' )
+			try:
+				kriging.ordinary( twice, covfct, data[0,:2], 6, stats=stats )
+			except np.linalg.LinAlgError:
+				pass
+		self.assertEqual( stats.illconditioned, 1 )
+		caught = [ w for w in caught if 'ill-conditioned' in str( w.message ) ]
+		self.assertEqual( len( caught ), 1 )
+
+	def test_variogram_merge( self ):
+		'''
+		Does variogram() record its stages, and merge() add stats up?
+		'''
+		stats = Stats()
+		variograms.variogram( data, np.arange( 5, 50, 5 ), 2.5, 'semivariogram', stats=stats )
+		self.assertEqual( set( stats.calls ), { 'pairs', 'binning' } )
+		total = Stats()
+		total.merge( stats )
+		total.merge( stats.asdict() )
+		self.assertEqual( total.calls['binning'], 2 * stats.calls['binning'] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from geostatsmodels import simulation, model
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+data = np.c_[ rng.uniform( 0, 100, ( 40, 2 ) ), rng.normal( 0, 1, 40 ) ]
+# a datum on the corner of the grid
+data[0,:2] = data[:,:2].min( axis=0 )
+covfct = model.covariance( model.spherical, ( 40, 1.0 ) )
+
+class GridPathTestCases( unittest.TestCase ):
+	'''Tests for simulation.gridpath()'''
+
+	def test_path( self ):
+		'''
+		Does the path visit every cell once, and do its
+		cells and coordinates agree?
+		'''
+		path = simulation.gridpath( ( 0, 10, 11 ), ( 0, 5, 6 ), rng=1 )
+		self.assertEqual( len( path ), 66 )
+		self.assertTrue( np.array_equal( np.sort( path.order ), np.arange( 66 ) ) )
+		i, j = path.cells()
+		x, y = path.coords()
+		self.assertTrue( np.allclose( x, i ) and np.allclose( y, j ) )
+		idx, cell, loc = next( iter( path ) )
+		self.assertEqual( cell, ( i[0], j[0] ) )
+
+	def test_multigrid( self ):
+		'''
+		Are the cells of the coarser grids visited first?
+		'''
+		path = simulation.gridpath( ( 0, 1, 9 ), ( 0, 1, 9 ), rng=1, levels=2 )
+		i, j = path.cells()
+		self.assertTrue( np.all( i[:9] % 4 == 0 ) and np.all( j[:9] % 4 == 0 ) )
+		self.assertTrue( np.all( i[9:25] % 2 == 0 ) and np.all( j[9:25] % 2 == 0 ) )
+		self.assertTrue( np.all( ( i[25:] % 2 == 1 ) | ( j[25:] % 2 == 1 ) ) )
+		m = simulation.sgs( data, covfct, 9, 9, N=8, seed=1, levels=2 )
+		self.assertEqual( m.shape, ( 9, 9 ) )
+
+class SGSTestCases( unittest.TestCase ):
+	'''Tests for simulation.sgs()'''
+
+	def test_seed( self ):
+		'''
+		Does a seed reproduce a realization, and
+		do different seeds give different ones?
+		'''
+		a = simulation.sgs( data, covfct, 30, 20, N=8, seed=1 )
+		b = simulation.sgs( data, covfct, 30, 20, N=8, seed=1 )
+		c = simulation.sgs( data, covfct, 30, 20, N=8, seed=2 )
+		self.assertEqual( a.shape, ( 30, 20 ) )
+		self.assertTrue( np.array_equal( a, b ) )
+		self.assertFalse( np.array_equal( a, c ) )
+
+	def test_conditioning( self ):
+		'''
+		Does a cell on a datum take its value, and do
+		the cells vary about the mean of the data?
+		'''
+		m = simulation.sgs( data, covfct, 30, 20, N=8, seed=1 )
+		self.assertEqual( m[0,0], data[0,2] )
+		self.assertTrue( abs( m.mean() - data[:,2].mean() ) < 0.5 )
+		self.assertTrue( 0.5 < m.std() < 1.5 )
+
+	def test_3d( self ):
+		'''
+		Does a 3D grid have the shape asked for, and does a cell
+		on a datum take its value?
+		'''
+		xyz = np.c_[ data[:,:2], rng.uniform( 0, 20, len( data ) ), data[:,2] ]
+		xyz[0,2] = xyz[:,2].min()
+		m = simulation.sgs( xyz, covfct, 8, 6, N=8, seed=1, zs=5 )
+		self.assertEqual( m.shape, ( 8, 6, 5 ) )
+		self.assertEqual( m[0,0,0], xyz[0,3] )
+		path = simulation.gridpath( ( 0, 1, 5 ), ( 0, 1, 5 ), rng=1, levels=1, zdim=( 0, 1, 5 ) )
+		i, j, k = path.cells()
+		self.assertTrue( np.all( ( i[:27] % 2 == 0 ) & ( j[:27] % 2 == 0 ) & ( k[:27] % 2 == 0 ) ) )
+
+class RealizationsTestCases( unittest.TestCase ):
+	'''Tests for simulation.realizations()'''
+
+	def test_realizations( self ):
+		'''
+		Are the realizations the same on one process and on
+		several, on disk or in memory, and do the running
+		statistics match the stack?
+		'''
+		a, sa = simulation.realizations( data, covfct, 5, 12, 10, seed=7, quantiles=[ 0.1, 0.5 ] )
+		self.assertEqual( a.shape, ( 5, 12, 10 ) )
+		self.assertFalse( np.array_equal( a[0], a[1] ) )
+		self.assertTrue( np.allclose( sa['mean'], a.mean( axis=0 ) ) )
+		self.assertTrue( np.allclose( sa['var'], a.var( axis=0 ) ) )
+		self.assertTrue( np.allclose( sa['quantiles'], np.quantile( a, [ 0.1, 0.5 ], axis=0 ) ) )
+		c, sc = simulation.realizations( data, covfct, 5, 12, 10, seed=7, n_jobs=2 )
+		self.assertTrue( np.array_equal( a, c ) )
+		folder = tempfile.mkdtemp()
+		try:
+			fn = os.path.join( folder, 'sims.npy' )
+			b, sb = simulation.realizations( data, covfct, 5, 12, 10, seed=7, n_jobs=2, filename=fn )
+			self.assertTrue( np.array_equal( a, b ) )
+			self.assertTrue( np.array_equal( np.load( fn ), a ) )
+			self.assertTrue( np.array_equal( sa['mean'], sb['mean'] ) )
+			del b
+		finally:
+			shutil.rmtree( folder )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+from geostatsmodels import utilities
+from geostatsmodels import variograms
+import numpy as np
+
+cluster = os.path.join( os.path.dirname( __file__ ), '..', 'data', 'cluster.dat' )
+
+class GeoEASTestCases( unittest.TestCase ):
+	'''Tests for reading and writing GeoEAS files'''
+
+	def setUp( self ):
+		self.dir = tempfile.mkdtemp()
+		self.fn = os.path.join( self.dir, 'out.dat' )
+
+	def tearDown( self ):
+		shutil.rmtree( self.dir )
+
+	def test_read( self ):
+		'''
+		Does readGeoEAS() return the data and variable names,
+		and do the chunks of iterGeoEAS() add up to the data?
+		'''
+		data, columns = utilities.readGeoEAS( cluster, header=True )
+		self.assertEqual( data.shape, ( 140, 5 ) )
+		self.assertEqual( columns[:3], [ 'Xlocation', 'Ylocation', 'Primary' ] )
+		chunks = list( utilities.iterGeoEAS( cluster, chunksize=60 ) )
+		self.assertEqual( [ len( c ) for c in chunks ], [ 60, 60, 20 ] )
+		self.assertTrue( np.array_equal( np.vstack( chunks ), data ) )
+
+	def test_write( self ):
+		'''
+		Does writeGeoEAS() round trip, with missing values?
+		'''
+		data = np.array([ [ 1.5, 2.0 ], [ np.nan, 4.25 ], [ 5.0, -6.0 ] ])
+		utilities.writeGeoEAS( self.fn, data, [ 'a', 'b' ], 'title', missing=-999, chunksize=2 )
+		self.assertEqual( utilities.readGeoEASHeader( self.fn ), ( 'title', [ 'a', 'b' ] ) )
+		self.assertTrue( np.array_equal( utilities.readGeoEAS( self.fn )[1], [ -999, 4.25 ] ) )
+		self.assertTrue( np.array_equal( utilities.readGeoEAS( self.fn, missing=-999 ), data, equal_nan=True ) )
+
+	def test_cache( self ):
+		'''
+		Does the cache map a parsed file back, parse a
+		changed file again, and evict the oldest entries?
+		'''
+		cache = utilities.GeoEASCache( os.path.join( self.dir, 'cache' ), maxbytes=2**20 )
+		a = utilities.readGeoEAS( cluster, cache=cache )
+		b, columns = utilities.readGeoEAS( cluster, header=True, cache=cache )
+		self.assertEqual(( cache.hits, cache.misses ), ( 1, 1 ))
+		self.assertTrue( isinstance( b, np.memmap ) )
+		self.assertTrue( np.array_equal( b, utilities.readGeoEAS( cluster ) ) )
+		self.assertEqual( columns[0], 'Xlocation' )
+		data = np.arange( 6.0 ).reshape( 3, 2 )
+		utilities.writeGeoEAS( self.fn, data, [ 'a', 'b' ] )
+		self.assertTrue( np.array_equal( utilities.readGeoEAS( self.fn, cache=cache ), data ) )
+		utilities.writeGeoEAS( self.fn, 2 * data, [ 'a', 'b' ] )
+		os.utime( self.fn, ns=( 0, 10**9 ) )
+		self.assertTrue( np.array_equal( utilities.readGeoEAS( self.fn, cache=cache ), 2 * data ) )
+		self.assertEqual( cache.misses, 3 )
+		# other files in the directory are not the cache's to remove
+		other = os.path.join( cache.directory, 'source.dat' )
+		utilities.writeGeoEAS( other, data, [ 'a', 'b' ] )
+		os.mkdir( os.path.join( cache.directory, 'sub' ) )
+		cache.maxbytes = 1
+		cache.evict()
+		self.assertEqual( cache.nbytes(), 0 )
+		utilities.readGeoEAS( self.fn, cache=cache )
+		cache.maxbytes = 2**20
+		cache.evict()
+		self.assertTrue( cache.nbytes() > 0 )
+		cache.clear()
+		self.assertEqual( sorted( os.listdir( cache.directory ) ), [ 'source.dat', 'sub' ] )
+
+class DistanceTestCases( unittest.TestCase ):
+	'''Tests for the blocked and sparse pairwise distances'''
+
+	def setUp( self ):
+		rng = np.random.default_rng( 16 )
+		self.data = rng.uniform( 0, 100, ( 300, 3 ) )
+		self.D = utilities.pairwise( self.data )
+
+	def test_tiles( self ):
+		'''Do the tiles cover the upper triangle of the matrix?'''
+		D = np.zeros_like( self.D )
+		for rows, cols, tile in utilities.tiles( self.data, blocksize=64, dtype=np.float32 ):
+			self.assertEqual( tile.dtype, np.float32 )
+			D[ rows, cols ] = tile
+		iu = np.triu_indices( len( D ) )
+		self.assertTrue( np.allclose( D[iu], self.D[iu], rtol=1e-6 ) )
+		c = utilities.pairwise( self.data, condensed=True )
+		self.assertTrue( np.array_equal( c, self.D[ np.triu_indices( len( D ), 1 ) ] ) )
+
+	def test_pairlist( self ):
+		'''Does the pair list give the same lag indices as the matrix?'''
+		pairs = utilities.pairlist( self.data, 20.0 )
+		i, j = np.nonzero( np.triu( self.D <= 20.0, 1 ) )
+		self.assertTrue( np.array_equal( pairs[0], i ) )
+		self.assertTrue( np.array_equal( pairs[1], j ) )
+		self.assertTrue( np.allclose( pairs[2], self.D[ i, j ] ) )
+		a = variograms.lagindices( self.D, 10.0, 5.0 )
+		b = variograms.lagindices( pairs, 10.0, 5.0 )
+		self.assertTrue( np.array_equal( a, b ) )
+
+	def test_3d( self ):
+		'''Are the distances 3D with ndim=3, and is a 3D grid laid out in order?'''
+		D = utilities.pairwise( self.data, ndim=3 )
+		pairs = utilities.pairlist( self.data, 30.0, ndim=3 )
+		i, j = np.nonzero( np.triu( D <= 30.0, 1 ) )
+		self.assertTrue( np.array_equal( pairs[0], i ) and np.array_equal( pairs[1], j ) )
+		self.assertTrue( np.allclose( pairs[2], D[ i, j ] ) )
+		g = utilities.gridpoints( ( 0, 10, 20 ), ( 1, 2, 3 ), ( 4, 3, 2 ) )
+		self.assertEqual( g.shape, ( 24, 3 ) )
+		self.assertTrue( np.array_equal( g[7], [ 1, 10, 23 ] ) )
+		self.assertTrue( np.array_equal( utilities.gridpoints( ( 0, 10, 20 ), ( 1, 2, 3 ), ( 4, 3, 2 ), 5, 9 ), g[5:9] ) )
+
+if __name__ == '__main__':
+    unittest.main()
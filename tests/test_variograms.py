@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import unittest
+from geostatsmodels import variograms, utilities
+import numpy as np
+
+rng = np.random.RandomState( 318 )
+data = np.c_[ rng.uniform( 0, 100, ( 150, 2 ) ), rng.normal( 10, 3, 150 ) ]
+pwdist = utilities.pairwise( data )
+lags, tol = np.linspace( 5, 50, 10 ), 2.5
+
+class VariogramTestCases( unittest.TestCase ):
+	'''Tests for variograms.py'''
+
+	def test_pairblocks( self ):
+		'''
+		Does pairblocks() visit each close pair exactly once?
+		'''
+		i, j, d = [ np.concatenate( b ) for b in zip( *utilities.pairblocks( data, 20.0 ) ) ]
+		self.assertTrue( np.all( i < j ) )
+		self.assertTrue( np.allclose( d, pwdist[ i, j ] ) )
+		a, b = np.where( np.triu( pwdist <= 20.0, 1 ) )
+		self.assertEqual( set( zip( i, j ) ), set( zip( a, b ) ) )
+		self.assertEqual( len( i ), len( a ) )
+
+	def check( self, lags, tol ):
+		'''
+		Do the semivariogram and covariogram match the
+		values from the pairs found by lagindices()?
+		'''
+		index = [ variograms.lagindices( pwdist, lag, tol ) for lag in lags ]
+		sv = variograms.semivariogram( data, lags, tol )
+		cv = variograms.covariogram( data, lags, tol )
+		self.assertTrue( np.allclose( sv[0], lags ) )
+		self.assertTrue( np.allclose( sv[1], [ variograms.semivariance( data, i ) for i in index ] ) )
+		self.assertTrue( np.allclose( cv[1], [ variograms.covariance( data, i ) for i in index ] ) )
+		self.assertTrue( np.array_equal( variograms.lagsums( data, lags, tol )[0],
+		                                 [ len( i ) for i in index ] ) )
+		counted = variograms.semivariogram( data, lags, tol, counts=True )
+		self.assertTrue( np.array_equal( counted[:2], sv ) )
+		self.assertTrue( np.array_equal( counted[2], [ len( i ) for i in index ] ) )
+
+	def test_variogram( self ):
+		self.check( lags, tol )
+
+	def test_overlapping_lags( self ):
+		self.check( lags, 4.0 )
+
+	def test_3d( self ):
+		'''
+		Does a 3D semivariogram use the 3D distances, and the
+		variable in the fourth column?
+		'''
+		xyz = np.c_[ data[:,:2], rng.uniform( 0, 100, len( data ) ), data[:,2] ]
+		D = utilities.pairwise( xyz, ndim=3 )
+		sv = variograms.semivariogram( xyz, lags, tol, ndim=3 )
+		for lag, v in zip( *sv ):
+			index = variograms.lagindices( D, lag, tol )
+			self.assertTrue( abs( v - variograms.semivariance( xyz, index, ndim=3 ) ) < 1e-10 )
+
+class DirectionalTestCases( unittest.TestCase ):
+	'''Tests for directional semivariograms'''
+
+	def test_bearings( self ):
+		'''
+		Do the bearings of pairs run clockwise from North?
+		'''
+		pts = np.array([ [ 0, 0, 0 ], [ 0, 1, 0 ], [ 1, 0, 0 ], [ 0, -1, 0 ], [ -1, 0, 0 ] ])
+		brngs = utilities.bearings( pts, [ [ 0, 1 ], [ 0, 2 ], [ 0, 3 ], [ 0, 4 ] ] )
+		self.assertTrue( np.allclose( brngs, [ 0, 90, 180, 270 ] ) )
+		# bearing() agrees with them in every quadrant
+		for dx, dy in [ ( 1, 2 ), ( 1, -2 ), ( -1, -2 ), ( -1, 2 ), ( -1, 0 ), ( 0, -1 ) ]:
+			b = utilities.bearing( ( 0, 0 ), ( dx, dy ) )
+			self.assertAlmostEqual( b, utilities.azimuths( np.array([ dx ]), np.array([ dy ]) )[0] )
+		self.assertAlmostEqual( utilities.bearing( ( 0, 0 ), ( -1, -2 ) ), 206.56505117707798 )
+		self.assertTrue( np.array_equal( utilities.inangle( np.array([ 355, 25, 31 ]), 10, 20 ),
+		                                 [ True, True, False ] ) )
+
+	def test_directional( self ):
+		'''
+		Does the table of sectors and lags match the pairs
+		found by anilagindices(), for sectors that tile the
+		circle, leave gaps, or overlap, and for overlapping lags?
+		'''
+		for angles, atol, tol in [ ( [ 22.5 + 45 * i for i in range( 8 ) ], 22.5, 2.5 ),
+		                           ( [ 10, 100 ], 15, 2.5 ),
+		                           ( [ 0, 45, 90, 135 ], 30, 2.5 ),
+		                           ( [ 0, 60, 120 ], 30, 4.0 ) ]:
+			sv = variograms.directional( data, lags, tol, angles, atol )
+			self.assertEqual( sv.shape, ( len( angles ), 10 ) )
+			for s, angle in enumerate( angles ):
+				for l, lag in enumerate( lags ):
+					index = variograms.anilagindices( data, pwdist, lag, tol, angle, atol )
+					self.assertTrue( abs( sv[s,l] - variograms.semivariance( data, index ) ) < 1e-9 )
+
+if __name__ == '__main__':
+    unittest.main()
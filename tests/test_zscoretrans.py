@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+import unittest
+from geostatsmodels import zscoretrans
+import numpy as np
+import scipy.stats
+
+rng = np.random.RandomState( 318 )
+x = np.round( rng.lognormal( size=200 ), 2 )
+
+class NormalScoreTestCases( unittest.TestCase ):
+	'''Tests for zscoretrans.py'''
+
+	def test_cdf( self ):
+		'''
+		Is the cdf the fraction of the data below each value?
+		'''
+		f, finv = zscoretrans.cdf( x )
+		for u, p in f:
+			self.assertEqual( p, np.sum( x < u ) / float( len( x ) ) )
+		self.assertTrue( np.array_equal( finv, f[:,::-1] ) )
+
+	def test_to_norm( self ):
+		'''
+		Does to_norm() map each value through the cdf and the
+		normal ppf, without changing the data it was given?
+		'''
+		d = np.c_[ rng.uniform( size=( 200, 2 ) ), x ]
+		copy = d.copy()
+		z, inv = zscoretrans.to_norm( d )
+		self.assertTrue( np.array_equal( d, copy ) )
+		self.assertTrue( np.array_equal( z[:,:2], d[:,:2] ) )
+		p = np.array([ np.sum( x < u ) for u in x ]) / float( len( x ) )
+		ppf = scipy.stats.norm.ppf( p )
+		ppf[ np.isinf( ppf ) ] = ppf[ np.isfinite( ppf ) ].min()
+		self.assertTrue( np.allclose( z[:,2], ppf ) )
+
+	def test_transformer( self ):
+		'''
+		Does NormalScore agree with to_norm() and from_norm()
+		on whole arrays of any shape?
+		'''
+		z, inv = zscoretrans.to_norm( x )
+		ns = zscoretrans.NormalScore( x )
+		self.assertTrue( np.array_equal( ns.transform( x ), z ) )
+		g = rng.normal( size=( 10, 20 ) )
+		self.assertTrue( np.array_equal( ns.inverse_transform( g ), zscoretrans.from_norm( g, inv ) ) )
+		self.assertEqual( ns.inverse_transform( g ).shape, g.shape )
+		self.assertTrue( np.all( np.diff( ns.inverse_transform( np.sort( g.ravel() ) ) ) >= 0 ) )
+
+if __name__ == '__main__':
+    unittest.main()